@@ -1,4 +1,5 @@
-from .main import StableBeachDEMPlugin
-
 def classFactory(iface):
+    # Importado aqui para que os módulos do motor (engine, profile_engine, ...)
+    # possam ser usados sem QGIS
+    from .main import StableBeachDEMPlugin
     return StableBeachDEMPlugin(iface)
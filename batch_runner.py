@@ -0,0 +1,196 @@
+"""
+Command-line batch runner: regenerate the stable beach surface for many
+sites in a process pool, without QGIS.
+
+    python -m stable_beach_dem.batch_runner sites.json --workers 8
+
+The manifest is JSON, either a list of sites or {"defaults": {...},
+"sites": [...]}, or CSV with one site per row. Each site needs dem,
+line_a, line_b, slope and output; the other keys are optional:
+
+    name, distance_interval, fill_backend (numpy, gdal, analytic or empty),
+    mode, power, cells, distance, tile_memory_mb, bigtiff, sparse,
+    pair_field, per_pair_outputs, incremental, scenario_slopes,
+    scenario_offsets, geopackage, cog_compression (DEFLATE or ZSTD),
+    cog_threads (a count or ALL_CPUS)
+
+scenario_slopes and scenario_offsets are lists, or comma separated
+strings in CSV manifests.
+
+Relative paths are taken from the manifest folder. A summary with the
+outcome, wall time and stage timings of every site is written to
+<manifest>_summary.json (or --summary).
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from .engine import generate_dem
+from .run_report import RunReport, log
+from .scenarios import scenario_list
+
+
+REQUIRED_KEYS = ('dem', 'line_a', 'line_b', 'slope', 'output')
+PATH_KEYS = ('dem', 'line_a', 'line_b', 'output')
+
+# Options passed to engine.generate_dem, with the converter for CSV strings
+SITE_OPTIONS = {
+    'distance_interval': float,
+    'fill_backend': str,
+    'mode': str,
+    'power': float,
+    'cells': int,
+    'distance': float,
+    'tile_memory_mb': float,
+    'pair_field': str,
+    'cog_compression': str,
+    'cog_threads': str,
+}
+SITE_FLAGS = ('bigtiff', 'sparse', 'per_pair_outputs', 'incremental', 'geopackage')
+
+
+def _as_bool(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'y')
+    return bool(value)
+
+
+def load_manifest(path):
+    """List of site dicts with defaults applied and paths made absolute."""
+    base_dir = os.path.dirname(os.path.abspath(path))
+    defaults = {}
+    if path.lower().endswith('.csv'):
+        with open(path, newline='', encoding='utf-8') as f:
+            sites = [row for row in csv.DictReader(f)]
+    else:
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            defaults = data.get('defaults', {})
+            sites = data.get('sites', [])
+        else:
+            sites = data
+
+    result = []
+    for i, raw in enumerate(sites):
+        site = dict(defaults)
+        # Células vazias do CSV não substituem os valores por omissão
+        site.update({k: v for k, v in raw.items() if v not in (None, '')})
+        missing = [key for key in REQUIRED_KEYS if key not in site]
+        if missing:
+            raise ValueError(f"Site {i + 1} is missing {', '.join(missing)}")
+        for key in PATH_KEYS:
+            site[key] = os.path.normpath(os.path.join(base_dir, site[key]))
+        site.setdefault('name', os.path.splitext(os.path.basename(site['output']))[0])
+        result.append(site)
+    return result
+
+
+def run_site(site):
+    """
+    Run one site in the current process and return its summary. Never
+    raises, so one failing site does not stop the batch.
+    """
+    start = time.perf_counter()
+    report = RunReport().start()
+    try:
+        options = {key: convert(site[key]) for key, convert in SITE_OPTIONS.items() if key in site}
+        options.update({key: _as_bool(site[key]) for key in SITE_FLAGS if key in site})
+        if site.get('scenario_slopes'):
+            options['scenarios'] = scenario_list(site['scenario_slopes'], site.get('scenario_offsets'))
+        # Os sites já ocupam o pool; os pares de cada site correm em série
+        options['workers'] = 1
+        os.makedirs(os.path.dirname(site['output']) or '.', exist_ok=True)
+
+        success, message, outputs = generate_dem(
+            site['dem'], site['line_a'], site['line_b'], float(site['slope']), site['output'],
+            report=report, **options
+        )
+    except Exception as e:
+        success, message, outputs = False, f"Error: {str(e)}", {}
+        log.exception(f"Site {site['name']} failed")
+
+    report.finish()
+    try:
+        report.write(site['output'])
+    except Exception as e:
+        log.warning(f"Could not write run report for {site['name']}: {str(e)}")
+    return {
+        'name': site['name'],
+        'success': success,
+        'message': message,
+        'seconds': round(time.perf_counter() - start, 3),
+        'pid': os.getpid(),
+        'outputs': outputs,
+        'stages': report.stages,
+        'counters': report.counters,
+    }
+
+
+def run_batch(sites, workers=None, echo=print):
+    """
+    Run every site across a pool of worker processes (one per CPU by
+    default; workers=1 runs in this process). Each summary line is passed
+    to echo as its site finishes. Returns the site summaries in manifest
+    order.
+    """
+    if workers == 1:
+        summaries = []
+        for site in sites:
+            summaries.append(run_site(site))
+            echo(_summary_line(summaries[-1]))
+        return summaries
+
+    summaries = [None] * len(sites)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(run_site, site): i for i, site in enumerate(sites)}
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                summaries[i] = future.result()
+            except Exception as e:
+                # Worker process died (e.g. out of memory) before returning
+                summaries[i] = {'name': sites[i]['name'], 'success': False,
+                                'message': f"Worker failed: {str(e)}", 'seconds': None}
+            echo(_summary_line(summaries[i]))
+    return summaries
+
+
+def _summary_line(summary):
+    status = 'ok' if summary['success'] else 'FAILED'
+    seconds = summary.get('seconds')
+    timing = f"{seconds:8.1f} s" if seconds is not None else '       - s'
+    return f"{status:>6} {timing}  {summary['name']}: {summary['message']}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate stable beach DEMs for every site of a manifest.")
+    parser.add_argument('manifest', help="JSON or CSV manifest of sites")
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help="worker processes (default: one per CPU)")
+    parser.add_argument('--summary', default=None,
+                        help="summary JSON path (default: <manifest>_summary.json)")
+    args = parser.parse_args(argv)
+
+    sites = load_manifest(args.manifest)
+    print(f"Running {len(sites)} sites with {args.workers or os.cpu_count()} workers")
+    start = time.perf_counter()
+    summaries = run_batch(sites, workers=args.workers)
+    total = time.perf_counter() - start
+
+    summary_path = args.summary or f"{os.path.splitext(args.manifest)[0]}_summary.json"
+    with open(summary_path, 'w', encoding='utf-8') as f:
+        json.dump({'total_seconds': round(total, 3), 'workers': args.workers or os.cpu_count(),
+                   'sites': summaries}, f, indent=2, default=str)
+
+    failed = sum(1 for s in summaries if not s['success'])
+    print(f"{len(sites) - failed} of {len(sites)} sites done in {total:.1f} s; summary: {summary_path}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,215 @@
+"""
+Bulk elevation sampling from a DEM through GDAL.
+
+DemWindowSampler reads the DEM window under a bounding box once;
+DemBlockSampler reads only the fixed-size blocks the points fall in and
+keeps a bounded number of them, so its memory does not grow with the site.
+The samplers never touch a QGIS data provider, so they can be used from the
+DEM generation worker thread.
+"""
+import math
+from collections import OrderedDict
+
+import numpy as np
+from osgeo import gdal
+
+
+# Side, in pixels, of the blocks read by DemBlockSampler
+SAMPLER_BLOCK_SIZE = 256
+
+
+class _Sampler:
+    """
+    Nearest and bilinear sampling over a north-up pixel grid; subclasses
+    give the grid origin and pixel sizes and _take(rows, cols).
+    """
+
+    def sample(self, xs, ys, method='nearest'):
+        """
+        Elevation at each (x, y). method is 'nearest', which returns the value
+        of the pixel containing the point like QgsRasterDataProvider.identify,
+        or 'bilinear', which interpolates between pixel centres and ignores
+        NoData neighbours.
+        """
+        xs = np.atleast_1d(np.asarray(xs, dtype=np.float64))
+        ys = np.atleast_1d(np.asarray(ys, dtype=np.float64))
+        col_f = (xs - self.origin_x) / self.pixel_size_x
+        row_f = (self.origin_y - ys) / self.pixel_size_y
+
+        if method == 'nearest':
+            return self._take(np.floor(row_f).astype(np.int64), np.floor(col_f).astype(np.int64))
+        if method == 'bilinear':
+            return self._bilinear(row_f - 0.5, col_f - 0.5)
+        raise ValueError(f"Unknown sampling method: {method}")
+
+    def _bilinear(self, row_f, col_f):
+        r0 = np.floor(row_f).astype(np.int64)
+        c0 = np.floor(col_f).astype(np.int64)
+        fr = row_f - r0
+        fc = col_f - c0
+
+        total = np.zeros(row_f.shape, dtype=np.float64)
+        weight = np.zeros(row_f.shape, dtype=np.float64)
+        for dr, dc, w in ((0, 0, (1 - fr) * (1 - fc)), (0, 1, (1 - fr) * fc),
+                          (1, 0, fr * (1 - fc)), (1, 1, fr * fc)):
+            v = self._take(r0 + dr, c0 + dc)
+            valid = ~np.isnan(v) & (w > 0)
+            total[valid] += v[valid] * w[valid]
+            weight[valid] += w[valid]
+
+        values = np.full(row_f.shape, np.nan, dtype=np.float64)
+        has_weight = weight > 0
+        values[has_weight] = total[has_weight] / weight[has_weight]
+        return values
+
+
+class DemWindowSampler(_Sampler):
+    """
+    Holds the part of a DEM covering a bounding box in memory and samples
+    elevations for many points at once.
+
+    Points outside the window or on NoData cells get NaN.
+    """
+
+    def __init__(self, dem_path, extent=None, band=1, no_data=None, margin=2):
+        """
+        dem_path: any raster GDAL can open
+        extent: (xmin, ymin, xmax, ymax) in the DEM CRS; whole raster if None
+        no_data: used when the band itself has no NoData value
+        margin: extra pixels read around extent so bilinear sampling on the
+                window edge still sees its neighbours
+        """
+        ds = gdal.Open(dem_path, gdal.GA_ReadOnly)
+        if ds is None:
+            raise IOError(f"Could not open DEM with GDAL: {dem_path}")
+
+        gt = ds.GetGeoTransform()
+        if gt[2] != 0 or gt[4] != 0:
+            raise ValueError("Rotated DEM geotransforms are not supported")
+
+        self.pixel_size_x = gt[1]
+        self.pixel_size_y = -gt[5]
+        self.raster_x_size = ds.RasterXSize
+        self.raster_y_size = ds.RasterYSize
+        self.projection = ds.GetProjection()
+
+        rb = ds.GetRasterBand(band)
+        band_no_data = rb.GetNoDataValue()
+        self.no_data = band_no_data if band_no_data is not None else no_data
+
+        if extent is None:
+            xoff, yoff = 0, 0
+            xsize, ysize = ds.RasterXSize, ds.RasterYSize
+        else:
+            xmin, ymin, xmax, ymax = extent
+            col0 = int(math.floor((xmin - gt[0]) / gt[1])) - margin
+            col1 = int(math.floor((xmax - gt[0]) / gt[1])) + margin + 1
+            row0 = int(math.floor((gt[3] - ymax) / self.pixel_size_y)) - margin
+            row1 = int(math.floor((gt[3] - ymin) / self.pixel_size_y)) + margin + 1
+            xoff, yoff = max(col0, 0), max(row0, 0)
+            xsize = min(col1, ds.RasterXSize) - xoff
+            ysize = min(row1, ds.RasterYSize) - yoff
+
+        if xsize > 0 and ysize > 0:
+            data = rb.ReadAsArray(xoff, yoff, xsize, ysize).astype(np.float64)
+        else:
+            data = np.empty((0, 0), dtype=np.float64)
+        ds = None
+
+        # NoData becomes NaN so that masks and bilinear weights are simple
+        if self.no_data is not None:
+            data[data == self.no_data] = np.nan
+        self.data = data
+
+        # Geotransform of the window
+        self.origin_x = gt[0] + xoff * gt[1]
+        self.origin_y = gt[3] + yoff * gt[5]
+
+    def _take(self, rows, cols):
+        values = np.full(rows.shape, np.nan, dtype=np.float64)
+        height, width = self.data.shape
+        inside = (rows >= 0) & (rows < height) & (cols >= 0) & (cols < width)
+        values[inside] = self.data[rows[inside], cols[inside]]
+        return values
+
+
+class DemBlockSampler(_Sampler):
+    """
+    Samples a DEM by reading only the SAMPLER_BLOCK_SIZE blocks the points
+    fall in, keeping at most cache_blocks of them (least recently used
+    first out). Same interface as DemWindowSampler; memory stays within
+    cache_blocks blocks whatever the extent of the points.
+    """
+
+    def __init__(self, dem_path, band=1, no_data=None, cache_blocks=16, block_size=SAMPLER_BLOCK_SIZE):
+        self.ds = gdal.Open(dem_path, gdal.GA_ReadOnly)
+        if self.ds is None:
+            raise IOError(f"Could not open DEM with GDAL: {dem_path}")
+        gt = self.ds.GetGeoTransform()
+        if gt[2] != 0 or gt[4] != 0:
+            raise ValueError("Rotated DEM geotransforms are not supported")
+
+        self.origin_x, self.origin_y = gt[0], gt[3]
+        self.pixel_size_x = gt[1]
+        self.pixel_size_y = -gt[5]
+        self.raster_x_size = self.ds.RasterXSize
+        self.raster_y_size = self.ds.RasterYSize
+        self.projection = self.ds.GetProjection()
+
+        self.band = self.ds.GetRasterBand(band)
+        band_no_data = self.band.GetNoDataValue()
+        self.no_data = band_no_data if band_no_data is not None else no_data
+        self.block_size = block_size
+        self.cache_blocks = max(int(cache_blocks), 1)
+        self._blocks = OrderedDict()
+
+    @classmethod
+    def for_budget(cls, dem_path, memory_mb, no_data=None, block_size=SAMPLER_BLOCK_SIZE):
+        """Sampler whose block cache fits in memory_mb (at least 4 blocks)."""
+        block_bytes = block_size * block_size * 8
+        cache_blocks = max(int(memory_mb * 1024 * 1024 // block_bytes), 4)
+        return cls(dem_path, no_data=no_data, cache_blocks=cache_blocks, block_size=block_size)
+
+    def _block(self, block_row, block_col):
+        key = (block_row, block_col)
+        data = self._blocks.get(key)
+        if data is not None:
+            self._blocks.move_to_end(key)
+            return data
+        row0, col0 = block_row * self.block_size, block_col * self.block_size
+        height = min(self.block_size, self.raster_y_size - row0)
+        width = min(self.block_size, self.raster_x_size - col0)
+        data = self.band.ReadAsArray(col0, row0, width, height).astype(np.float64)
+        if self.no_data is not None:
+            data[data == self.no_data] = np.nan
+        self._blocks[key] = data
+        if len(self._blocks) > self.cache_blocks:
+            self._blocks.popitem(last=False)
+        return data
+
+    def _take(self, rows, cols):
+        values = np.full(rows.shape, np.nan, dtype=np.float64)
+        inside = (rows >= 0) & (rows < self.raster_y_size) & (cols >= 0) & (cols < self.raster_x_size)
+        index = np.flatnonzero(inside)
+        if index.size == 0:
+            return values
+        block_rows = rows[index] // self.block_size
+        block_cols = cols[index] // self.block_size
+        # Pontos agrupados por bloco, cada bloco lido uma só vez por chamada
+        keys = block_rows * (self.raster_x_size // self.block_size + 1) + block_cols
+        order = np.argsort(keys, kind='stable')
+        starts = np.flatnonzero(np.r_[True, keys[order][1:] != keys[order][:-1]])
+        ends = np.r_[starts[1:], order.size]
+        for start, end in zip(starts, ends):
+            group = order[start:end]
+            block_row, block_col = int(block_rows[group[0]]), int(block_cols[group[0]])
+            data = self._block(block_row, block_col)
+            points = index[group]
+            values[points] = data[rows[points] - block_row * self.block_size,
+                                  cols[points] - block_col * self.block_size]
+        return values
+
+    def close(self):
+        self._blocks.clear()
+        self.band = None
+        self.ds = None
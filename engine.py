@@ -0,0 +1,1183 @@
+"""
+QGIS-independent core of the stable beach DEM generator.
+
+Everything here works on plain coordinate arrays and file paths with NumPy
+and GDAL/OGR only, so it can be imported from a plain Python interpreter or
+a worker process without starting QGIS. generate_dem.py adapts QGIS layers
+to these functions and loads the results into the project.
+
+Headless use, with the folder containing the plugin on sys.path and the
+plugin folder named as a Python package (see the README):
+
+    from stable_beach_dem.engine import generate_dem
+    ok, message, outputs = generate_dem('dem.tif', 'line_a.shp', 'line_b.shp', 5.0, 'out.tif')
+"""
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+from functools import partial
+
+import numpy as np
+from osgeo import gdal, ogr
+
+from .dem_sampler import DemBlockSampler, DemWindowSampler
+from .gap_fill import fill_raster_gdal, fill_raster_numpy
+from .geopackage import SQLITE_SIDECARS, create_vector_layer, layer_path, pack_rasters, reset_container
+from .incremental import (compare_state, load_state, refill_surface, save_state, state_records,
+                          update_analytic_surface, update_raster, write_provenance)
+from .profile_engine import (LineSegmentIndex, interpolate_line_by_distance, iter_profile_cells,
+                             profile_cell_bounds, profile_step_counts, profile_step_vectors,
+                             rasterize_profiles)
+from .profile_records import ProfileRecords
+from .raster_io import (SparseTileRaster, TiledGeoTiffWriter, clip_to_mask, tile_layout_for_budget, write_cog,
+                        write_geotiff)
+from .run_report import PROGRESS_INTERVAL, RunCancelled, RunReport, log
+from .scenarios import write_scenarios
+from .surface_model import joined_quads, quad_cell_bounds, quads_in_window, render_envelope_surface
+
+
+DEFAULT_NO_DATA = -9999.0
+
+
+def read_line_parts(path, feature_index=0):
+    """
+    Vertex coordinates of each part of one line feature of an OGR dataset,
+    as a list of (xs, ys).
+    """
+    features = read_line_features(path)
+    if feature_index >= len(features):
+        raise ValueError(f"No feature {feature_index} in {path}")
+    return features[feature_index][1]
+
+
+def read_line_features(path, key_field=None):
+    """
+    Every line feature of an OGR dataset as a list of (key, parts), where
+    key is the value of key_field (the feature id without one) and parts
+    the (xs, ys) vertex lists of each part. Features without geometry are
+    skipped.
+    """
+    ds = ogr.Open(path)
+    if ds is None:
+        raise IOError(f"Could not open vector file: {path}")
+    features = []
+    for feature in ds.GetLayer(0):
+        geometry = feature.GetGeometryRef()
+        if geometry is None:
+            continue
+        if geometry.GetGeometryCount() > 0:
+            lines = [geometry.GetGeometryRef(i) for i in range(geometry.GetGeometryCount())]
+        else:
+            lines = [geometry]
+        parts = []
+        for line in lines:
+            points = line.GetPoints() or []
+            parts.append(([p[0] for p in points], [p[1] for p in points]))
+        key = feature.GetField(key_field) if key_field else feature.GetFID()
+        features.append((key, parts))
+    ds = None
+    return features
+
+
+# Line A vertices used to measure how close a Line B feature is
+PAIRING_SAMPLE_VERTICES = 64
+
+
+def pair_line_features(features_a, features_b, by_key=False):
+    """
+    (index_a, index_b) of the Line B feature that goes with each Line A
+    feature, in Line A order. features_* are (key, parts) lists as returned
+    by read_line_features.
+
+    by_key: pair features with equal keys; Line A features without a match
+    are skipped. Otherwise each Line A feature takes the Line B feature with
+    the smallest mean distance from its vertices.
+    """
+    pairs = []
+    if by_key:
+        b_index = {}
+        for j, (key, _) in enumerate(features_b):
+            b_index.setdefault(key, j)
+        for i, (key, _) in enumerate(features_a):
+            if key in b_index:
+                pairs.append((i, b_index[key]))
+            else:
+                log.warning(f"No Line B feature with key {key!r}, skipping it")
+        return pairs
+
+    if not features_b:
+        return pairs
+    b_indexes = [LineSegmentIndex(parts) for _, parts in features_b]
+    for i, (_, parts) in enumerate(features_a):
+        xs = np.concatenate([np.asarray(x, dtype=np.float64) for x, _ in parts])
+        ys = np.concatenate([np.asarray(y, dtype=np.float64) for _, y in parts])
+        if xs.size == 0:
+            continue
+        step = max(xs.size // PAIRING_SAMPLE_VERTICES, 1)
+        xs, ys = xs[::step], ys[::step]
+        distances = [float(np.mean(index.nearest(xs, ys)[2])) for index in b_indexes]
+        pairs.append((i, int(np.argmin(distances))))
+    return pairs
+
+
+def lines_extent(*part_lists):
+    """(xmin, ymin, xmax, ymax) of the vertices of every part given."""
+    xs = np.concatenate([np.asarray(x, dtype=np.float64) for parts in part_lists for x, _ in parts])
+    ys = np.concatenate([np.asarray(y, dtype=np.float64) for parts in part_lists for _, y in parts])
+    return float(xs.min()), float(ys.min()), float(xs.max()), float(ys.max())
+
+
+def dem_grid_info(dem_path, band=1):
+    """(pixel_size_x, pixel_size_y, no_data, projection_wkt) of a DEM file."""
+    ds = gdal.Open(dem_path, gdal.GA_ReadOnly)
+    if ds is None:
+        raise IOError(f"Could not open DEM with GDAL: {dem_path}")
+    gt = ds.GetGeoTransform()
+    no_data = ds.GetRasterBand(band).GetNoDataValue() or DEFAULT_NO_DATA
+    projection = ds.GetProjection()
+    ds = None
+    return gt[1], -gt[5], no_data, projection
+
+
+def profile_start_points(parts, interval=None):
+    """
+    Profile start points along Line A, either at its vertices (interval None
+    or <= 0) or every `interval` map units. Returns (xs, ys, part_ids)
+    arrays; part_ids is the index of the line part each point comes from.
+    """
+    xs, ys, part_ids = [], [], []
+    for part_id, (line_x, line_y) in enumerate(parts):
+        if interval is None or interval <= 0:
+            px = np.asarray(line_x, dtype=np.float64)
+            py = np.asarray(line_y, dtype=np.float64)
+        else:
+            px, py = interpolate_line_by_distance(line_x, line_y, interval)
+        xs.append(px)
+        ys.append(py)
+        part_ids.append(np.full(px.size, part_id, dtype=np.int64))
+    if not xs:
+        return np.empty(0), np.empty(0), np.empty(0, dtype=np.int64)
+    return np.concatenate(xs), np.concatenate(ys), np.concatenate(part_ids)
+
+
+class StableBeachProfiles:
+    """
+    The profiles from Line A to Line B and the raster grid they are burned
+    into, computed once from the line geometry and the DEM.
+
+    dem_sampler: any object with sample(xs, ys) returning elevations with
+    NaN where the DEM has no value (e.g. DemWindowSampler).
+
+    Attributes: records (ProfileRecords), geotransform, rows, cols,
+    start_rows, start_cols, row_steps, col_steps, n_steps, elevation_step,
+    tan_slope, no_data and profile_point_count.
+    """
+
+    def __init__(self, line_a_parts, line_b_parts, dem_sampler, slope, pixel_size_x, pixel_size_y,
+                 no_data=DEFAULT_NO_DATA, distance_interval=None, extent=None):
+        """
+        extent: (xmin, ymin, xmax, ymax) of the raster grid; the extent of
+        both lines when None. Profiles of several feature pairs computed on
+        the same extent can be merged.
+        """
+        self.no_data = no_data
+        self.slope = slope
+
+        xs, ys, part_ids = profile_start_points(line_a_parts, distance_interval)
+        self.profile_point_count = xs.size
+        log.info(f"Generated {xs.size} profile points")
+
+        # Compute extent and dimensions
+        if extent is None:
+            extent = lines_extent(line_a_parts, line_b_parts)
+        xmin, ymin, xmax, ymax = extent
+        self.extent = tuple(extent)
+        self.cols = max(int((xmax - xmin) / pixel_size_x), 1)
+        self.rows = max(int((ymax - ymin) / pixel_size_y), 1)
+        self.geotransform = [xmin, pixel_size_x, 0, ymax, 0, -pixel_size_y]
+
+        self.tan_slope = math.tan(math.radians(slope))
+        step_size = math.sqrt(pixel_size_x**2 + pixel_size_y**2)
+        self.elevation_step = self.tan_slope * step_size
+        max_steps = int(math.sqrt(self.cols**2 + self.rows**2))
+
+        # Keep only the profiles whose start has a valid elevation
+        start_z = np.asarray(dem_sampler.sample(xs, ys), dtype=np.float64)
+        valid = ~np.isnan(start_z) & (start_z != no_data)
+        for x, y in zip(xs[~valid], ys[~valid]):
+            log.debug(f"Skipping profile at ({x}, {y}): no start elevation")
+        self.start_sampling_misses = int(np.count_nonzero(~valid))
+        if not valid.all():
+            log.warning(f"No valid elevation at {self.start_sampling_misses} of {xs.size} points")
+        start_x, start_y = xs[valid], ys[valid]
+        start_z = start_z[valid]
+        start_parts = part_ids[valid]
+
+        # Convert to raster coordinates
+        self.start_cols = ((start_x - xmin) / pixel_size_x).astype(np.int64)
+        self.start_rows = ((ymax - start_y) / pixel_size_y).astype(np.int64)
+
+        # Find closest point on Line B for every profile in one query
+        if start_x.size:
+            end_x, end_y, _ = LineSegmentIndex(line_b_parts).nearest(start_x, start_y)
+        else:
+            end_x, end_y = np.empty(0), np.empty(0)
+
+        # Profile length in steps, from the start pixel corner to Line B
+        self.n_steps = profile_step_counts(
+            xmin + self.start_cols * pixel_size_x,
+            ymax - self.start_rows * pixel_size_y,
+            start_x, start_y, end_x, end_y,
+            step_size, pixel_size_x, max_steps
+        )
+        self.row_steps, self.col_steps = profile_step_vectors(
+            start_x, start_y, end_x, end_y,
+            step_size, pixel_size_x, pixel_size_y
+        )
+
+        end_z = np.asarray(dem_sampler.sample(end_x, end_y), dtype=np.float64)
+        self.end_sampling_misses = int(np.count_nonzero(np.isnan(end_z)))
+        self.records = ProfileRecords.build(
+            start_x, start_y, end_x, end_y, start_z, end_z,
+            slope=slope, part_id=start_parts, no_data=no_data
+        )
+
+    @classmethod
+    def merge(cls, profiles_list):
+        """
+        Profiles of several feature pairs computed on the same grid, as one
+        set in list order. Rasterizing the merged set gives the first pair
+        that reaches a cell its value, as within a single pair.
+        """
+        first = profiles_list[0]
+        merged = cls.__new__(cls)
+        for name in ('no_data', 'slope', 'extent', 'cols', 'rows', 'geotransform', 'tan_slope',
+                     'elevation_step'):
+            setattr(merged, name, getattr(first, name))
+        for name in ('start_rows', 'start_cols', 'n_steps', 'row_steps', 'col_steps'):
+            setattr(merged, name, np.concatenate([getattr(p, name) for p in profiles_list]))
+        for name in ('profile_point_count', 'start_sampling_misses', 'end_sampling_misses'):
+            setattr(merged, name, sum(getattr(p, name) for p in profiles_list))
+        merged.records = ProfileRecords.concatenate([p.records for p in profiles_list])
+        return merged
+
+    def count_into(self, report):
+        """Add the profile counters of this set to a RunReport."""
+        report.count('profile_points', self.profile_point_count)
+        report.count('profiles', len(self.records))
+        report.count('steps', int(self.n_steps.sum()))
+        report.count('raster_cells', self.rows * self.cols)
+        report.count('sampling_misses', self.start_sampling_misses + self.end_sampling_misses)
+
+    @property
+    def part_breaks(self):
+        """True at i when profiles i and i + 1 start on different Line A parts."""
+        return self.records.part_id[1:] != self.records.part_id[:-1]
+
+    def write_raster(self, output_path, projection, tile_memory_mb=None, bigtiff=False, sparse=False,
+                     report=None):
+        """
+        Burn the profiles into output_path. See write_profiles_tiled and
+        write_profiles_sparse for the tiled and sparse layouts; otherwise the
+        whole raster is built in memory. Returns the number of cells written.
+        """
+        report = report or RunReport()
+        progress = partial(report.progress, unit='profiles')
+        args = (self.start_rows, self.start_cols, self.row_steps, self.col_steps,
+                self.records.ini_elev, self.elevation_step, self.n_steps)
+        if tile_memory_mb:
+            with report.stage('rasterize_and_write'):
+                cells_written = write_profiles_tiled(
+                    output_path, self.cols, self.rows, self.geotransform, projection, self.no_data,
+                    *args, tile_memory_mb, bigtiff, sparse,
+                    progress=partial(report.progress, unit='tiles')
+                )
+        elif sparse:
+            with report.stage('rasterize_and_write'):
+                cells_written = write_profiles_sparse(
+                    output_path, self.cols, self.rows, self.geotransform, projection, self.no_data,
+                    *args, bigtiff, progress=progress
+                )
+        else:
+            with report.stage('rasterize'):
+                result_array = np.full((self.rows, self.cols), self.no_data, dtype=np.float32)
+                cells_written = rasterize_profiles(result_array, *args, self.no_data, progress=progress)
+
+            # Save the DEM raster
+            with report.stage('write_geotiff'):
+                driver = gdal.GetDriverByName('GTiff')
+                out_raster = driver.Create(output_path, self.cols, self.rows, 1, gdal.GDT_Float32)
+                out_raster.SetGeoTransform(self.geotransform)
+                out_raster.SetProjection(projection)
+                out_band = out_raster.GetRasterBand(1)
+                out_band.SetNoDataValue(self.no_data)
+                out_band.WriteArray(result_array)
+                out_band.FlushCache()
+                out_raster = None
+                result_array = None
+        report.count('cells_written', cells_written)
+        log.info(f"Rasterized {len(self.records)} profiles into {cells_written} cells")
+        return cells_written
+
+    def write_surface(self, output_path, projection, tile_memory_mb=None, bigtiff=False, sparse=False,
+                      report=None):
+        """Write the analytic inter-profile surface; returns the cells written."""
+        report = report or RunReport()
+        records = self.records
+        with report.stage('analytic_surface'):
+            surface_cells = write_analytic_surface(
+                output_path, self.cols, self.rows, self.geotransform, projection, self.no_data,
+                records.start_x, records.start_y, records.end_x, records.end_y, records.ini_elev,
+                self.tan_slope, self.part_breaks, tile_memory_mb, bigtiff, sparse,
+                progress=partial(report.progress, unit='tiles')
+            )
+        report.count('surface_cells_written', surface_cells)
+        log.info(f"Analytic surface written to {output_path} ({surface_cells} cells)")
+        return surface_cells
+
+
+def write_profiles_tiled(output_path, cols, rows, geotransform, projection, no_data,
+                         start_rows, start_cols, row_steps, col_steps, elevations,
+                         elevation_step, n_steps, memory_budget_mb, bigtiff=False, sparse=False,
+                         progress=None):
+    """
+    Rasterize the profiles straight into a tiled GeoTIFF, one tile at a time.
+    Each tile only receives the profiles whose footprint touches it, and is
+    written and released before the next one is allocated. Tiles no profile
+    touches are never allocated; with sparse, NoData-only blocks are not
+    stored in the file either.
+
+    progress: optional callable(tiles_done, total_tiles), called per tile.
+    """
+    tile_size, chunk_samples = tile_layout_for_budget(memory_budget_mb)
+    log.info(f"Tiled output: {tile_size}x{tile_size} tiles, {chunk_samples} samples per batch")
+
+    row_min, row_max, col_min, col_max = profile_cell_bounds(
+        start_rows, start_cols, row_steps, col_steps, n_steps
+    )
+    cells_written = 0
+    with TiledGeoTiffWriter(output_path, cols, rows, geotransform, projection, no_data,
+                            tile_size=tile_size, bigtiff=bigtiff, sparse=sparse) as writer:
+        tiles = list(writer.tiles())
+        for k, (row_off, col_off, height, width) in enumerate(tiles):
+            if progress is not None:
+                progress(k, len(tiles))
+            touching = ((row_max >= row_off) & (row_min < row_off + height) &
+                        (col_max >= col_off) & (col_min < col_off + width) &
+                        (n_steps > 0))
+            if not touching.any():
+                # GDAL fills unwritten blocks with NoData
+                continue
+            tile = np.full((height, width), no_data, dtype=np.float32)
+            cells_written += rasterize_profiles(
+                tile, start_rows[touching], start_cols[touching],
+                row_steps[touching], col_steps[touching], elevations[touching],
+                elevation_step, n_steps[touching], no_data,
+                chunk_samples=chunk_samples, window=(row_off, col_off, rows, cols)
+            )
+            writer.write_tile(tile, row_off, col_off)
+    if progress is not None:
+        progress(len(tiles), len(tiles))
+    return cells_written
+
+
+def write_profiles_sparse(output_path, cols, rows, geotransform, projection, no_data,
+                          start_rows, start_cols, row_steps, col_steps, elevations,
+                          elevation_step, n_steps, bigtiff=False, progress=None):
+    """
+    Rasterize the profiles into a SparseTileRaster, which only allocates the
+    blocks the profiles touch, and write it as a sparse tiled GeoTIFF.
+    progress is passed on to iter_profile_cells.
+    """
+    accumulator = SparseTileRaster(rows, cols, no_data)
+    cells_written = 0
+    for r, c, z in iter_profile_cells(start_rows, start_cols, row_steps, col_steps,
+                                      elevations, elevation_step, n_steps, (rows, cols),
+                                      progress=progress):
+        cells_written += accumulator.write_first(r, c, z)
+
+    total_blocks = math.ceil(rows / accumulator.block_size) * math.ceil(cols / accumulator.block_size)
+    log.info(f"Sparse output: {len(accumulator.blocks)} of {total_blocks} blocks allocated "
+             f"({accumulator.nbytes / 1024 / 1024:.1f} MB)")
+    accumulator.write_geotiff(output_path, geotransform, projection, bigtiff=bigtiff)
+    return cells_written
+
+
+def write_analytic_surface(output_path, cols, rows, geotransform, projection, no_data,
+                           start_x, start_y, end_x, end_y, start_z, tan_slope, breaks,
+                           tile_memory_mb=None, bigtiff=False, sparse=False, progress=None):
+    """
+    Write the analytic inter-profile surface (see surface_model) on the same
+    grid as the raw DEM. With tile_memory_mb set it is rendered and written
+    one tile at a time, calling progress(tiles_done, total_tiles) per tile.
+    """
+    if not tile_memory_mb:
+        surface = np.full((rows, cols), no_data, dtype=np.float32)
+        cells_written = render_envelope_surface(
+            surface, geotransform, start_x, start_y, end_x, end_y,
+            start_z, tan_slope, no_data, breaks=breaks
+        )
+        write_geotiff(output_path, surface, geotransform, projection, no_data,
+                      bigtiff=bigtiff, sparse=sparse)
+        return cells_written
+
+    tile_size, _ = tile_layout_for_budget(tile_memory_mb)
+    # Limites de cada quadrilátero calculados uma vez; cada tile só recebe os que o tocam
+    quads = joined_quads(len(start_x), breaks)
+    bounds = quad_cell_bounds(start_x, start_y, end_x, end_y, quads, geotransform)
+    cells_written = 0
+    with TiledGeoTiffWriter(output_path, cols, rows, geotransform, projection, no_data,
+                            tile_size=tile_size, bigtiff=bigtiff, sparse=sparse) as writer:
+        tiles = list(writer.tiles())
+        for k, (row_off, col_off, height, width) in enumerate(tiles):
+            if progress is not None:
+                progress(k, len(tiles))
+            reaching = quads_in_window(quads, bounds, (row_off, col_off, height, width))
+            if reaching.size == 0:
+                continue
+            tile = np.full((height, width), no_data, dtype=np.float32)
+            tile_geotransform = [
+                geotransform[0] + col_off * geotransform[1], geotransform[1], 0,
+                geotransform[3] + row_off * geotransform[5], 0, geotransform[5]
+            ]
+            written = render_envelope_surface(
+                tile, tile_geotransform, start_x, start_y, end_x, end_y,
+                start_z, tan_slope, no_data, quads=reaching
+            )
+            if written:
+                writer.write_tile(tile, row_off, col_off)
+                cells_written += written
+    if progress is not None:
+        progress(len(tiles), len(tiles))
+    return cells_written
+
+
+def write_profile_lines(path, records, projection):
+    """
+    Profile lines with ProfNumb, ProfileAz, IniElev, FinElev and Dist_profile.
+    Zero-length profiles are skipped. Returns the number of lines written.
+    """
+    ds, layer = create_vector_layer(path, ogr.wkbLineString, [
+        ('ProfNumb', ogr.OFTInteger, 0, 0),
+        ('ProfileAz', ogr.OFTReal, 10, 3),
+        ('IniElev', ogr.OFTReal, 10, 3),
+        ('FinElev', ogr.OFTReal, 10, 3),
+        ('Dist_profile', ogr.OFTReal, 10, 3),
+    ], projection)
+
+    # Perfis de comprimento nulo não formam uma linha válida
+    degenerate = records.length == 0
+    if degenerate.any():
+        log.warning(f"Skipping {int(degenerate.sum())} zero-length profiles")
+
+    defn = layer.GetLayerDefn()
+    written = 0
+    layer.StartTransaction()
+    for i in np.flatnonzero(~degenerate):
+        feat = ogr.Feature(defn)
+        _set_profile_line(feat, records, i)
+        layer.CreateFeature(feat)
+        written += 1
+    layer.CommitTransaction()
+    ds = None
+    return written
+
+
+def _set_profile_line(feat, records, i):
+    line = ogr.Geometry(ogr.wkbLineString)
+    line.AddPoint_2D(float(records.start_x[i]), float(records.start_y[i]))
+    line.AddPoint_2D(float(records.end_x[i]), float(records.end_y[i]))
+    feat.SetGeometry(line)
+    feat.SetField(0, int(i) + 1)
+    feat.SetField(1, float(round(records.azimuth[i], 3)))
+    feat.SetField(2, float(round(records.ini_elev[i], 3)))
+    feat.SetField(3, float(round(records.fin_elev[i], 3)))
+    feat.SetField(4, float(round(records.length[i], 3)))
+
+
+def write_profile_points(path, records, projection):
+    """
+    Start and end point of every profile, chained in the mask polygon order
+    (vertex_ind). Returns the number of points written.
+    """
+    ds, layer = create_vector_layer(path, ogr.wkbPoint, [
+        ('ProfNumb', ogr.OFTInteger, 0, 0),
+        ('PointType', ogr.OFTString, 0, 0),
+        ('Elevation', ogr.OFTReal, 10, 3),
+        ('X', ogr.OFTReal, 10, 3),
+        ('Y', ogr.OFTReal, 10, 3),
+        ('vertex_ind', ogr.OFTInteger, 0, 0),
+    ], projection)
+
+    # Pontos iniciais (Y crescente) seguidos dos pontos finais (Y decrescente)
+    index, is_end = records.boundary_order()
+
+    defn = layer.GetLayerDefn()
+    layer.StartTransaction()
+    for position in range(index.size):
+        feat = ogr.Feature(defn)
+        _set_profile_point(feat, records, index, is_end, position)
+        layer.CreateFeature(feat)
+    layer.CommitTransaction()
+    ds = None
+    return len(index)
+
+
+def _set_profile_point(feat, records, index, is_end, position):
+    i, end = index[position], is_end[position]
+    x = float(records.end_x[i] if end else records.start_x[i])
+    y = float(records.end_y[i] if end else records.start_y[i])
+    point = ogr.Geometry(ogr.wkbPoint)
+    point.AddPoint_2D(x, y)
+    feat.SetGeometry(point)
+    feat.SetField(0, int(i) + 1)
+    feat.SetField(1, 'End' if end else 'Start')
+    feat.SetField(2, float(round(records.fin_elev[i] if end else records.ini_elev[i], 3)))
+    feat.SetField(3, x)
+    feat.SetField(4, y)
+    feat.SetField(5, position + 1)
+
+
+def write_mask_polygon(path, records, projection):
+    """
+    Polygon through the profile points in vertex_ind order, one feature per
+    Line A / Line B pair (id = pair number).
+    """
+    ds, layer = create_vector_layer(path, ogr.wkbPolygon, [('id', ogr.OFTInteger, 0, 0)], projection)
+    layer.StartTransaction()
+    for pair, xs, ys in records.mask_rings():
+        ring = ogr.Geometry(ogr.wkbLinearRing)
+        for x, y in zip(xs, ys):
+            ring.AddPoint_2D(float(x), float(y))
+        polygon = ogr.Geometry(ogr.wkbPolygon)
+        polygon.AddGeometry(ring)
+        feat = ogr.Feature(layer.GetLayerDefn())
+        feat.SetGeometry(polygon)
+        feat.SetField(0, pair + 1)  # ID do polígono
+        layer.CreateFeature(feat)
+        log.info(f"Mask polygon {pair + 1} built from {len(xs) - 1} points")
+    layer.CommitTransaction()
+    ds = None
+    return path
+
+
+def patch_profile_lines(path, records, changed):
+    """
+    Rewrite in place the features of the changed profiles in a file written
+    by write_profile_lines. Returns False, leaving the file alone, when it
+    does not hold the expected profiles (e.g. a profile became zero-length).
+    """
+    ds = ogr.Open(path, 1)
+    if ds is None:
+        return False
+    layer = ds.GetLayer(0)
+    fids = {feat.GetField(0): feat.GetFID() for feat in layer}
+    if set(fids) != set((np.flatnonzero(records.length > 0) + 1).tolist()):
+        ds = None
+        return False
+    layer.StartTransaction()
+    for i in np.flatnonzero(changed):
+        feat = layer.GetFeature(fids[int(i) + 1])
+        _set_profile_line(feat, records, i)
+        layer.SetFeature(feat)
+    layer.CommitTransaction()
+    ds = None
+    return True
+
+
+def patch_profile_points(path, records, changed, old_records):
+    """
+    Rewrite in place the points of the changed profiles in a file written by
+    write_profile_points. Returns False, leaving the file alone, when the
+    vertex order differs from the one of old_records.
+    """
+    index, is_end = records.boundary_order()
+    old_index, old_is_end = old_records.boundary_order()
+    if not (np.array_equal(index, old_index) and np.array_equal(is_end, old_is_end)):
+        return False
+    ds = ogr.Open(path, 1)
+    if ds is None:
+        return False
+    layer = ds.GetLayer(0)
+    if layer.GetFeatureCount() != index.size:
+        ds = None
+        return False
+    # Os pontos foram escritos pela ordem de vertex_ind, logo FID = vertex_ind - 1
+    layer.StartTransaction()
+    for position in np.flatnonzero(changed[index]):
+        feat = layer.GetFeature(int(position))
+        _set_profile_point(feat, records, index, is_end, position)
+        layer.SetFeature(feat)
+    layer.CommitTransaction()
+    ds = None
+    return True
+
+
+def patch_vector_outputs(output_path, records, changed, old_records, projection):
+    """
+    Bring the profile lines, points and mask of an earlier run up to date
+    with records: changed features are patched in place where the layout
+    allows it, the files are written again otherwise. Returns the number of
+    profiles patched.
+    """
+    paths = output_paths(output_path)
+    if not changed.any() and all(os.path.exists(paths[key]) for key in ('profiles', 'points', 'mask')):
+        return 0
+    if not patch_profile_lines(paths['profiles'], records, changed):
+        write_profile_lines(paths['profiles'], records, projection)
+    if not patch_profile_points(paths['points'], records, changed, old_records):
+        write_profile_points(paths['points'], records, projection)
+    write_mask_polygon(paths['mask'], records, projection)
+    return int(np.count_nonzero(changed))
+
+
+def write_incremental_state(profiles, output_path, projection, report=None):
+    """
+    Provenance raster and state sidecar of a full run, so that the next
+    incremental run can update its outputs in place.
+    """
+    report = report or RunReport()
+    paths = output_paths(output_path)
+    with report.stage('provenance'):
+        write_provenance(paths['provenance'], profiles, projection,
+                         progress=partial(report.progress, unit='tiles'))
+        save_state(paths['state'], profiles)
+
+
+def discard_incremental_state(output_path):
+    """
+    Remove the provenance raster and state sidecar at output_path, which a
+    full run that does not refresh them would make stale.
+    """
+    paths = output_paths(output_path)
+    for path in (paths['provenance'], paths['state']):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def write_scenario_outputs(profiles, output_path, projection, scenarios, dem_sampler=None,
+                           analytic_surface=False, tile_memory_mb=None, bigtiff=False, sparse=False,
+                           report=None):
+    """
+    Multi-band raw DEM (and analytic surface) with one band per (slope,
+    offset) scenario, and with dem_sampler and analytic_surface the
+    scenario volume table (the raw bands only cover the profile traces).
+    See the scenarios module. Returns the outputs dict entries written.
+    """
+    report = report or RunReport()
+    paths = output_paths(output_path)
+    outputs = {'scenarios': paths['scenarios']}
+    surface_path = paths['scenarios_surface'] if analytic_surface else None
+    volumes_path = None
+    if not analytic_surface:
+        log.warning("Scenario volumes need the analytic surface (fill backend 'analytic'); "
+                    "the volume table is not written")
+    elif dem_sampler is not None:
+        volumes_path = paths['scenario_volumes']
+    with report.stage('scenarios'):
+        rows = write_scenarios(profiles, scenarios, paths['scenarios'], projection,
+                               surface_path=surface_path, volumes_path=volumes_path,
+                               dem_sampler=dem_sampler, tile_memory_mb=tile_memory_mb,
+                               bigtiff=bigtiff, sparse=sparse,
+                               progress=partial(report.progress, unit='tiles'))
+    report.count('scenarios', len(scenarios))
+    if surface_path:
+        outputs['scenarios_surface'] = surface_path
+    if volumes_path:
+        outputs['scenario_volumes'] = volumes_path
+        for row in rows:
+            log.info(f"Scenario {row['scenario']} (slope {row['slope']:g}, offset {row['offset']:+g}): "
+                     f"fill {row['fill']:.1f}, cut {row['cut']:.1f}, net {row['net']:.1f}")
+    log.info(f"{len(scenarios)} scenarios written to {paths['scenarios']}")
+    return outputs
+
+
+def update_raster_outputs(profiles, output_path, analytic_surface=False, report=None):
+    """
+    Incremental update of the raw DEM (and the analytic surface) left at
+    output_path by an earlier incremental run: only the tiles of the changed
+    profiles are rewritten, in place. Returns (tiles, record_changed,
+    old_records), or None when the earlier outputs cannot be reused and a
+    full run is needed.
+    """
+    report = report or RunReport()
+    paths = output_paths(output_path)
+    needed = [output_path, paths['provenance']] + ([paths['surface']] if analytic_surface else [])
+    if not all(os.path.exists(path) for path in needed):
+        return None
+    state = load_state(paths['state'])
+    changes = compare_state(state, profiles)
+    if changes is None:
+        log.info("Incremental update not possible (grid or profile count changed), running in full")
+        return None
+    raster_changed, record_changed = changes
+    log.info(f"Incremental update: {int(record_changed.sum())} of {len(profiles.records)} profiles changed")
+    report.count('changed_profiles', int(record_changed.sum()))
+
+    with report.stage('rasterize_update'):
+        tiles, cells_written = update_raster(profiles, state, raster_changed, output_path, paths['provenance'],
+                                             progress=partial(report.progress, unit='tiles'))
+    report.count('cells_written', cells_written)
+    report.count('tiles_updated', len(tiles))
+    if analytic_surface:
+        with report.stage('analytic_surface_update'):
+            update_analytic_surface(profiles, state, record_changed, paths['surface'],
+                                    progress=partial(report.progress, unit='tiles'))
+    save_state(paths['state'], profiles, tiles)
+    return tiles, record_changed, state_records(state)
+
+
+def output_paths(output_path, geopackage=False):
+    """
+    Paths of every file derived from the output GeoTIFF path. With
+    geopackage the vector outputs are tables of <output>.gpkg (see the
+    geopackage module); the rasters are always the GeoTIFFs they are
+    written to first.
+    """
+    base_path = os.path.splitext(output_path)[0]
+    container_path = f"{base_path}.gpkg"
+    vectors = {
+        'profiles': f"{base_path}_input_dem_profile_points.shp",
+        'points': f"{base_path}_profile_points.shp",
+        'mask': f"{base_path}_mask.shp",
+    }
+    if geopackage:
+        vectors = {key: layer_path(container_path, os.path.splitext(os.path.basename(path))[0])
+                   for key, path in vectors.items()}
+    return {
+        'dem': output_path,
+        **vectors,
+        'surface': f"{base_path}_surface.tif",
+        'cropped': f"{base_path}_surface_cropped.tif",
+        'provenance': f"{base_path}_provenance.tif",
+        'state': f"{base_path}_profiles_state.npz",
+        'scenarios': f"{base_path}_scenarios.tif",
+        'scenarios_surface': f"{base_path}_scenarios_surface.tif",
+        'scenario_volumes': f"{base_path}_scenarios_volumes.csv",
+        'geopackage': container_path,
+    }
+
+
+# Saídas raster copiadas para o GeoPackage no fim da corrida
+RASTER_OUTPUTS = ('dem', 'surface', 'cropped', 'scenarios', 'scenarios_surface')
+
+
+def pack_raster_outputs(output_path):
+    """
+    Move the raster outputs written for output_path into <output>.gpkg.
+    Returns {key: raster table source} of those packed.
+    """
+    paths = output_paths(output_path)
+    return pack_rasters(paths['geopackage'], {key: paths[key] for key in RASTER_OUTPUTS})
+
+
+def cog_raster_outputs(output_path, compression='DEFLATE', threads=None, bigtiff=False, progress=None):
+    """
+    Rewrite the raster outputs written for output_path as Cloud Optimized
+    GeoTIFFs (see raster_io.write_cog). progress: optional
+    callable(rasters_done, rasters). Returns the paths rewritten.
+    """
+    paths = output_paths(output_path)
+    rasters = [paths[key] for key in RASTER_OUTPUTS if os.path.exists(paths[key])]
+    for k, path in enumerate(rasters):
+        if progress is not None:
+            progress(k, len(rasters))
+        write_cog(path, compression, threads, bigtiff)
+        log.info(f"Raster {path} written as COG ({compression})")
+    if progress is not None:
+        progress(len(rasters), len(rasters))
+    return rasters
+
+
+def check_output_format(incremental=False, geopackage=False, cog_compression=None):
+    """Raise ValueError for output options that cannot be combined."""
+    if geopackage and incremental:
+        raise ValueError("Incremental runs need the GeoTIFF outputs; turn off the GeoPackage output")
+    if cog_compression and incremental:
+        raise ValueError("Incremental runs update the rasters in place; turn off the COG output")
+    if cog_compression and geopackage:
+        raise ValueError("The GeoPackage output stores its own raster tiles; turn off the COG output")
+
+
+# Ficheiros que acompanham cada shapefile
+SHAPEFILE_EXTENSIONS = ('.shp', '.shx', '.dbf', '.prj', '.cpg')
+
+
+def output_files(output_path):
+    """Every file a run may write for output_path, shapefile sidecars included."""
+    files = []
+    for path in output_paths(output_path).values():
+        base_path, ext = os.path.splitext(path)
+        if ext == '.gpkg':
+            files.extend([path] + [path + suffix for suffix in SQLITE_SIDECARS])
+            continue
+        if ext == '.shp':
+            files.extend(base_path + sidecar for sidecar in SHAPEFILE_EXTENSIONS)
+        else:
+            files.append(path)
+    return files
+
+
+def snapshot_outputs(output_paths_list):
+    """{path: mtime} of the existing output files of each output path."""
+    return {path: os.path.getmtime(path)
+            for output_path in output_paths_list
+            for path in output_files(output_path) if os.path.exists(path)}
+
+
+def changed_outputs(output_paths_list, snapshot):
+    """Output files created or rewritten since snapshot was taken."""
+    return [path for output_path in output_paths_list for path in output_files(output_path)
+            if os.path.exists(path) and snapshot.get(path) != os.path.getmtime(path)]
+
+
+def remove_partial_outputs(output_paths_list, snapshot):
+    """
+    Delete the output files created or rewritten since snapshot was taken,
+    e.g. after a cancelled run. Files the run did not touch are kept.
+    Returns the paths removed.
+    """
+    removed = []
+    for path in changed_outputs(output_paths_list, snapshot):
+        try:
+            os.remove(path)
+            removed.append(path)
+        except OSError as e:
+            log.warning(f"Could not remove partial output {path}: {str(e)}")
+    if removed:
+        log.info(f"Removed {len(removed)} partial output files")
+    return removed
+
+
+def open_dem_sampler(dem_path, extent=None, no_data=None, tile_memory_mb=None):
+    """
+    Sampler for dem_path. Without tile_memory_mb the DEM window under extent
+    is read at once (DemWindowSampler); with it only the blocks holding the
+    sampled points are read, through a cache of a quarter of the budget
+    (DemBlockSampler), so sampling memory does not grow with the site.
+    """
+    if tile_memory_mb:
+        return DemBlockSampler.for_budget(dem_path, tile_memory_mb / 4, no_data=no_data)
+    return DemWindowSampler(dem_path, extent, no_data=no_data)
+
+
+def _pair_profiles_task(task):
+    """Worker entry point: StableBeachProfiles of one feature pair."""
+    (line_a_parts, line_b_parts, dem, slope, pixel_size_x, pixel_size_y, no_data,
+     distance_interval, extent, tile_memory_mb) = task
+    if isinstance(dem, str):
+        # Each worker reads only the DEM under its own pair
+        dem = open_dem_sampler(dem, lines_extent(line_a_parts, line_b_parts), no_data, tile_memory_mb)
+    return StableBeachProfiles(
+        line_a_parts, line_b_parts, dem, slope, pixel_size_x, pixel_size_y,
+        no_data=no_data, distance_interval=distance_interval, extent=extent
+    )
+
+
+def map_pairs(function, tasks, workers=None, use_processes=True, progress=None):
+    """
+    function applied to every task, results in task order. Runs on a
+    process (or thread) pool of `workers` when there is more than one task.
+
+    progress: optional callable(tasks_done, total_tasks), also called while
+    waiting on a running task. If it raises (e.g. RunCancelled), the tasks
+    not yet started are dropped and the exception propagates once the
+    running ones return.
+    """
+    results = []
+    if len(tasks) <= 1 or workers == 1:
+        for k, task in enumerate(tasks):
+            if progress is not None:
+                progress(k, len(tasks))
+            results.append(function(task))
+    else:
+        pool_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+        with pool_class(max_workers=workers) as pool:
+            futures = [pool.submit(function, task) for task in tasks]
+            try:
+                for k, future in enumerate(futures):
+                    while not future.done():
+                        if progress is not None:
+                            progress(k, len(tasks))
+                        wait([future], timeout=PROGRESS_INTERVAL)
+                    results.append(future.result())
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+    if progress is not None:
+        progress(len(tasks), len(tasks))
+    return results
+
+
+def build_pair_profiles(pairs, features_a, features_b, dem, slope, pixel_size_x, pixel_size_y,
+                        no_data=DEFAULT_NO_DATA, distance_interval=None, extent=None,
+                        workers=None, use_processes=True, progress=None, tile_memory_mb=None):
+    """
+    StableBeachProfiles of every (index_a, index_b) pair, in pair order,
+    computed in parallel. progress is passed on to map_pairs.
+
+    dem: DEM path, in which case every worker opens a sampler for its pair
+    (see open_dem_sampler, which tile_memory_mb is passed to), or a shared
+    sampler object, which forces a thread pool.
+    extent: common grid extent, so that the results can be merged.
+    """
+    if not isinstance(dem, str):
+        use_processes = False
+    tasks = [
+        (features_a[i][1], features_b[j][1], dem, slope, pixel_size_x, pixel_size_y,
+         no_data, distance_interval, extent, tile_memory_mb)
+        for i, j in pairs
+    ]
+    return map_pairs(_pair_profiles_task, tasks, workers, use_processes, progress)
+
+
+def write_profile_outputs(profiles, output_path, projection, tile_memory_mb=None, bigtiff=False, sparse=False,
+                          analytic_surface=False, incremental=False, scenarios=None, dem_sampler=None,
+                          geopackage=False, report=None):
+    """
+    Outputs written straight from a profile set: the raw DEM (and with
+    analytic_surface the surface), the profile lines, points and mask, the
+    incremental state and the scenario rasters. Shared by write_outputs and
+    the QGIS adapter, which fill, crop and pack the rasters afterwards.
+
+    dem_sampler: sampler of the input DEM for the scenario volume table
+    (skipped when None). Returns (outputs, plan), plan being the
+    update_raster_outputs result of an incremental update, else None.
+    """
+    check_output_format(incremental, geopackage)
+    report = report or RunReport()
+    paths = output_paths(output_path, geopackage)
+    outputs = {'dem': output_path}
+    records = profiles.records
+    if geopackage:
+        # Um contentor novo por corrida
+        reset_container(paths['geopackage'])
+
+    plan = None
+    if incremental:
+        plan = update_raster_outputs(profiles, output_path, analytic_surface, report)
+    else:
+        discard_incremental_state(output_path)
+    if plan is None:
+        profiles.write_raster(output_path, projection, tile_memory_mb, bigtiff, sparse, report=report)
+        if analytic_surface:
+            profiles.write_surface(paths['surface'], projection, tile_memory_mb, bigtiff, sparse, report=report)
+    if analytic_surface:
+        outputs['surface'] = paths['surface']
+
+    log.info(f"Number of profiles to create: {len(records)}")
+    if len(records):
+        with report.stage('vector_outputs'):
+            if plan is None:
+                write_profile_lines(paths['profiles'], records, projection)
+                write_profile_points(paths['points'], records, projection)
+                write_mask_polygon(paths['mask'], records, projection)
+            else:
+                # Atualização incremental: só os perfis alterados são reescritos
+                _, changed, old_records = plan
+                patched = patch_vector_outputs(output_path, records, changed, old_records, projection)
+                log.info(f"Patched {patched} profiles in the vector outputs")
+        outputs.update(profiles=paths['profiles'], points=paths['points'], mask=paths['mask'])
+
+    if incremental and plan is None:
+        write_incremental_state(profiles, output_path, projection, report)
+
+    if scenarios:
+        outputs.update(write_scenario_outputs(
+            profiles, output_path, projection, scenarios, dem_sampler,
+            analytic_surface, tile_memory_mb, bigtiff, sparse, report=report
+        ))
+    return outputs, plan
+
+
+def write_outputs(profiles, output_path, projection, tile_memory_mb=None, bigtiff=False, sparse=False,
+                  fill_backend=None, mode='wmean', power=2.0, cells=6, distance=0.5, incremental=False,
+                  scenarios=None, dem_path=None, geopackage=False, cog_compression=None, cog_threads=None,
+                  report=None):
+    """
+    Raw DEM, profile lines, profile points and mask of a profile set (see
+    write_profile_outputs), and with fill_backend ('numpy', 'gdal' or
+    'analytic') the surface and the surface cropped to the mask. Returns
+    the outputs dict of generate_dem.
+
+    incremental: update the outputs of an earlier incremental run in place
+    when possible (see the incremental module), and leave the provenance
+    raster and state sidecar for the next one.
+
+    scenarios: list of (slope, offset); also writes the multi-band scenario
+    rasters and, with dem_path and the analytic backend, their volume table
+    against that DEM.
+
+    geopackage: write the vector outputs into <output>.gpkg and move the
+    rasters there at the end, replacing any earlier container. Not
+    available with incremental, which updates the GeoTIFFs in place.
+
+    cog_compression: 'DEFLATE' or 'ZSTD' to rewrite every raster as a
+    compressed COG with overviews once it is complete, on cog_threads
+    threads (see raster_io.cog_options). Not available with incremental or
+    geopackage.
+    """
+    if fill_backend not in (None, 'analytic', 'numpy', 'gdal'):
+        raise ValueError(f"Fill backend not available without QGIS: {fill_backend}")
+    check_output_format(incremental, geopackage, cog_compression)
+    report = report or RunReport()
+    paths = output_paths(output_path, geopackage)
+    dem_sampler = None
+    if scenarios and dem_path and fill_backend == 'analytic':
+        dem_sampler = open_dem_sampler(dem_path, profiles.extent, profiles.no_data, tile_memory_mb)
+    outputs, plan = write_profile_outputs(
+        profiles, output_path, projection, tile_memory_mb, bigtiff, sparse,
+        analytic_surface=fill_backend == 'analytic', incremental=incremental, scenarios=scenarios,
+        dem_sampler=dem_sampler, geopackage=geopackage, report=report
+    )
+
+    if fill_backend in ('numpy', 'gdal'):
+        with report.stage('fill'):
+            if plan is not None and fill_backend == 'numpy' and os.path.exists(paths['surface']):
+                # Só as janelas reescritas, mais o raio de pesquisa
+                refill_surface(output_path, paths['surface'], plan[0], mode=mode, power=power,
+                               cells=cells, distance=distance, progress=partial(report.progress, unit='tiles'))
+            elif fill_backend == 'numpy':
+                fill_raster_numpy(output_path, paths['surface'], mode=mode, power=power,
+                                  cells=cells, distance=distance)
+            else:
+                fill_raster_gdal(output_path, paths['surface'], distance=distance)
+        outputs['surface'] = paths['surface']
+        if 'mask' in outputs:
+            with report.stage('clip'):
+                clip_to_mask(paths['surface'], paths['mask'], paths['cropped'], profiles.no_data, bigtiff,
+                             progress=partial(report.progress, unit='blocks'))
+            outputs['cropped'] = paths['cropped']
+
+    if cog_compression:
+        with report.stage('cog'):
+            cog_raster_outputs(output_path, cog_compression, cog_threads, bigtiff,
+                               progress=partial(report.progress, unit='rasters'))
+
+    if geopackage:
+        with report.stage('geopackage'):
+            outputs.update(pack_raster_outputs(output_path))
+        outputs['geopackage'] = paths['geopackage']
+    return outputs
+
+
+def _pair_outputs_task(task):
+    """Worker entry point: full run of one feature pair into its own files."""
+    profiles_task, output_path, projection, options = task
+    report = RunReport().start()
+    with report.stage('profiles'):
+        profiles = _pair_profiles_task(profiles_task)
+    profiles.count_into(report)
+    outputs = write_outputs(profiles, output_path, projection, report=report, **options)
+    report.finish().write(output_path)
+    return outputs
+
+
+def generate_dem(dem_path, line_a_path, line_b_path, slope, output_path, distance_interval=None,
+                 tile_memory_mb=None, bigtiff=False, sparse=False, fill_backend=None,
+                 mode='wmean', power=2.0, cells=6, distance=0.5, pair_field=None,
+                 per_pair_outputs=False, incremental=False, scenarios=None, workers=None, geopackage=False,
+                 cog_compression=None, cog_threads=None, report=None):
+    """
+    Complete run without QGIS: raw DEM, profile lines, profile points and
+    mask, and with fill_backend ('numpy', 'gdal' or 'analytic') the surface
+    and the surface cropped to the mask. GRASS needs QGIS Processing and is
+    not available here.
+
+    Every Line A feature is paired with a Line B feature, by equal
+    pair_field values when given or else by proximity, and the pairs are
+    processed on a pool of `workers` processes. Their profiles are merged
+    into one set of outputs, or with per_pair_outputs every pair gets its
+    own <output>_pair<n> files and run report.
+
+    Returns (success, message, outputs) where outputs maps output names to
+    the files written (per pair: outputs['pairs'] lists one such dict per
+    pair).
+
+    With incremental, a run over the outputs of an earlier incremental run
+    only rewrites what the changed profiles touch (see write_outputs).
+
+    scenarios: list of (slope, offset) pairs (see scenarios.scenario_list)
+    to also write as one band each, with their cut / fill volume table.
+
+    geopackage: write every vector and raster output into one
+    <output>.gpkg instead of separate files (see write_outputs); outputs
+    then holds layer paths and raster table sources.
+
+    cog_compression ('DEFLATE' or 'ZSTD') and cog_threads: write every
+    raster as a compressed Cloud Optimized GeoTIFF with overviews.
+
+    Cancelling the report (report.cancel(), from another thread) stops the
+    run at its next progress check and removes the files it had written.
+    """
+    own_report = report is None
+    if own_report:
+        report = RunReport().start()
+    report.set_parameters(
+        slope=slope, distance_interval=distance_interval, tile_memory_mb=tile_memory_mb,
+        bigtiff=bigtiff, sparse=sparse, fill_backend=fill_backend, pair_field=pair_field,
+        per_pair_outputs=per_pair_outputs, incremental=incremental, workers=workers,
+        scenarios=[list(scenario) for scenario in scenarios or []], geopackage=geopackage,
+        cog_compression=cog_compression, cog_threads=cog_threads
+    )
+    options = dict(tile_memory_mb=tile_memory_mb, bigtiff=bigtiff, sparse=sparse,
+                   fill_backend=fill_backend, mode=mode, power=power, cells=cells, distance=distance,
+                   incremental=incremental, scenarios=scenarios, dem_path=dem_path, geopackage=geopackage,
+                   cog_compression=cog_compression, cog_threads=cog_threads)
+    written_paths = [output_path]
+    snapshot = snapshot_outputs(written_paths)
+    try:
+        pixel_size_x, pixel_size_y, no_data, projection = dem_grid_info(dem_path)
+
+        features_a = read_line_features(line_a_path, pair_field)
+        features_b = read_line_features(line_b_path, pair_field)
+        pairs = pair_line_features(features_a, features_b, by_key=pair_field is not None)
+        if not pairs:
+            raise ValueError("No Line A / Line B feature pairs found")
+        report.count('feature_pairs', len(pairs))
+        log.info(f"Processing {len(pairs)} Line A / Line B feature pairs")
+
+        if per_pair_outputs:
+            base_path, ext = os.path.splitext(output_path)
+            written_paths = [f"{base_path}_pair{k + 1}{ext}" for k in range(len(pairs))]
+            snapshot = snapshot_outputs(written_paths)
+            tasks = [
+                ((features_a[i][1], features_b[j][1], dem_path, slope, pixel_size_x, pixel_size_y,
+                  no_data, distance_interval, None, tile_memory_mb),
+                 written_paths[k], projection, options)
+                for k, (i, j) in enumerate(pairs)
+            ]
+            with report.stage('pairs'):
+                pair_outputs = map_pairs(_pair_outputs_task, tasks, workers,
+                                         progress=partial(report.progress, unit='pairs'))
+            return True, "DEM generated successfully!", {'pairs': pair_outputs}
+
+        with report.stage('profiles'):
+            # Grelha comum a todos os pares, para que os perfis possam ser juntos
+            extent = lines_extent(*[features_a[i][1] for i, _ in pairs], *[features_b[j][1] for _, j in pairs])
+            profiles = StableBeachProfiles.merge(build_pair_profiles(
+                pairs, features_a, features_b, dem_path, slope, pixel_size_x, pixel_size_y,
+                no_data=no_data, distance_interval=distance_interval, extent=extent, workers=workers,
+                progress=partial(report.progress, unit='pairs'), tile_memory_mb=tile_memory_mb
+            ))
+        profiles.count_into(report)
+
+        outputs = write_outputs(profiles, output_path, projection, report=report, **options)
+        return True, "DEM generated successfully!", outputs
+
+    except RunCancelled as e:
+        log.info(str(e))
+        remove_partial_outputs(written_paths, snapshot)
+        return False, str(e), {}
+
+    except Exception as e:
+        log.exception("DEM generation failed")
+        return False, f"Error: {str(e)}", {}
+
+    finally:
+        if own_report:
+            try:
+                report.finish().write(output_path)
+            except Exception as e:
+                log.warning(f"Could not write run report: {str(e)}")
@@ -0,0 +1,275 @@
+"""
+Volume change of the stable surface against a time series of survey DEMs.
+
+Every survey (epoch) is compared with the same stable surface, within the
+mask. The surface is read one block of rows at a time and the mask is
+rasterized for that block only; every survey is then read for the same
+block before moving on. N epochs therefore cost about N sequential reads of
+the surface window, and only one block of each raster is in memory at a
+time. The totals of every epoch go into one CSV table and, optionally, the
+differences into a multi-band raster with one band per epoch.
+
+Surveys on the surface grid are read block for block; other grids are
+sampled at the surface pixel centres, as in grid_volumes.
+"""
+import csv
+import os
+
+import numpy as np
+from osgeo import gdal
+
+from .dem_sampler import DemWindowSampler
+from .geopackage import open_layer
+from .grid_volumes import BLOCK_ROWS
+from .raster_io import TiledGeoTiffWriter, mask_window, rasterize_mask
+from .run_report import RunCancelled, RunReport, log
+
+
+EPOCH_FIELDS = ('epoch', 'name', 'source', 'cells', 'area', 'coverage', 'fill', 'cut', 'net', 'net_change')
+
+# NoData das diferenças quando a superfície não tem nenhum
+DIFFERENCE_NO_DATA = -9999.0
+
+
+def epoch_output_paths(volumes_path):
+    """Paths of the epoch outputs derived from the volume table path."""
+    base_path = os.path.splitext(volumes_path)[0]
+    return {
+        'volumes': volumes_path,
+        'differences': f"{base_path}_differences.tif",
+    }
+
+
+def epoch_name(path):
+    """Short name of a survey: the file name without extension, or the GeoPackage table."""
+    if path.startswith('GPKG:'):
+        return path.rsplit(':', 1)[1]
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+class EpochVolumes:
+    """
+    Running cut / fill totals of every epoch against the stable surface.
+    fill is the volume the stable surface lies above the survey, cut the
+    volume below it, as in grid_volumes. Surface cells the survey does not
+    cover are not counted and lower its coverage.
+    """
+
+    def __init__(self, sources, cell_area):
+        self.sources = list(sources)
+        self.cell_area = cell_area
+        self.surface_cells = 0
+        self.cells = np.zeros(len(self.sources), dtype=np.int64)
+        self.fill = np.zeros(len(self.sources), dtype=np.float64)
+        self.cut = np.zeros(len(self.sources), dtype=np.float64)
+
+    def add(self, k, difference):
+        """Add the surface minus survey values of the cells epoch k covers."""
+        self.cells[k] += difference.size
+        self.fill[k] += float(difference[difference > 0].sum()) * self.cell_area
+        self.cut[k] += float(-difference[difference < 0].sum()) * self.cell_area
+
+    def rows(self):
+        result = []
+        previous = None
+        for k, source in enumerate(self.sources):
+            net = float(self.fill[k] - self.cut[k])
+            result.append({
+                'epoch': k + 1, 'name': epoch_name(source), 'source': source,
+                'cells': int(self.cells[k]),
+                'area': round(float(self.cells[k] * self.cell_area), 3),
+                'coverage': round(float(self.cells[k]) / self.surface_cells, 4) if self.surface_cells else 0.0,
+                'fill': round(float(self.fill[k]), 3),
+                'cut': round(float(self.cut[k]), 3),
+                'net': round(net, 3),
+                # Variação do volume líquido desde a época anterior
+                'net_change': '' if previous is None else round(net - previous, 3),
+            })
+            previous = net
+        return result
+
+    def write_csv(self, path):
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=EPOCH_FIELDS)
+            writer.writeheader()
+            writer.writerows(self.rows())
+        return path
+
+
+class _EpochReader:
+    """Survey DEM read for the blocks of the surface grid."""
+
+    def __init__(self, path, geotransform):
+        self.path = path
+        self.ds = gdal.Open(path, gdal.GA_ReadOnly)
+        if self.ds is None:
+            raise IOError(f"Could not open survey DEM: {path}")
+        self.band = self.ds.GetRasterBand(1)
+        self.no_data = self.band.GetNoDataValue()
+        # Mesma grelha da superfície: lê-se a mesma janela, sem amostragem
+        self.aligned = np.allclose(self.ds.GetGeoTransform(), geotransform, rtol=0.0,
+                                   atol=abs(geotransform[1]) * 1e-6)
+        self.geotransform = geotransform
+
+    def values(self, col0, row0, width, height, valid):
+        """Survey elevation of every valid cell of the block (NaN where it has none)."""
+        if not self.aligned:
+            gt = self.geotransform
+            rows, cols = np.nonzero(valid)
+            xs = gt[0] + (col0 + cols + 0.5) * gt[1]
+            ys = gt[3] + (row0 + rows + 0.5) * gt[5]
+            extent = (xs.min(), ys.min(), xs.max(), ys.max())
+            return DemWindowSampler(self.path, extent).sample(xs, ys)
+
+        block = np.full((height, width), np.nan, dtype=np.float64)
+        read_width = min(width, self.ds.RasterXSize - col0)
+        read_height = min(height, self.ds.RasterYSize - row0)
+        if read_width > 0 and read_height > 0:
+            data = self.band.ReadAsArray(col0, row0, read_width, read_height).astype(np.float64)
+            if self.no_data is not None:
+                data[data == self.no_data] = np.nan
+            block[:read_height, :read_width] = data
+        return block[valid]
+
+    def close(self):
+        self.band = None
+        self.ds = None
+
+
+def epoch_volumes(surface_path, epoch_paths, mask_path=None, differences_path=None, block_rows=BLOCK_ROWS,
+                  bigtiff=False, progress=None):
+    """
+    EpochVolumes of every survey DEM in epoch_paths (in survey order)
+    against the stable surface at surface_path, over the surface cells
+    with data inside the mask polygon at mask_path (a file or GeoPackage
+    layer path; the whole surface when None).
+
+    With differences_path, the stable surface minus each survey is also
+    written there, one Float32 band per epoch over the mask extent.
+    progress: optional callable(blocks_done, total_blocks).
+    """
+    ds = gdal.Open(surface_path, gdal.GA_ReadOnly)
+    if ds is None:
+        raise IOError(f"Could not open surface: {surface_path}")
+    gt = ds.GetGeoTransform()
+    if gt[2] != 0 or gt[4] != 0:
+        raise ValueError("Rotated surface geotransforms are not supported")
+    band = ds.GetRasterBand(1)
+    no_data = band.GetNoDataValue()
+
+    mask_ds = mask = None
+    col0, col1, row0, row1 = 0, ds.RasterXSize, 0, ds.RasterYSize
+    if mask_path:
+        mask_ds, mask = open_layer(mask_path)
+        col0, col1, row0, row1 = mask_window(mask, gt, ds.RasterXSize, ds.RasterYSize)
+    width = col1 - col0
+
+    volumes = EpochVolumes(epoch_paths, abs(gt[1] * gt[5]))
+    readers = []
+    writer = None
+    try:
+        readers = [_EpochReader(path, gt) for path in epoch_paths]
+        if differences_path:
+            out_no_data = no_data if no_data is not None else DIFFERENCE_NO_DATA
+            window_gt = (gt[0] + col0 * gt[1], gt[1], 0.0, gt[3] + row0 * gt[5], 0.0, gt[5])
+            writer = TiledGeoTiffWriter(differences_path, max(width, 1), max(row1 - row0, 1), window_gt,
+                                        ds.GetProjection(), out_no_data, bigtiff=bigtiff, sparse=True,
+                                        band_count=len(readers))
+            for k, path in enumerate(epoch_paths):
+                writer.set_band_description(k + 1, epoch_name(path))
+
+        blocks = list(range(row0, row1, block_rows)) if width > 0 else []
+        for n, block_row in enumerate(blocks):
+            if progress is not None:
+                progress(n, len(blocks))
+            height = min(block_rows, row1 - block_row)
+            surface = band.ReadAsArray(col0, block_row, width, height).astype(np.float64)
+            valid = ~np.isnan(surface)
+            if no_data is not None:
+                valid &= surface != no_data
+            if mask is not None:
+                # Máscara só deste bloco, para a memória não crescer com o raster
+                valid &= rasterize_mask(mask, gt, col0, block_row, width, height)
+            volumes.surface_cells += int(np.count_nonzero(valid))
+            if not valid.any():
+                continue
+
+            # Um só bloco da superfície para todas as épocas
+            surface_values = surface[valid]
+            for k, reader in enumerate(readers):
+                survey = reader.values(col0, block_row, width, height, valid)
+                covered = ~np.isnan(survey)
+                difference = surface_values[covered] - survey[covered]
+                volumes.add(k, difference)
+                if writer is not None:
+                    values = np.full(surface_values.size, writer.no_data, dtype=np.float32)
+                    values[covered] = difference
+                    tile = np.full((height, width), writer.no_data, dtype=np.float32)
+                    tile[valid] = values
+                    writer.write_tile(tile, block_row - row0, 0, k + 1)
+        if progress is not None:
+            progress(len(blocks), len(blocks))
+    finally:
+        if writer is not None:
+            writer.close()
+        for reader in readers:
+            reader.close()
+        mask = mask_ds = None
+        band = None
+        ds = None
+    return volumes
+
+
+def compare_epochs(surface_path, epoch_paths, volumes_path, mask_path=None, differences=False,
+                   block_rows=BLOCK_ROWS, bigtiff=False, report=None):
+    """
+    Run without QGIS: writes the per-epoch volume table to volumes_path
+    (CSV) and, with differences, the difference raster next to it (see
+    epoch_output_paths). Returns (success, message, outputs).
+
+    Cancelling the report stops the run at its next block and removes the
+    partial difference raster.
+    """
+    own_report = report is None
+    if own_report:
+        report = RunReport().start()
+    report.set_parameters(surface=surface_path, epochs=list(epoch_paths), mask=mask_path,
+                          differences=differences, block_rows=block_rows)
+    paths = epoch_output_paths(volumes_path)
+    try:
+        if not epoch_paths:
+            raise ValueError("No survey DEMs given")
+        log.info(f"Comparing the stable surface with {len(epoch_paths)} surveys")
+        with report.stage('epochs'):
+            volumes = epoch_volumes(
+                surface_path, epoch_paths, mask_path,
+                differences_path=paths['differences'] if differences else None,
+                block_rows=block_rows, bigtiff=bigtiff,
+                progress=lambda done, total: report.progress(done, total, 'blocks')
+            )
+        volumes.write_csv(volumes_path)
+        report.count('epochs', len(epoch_paths))
+        report.count('surface_cells', volumes.surface_cells)
+        outputs = {'volumes': volumes_path}
+        if differences:
+            outputs['differences'] = paths['differences']
+        log.info(f"Epoch volumes written to {volumes_path}")
+        return True, "Epoch volumes calculated successfully!", outputs
+
+    except RunCancelled as e:
+        log.info(str(e))
+        # A tabela só é escrita no fim; o raster das diferenças fica a meio
+        if differences and os.path.exists(paths['differences']):
+            os.remove(paths['differences'])
+        return False, str(e), {}
+
+    except Exception as e:
+        log.exception("Epoch comparison failed")
+        return False, f"Error: {str(e)}", {}
+
+    finally:
+        if own_report:
+            try:
+                report.finish().write(volumes_path)
+            except Exception as e:
+                log.warning(f"Could not write run report: {str(e)}")
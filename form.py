@@ -61,6 +61,95 @@ class Ui_Form(object):
         self.horizontalLayout.addWidget(self.distanceInput)
         self.optionsLayout.addWidget(self.distanceWidget)
         
+        self.pairFieldWidget = QtWidgets.QWidget()
+        self.pairFieldLayout = QtWidgets.QHBoxLayout(self.pairFieldWidget)
+        self.pairFieldLabel = QtWidgets.QLabel("Pair A/B features by field")
+        self.pairFieldLayout.addWidget(self.pairFieldLabel)
+        self.pairFieldInput = QtWidgets.QLineEdit()
+        self.pairFieldInput.setPlaceholderText("(nearest feature)")
+        self.pairFieldLayout.addWidget(self.pairFieldInput)
+        self.optionsLayout.addWidget(self.pairFieldWidget)
+        
+        self.workersWidget = QtWidgets.QWidget()
+        self.workersLayout = QtWidgets.QHBoxLayout(self.workersWidget)
+        self.workersLabel = QtWidgets.QLabel("Worker threads (0 = all cores)")
+        self.workersLayout.addWidget(self.workersLabel)
+        self.workersInput = QtWidgets.QLineEdit()
+        self.workersInput.setText("0")
+        self.workersLayout.addWidget(self.workersInput)
+        self.optionsLayout.addWidget(self.workersWidget)
+        
+        # Output Options Group
+        self.outputOptionsGroup = QtWidgets.QGroupBox("Output Options")
+        self.beachLayout.addWidget(self.outputOptionsGroup)
+        self.outputOptionsLayout = QtWidgets.QVBoxLayout(self.outputOptionsGroup)
+        
+        self.tiledCheckBox = QtWidgets.QCheckBox("Tiled output (limit memory use)")
+        self.outputOptionsLayout.addWidget(self.tiledCheckBox)
+        
+        self.memoryBudgetWidget = QtWidgets.QWidget()
+        self.memoryBudgetLayout = QtWidgets.QHBoxLayout(self.memoryBudgetWidget)
+        self.memoryBudgetLabel = QtWidgets.QLabel("Memory budget (MB)")
+        self.memoryBudgetLayout.addWidget(self.memoryBudgetLabel)
+        self.memoryBudgetInput = QtWidgets.QLineEdit()
+        self.memoryBudgetInput.setText("512")
+        self.memoryBudgetInput.setEnabled(False)
+        self.memoryBudgetLayout.addWidget(self.memoryBudgetInput)
+        self.outputOptionsLayout.addWidget(self.memoryBudgetWidget)
+        
+        self.bigTiffCheckBox = QtWidgets.QCheckBox("BigTIFF")
+        self.outputOptionsLayout.addWidget(self.bigTiffCheckBox)
+        
+        self.sparseCheckBox = QtWidgets.QCheckBox("Sparse output (skip empty blocks)")
+        self.outputOptionsLayout.addWidget(self.sparseCheckBox)
+
+        self.incrementalCheckBox = QtWidgets.QCheckBox("Incremental (only update changed profiles)")
+        self.outputOptionsLayout.addWidget(self.incrementalCheckBox)
+
+        self.geopackageCheckBox = QtWidgets.QCheckBox("Single GeoPackage output (.gpkg)")
+        self.outputOptionsLayout.addWidget(self.geopackageCheckBox)
+
+        self.cogCheckBox = QtWidgets.QCheckBox("Compressed COG output (overviews)")
+        self.outputOptionsLayout.addWidget(self.cogCheckBox)
+
+        self.cogCompressionWidget = QtWidgets.QWidget()
+        self.cogCompressionLayout = QtWidgets.QHBoxLayout(self.cogCompressionWidget)
+        self.cogCompressionLabel = QtWidgets.QLabel("COG compression")
+        self.cogCompressionLayout.addWidget(self.cogCompressionLabel)
+        self.cogCompressionCombo = QtWidgets.QComboBox()
+        self.cogCompressionCombo.addItems(['DEFLATE', 'ZSTD'])
+        self.cogCompressionCombo.setEnabled(False)
+        self.cogCompressionLayout.addWidget(self.cogCompressionCombo)
+        self.outputOptionsLayout.addWidget(self.cogCompressionWidget)
+
+        self.cogThreadsCheckBox = QtWidgets.QCheckBox("Multi-threaded compression")
+        self.cogThreadsCheckBox.setEnabled(False)
+        self.outputOptionsLayout.addWidget(self.cogThreadsCheckBox)
+        
+        self.scenarioSlopesWidget = QtWidgets.QWidget()
+        self.scenarioSlopesLayout = QtWidgets.QHBoxLayout(self.scenarioSlopesWidget)
+        self.scenarioSlopesLabel = QtWidgets.QLabel("Scenario slopes (degrees)")
+        self.scenarioSlopesLayout.addWidget(self.scenarioSlopesLabel)
+        self.scenarioSlopesInput = QtWidgets.QLineEdit()
+        self.scenarioSlopesInput.setPlaceholderText("e.g. 3, 4.5, 6")
+        self.scenarioSlopesLayout.addWidget(self.scenarioSlopesInput)
+        self.outputOptionsLayout.addWidget(self.scenarioSlopesWidget)
+        
+        self.scenarioOffsetsWidget = QtWidgets.QWidget()
+        self.scenarioOffsetsLayout = QtWidgets.QHBoxLayout(self.scenarioOffsetsWidget)
+        self.scenarioOffsetsLabel = QtWidgets.QLabel("Scenario offsets (m)")
+        self.scenarioOffsetsLayout.addWidget(self.scenarioOffsetsLabel)
+        self.scenarioOffsetsInput = QtWidgets.QLineEdit()
+        self.scenarioOffsetsInput.setPlaceholderText("e.g. 0, 0.5")
+        self.scenarioOffsetsLayout.addWidget(self.scenarioOffsetsInput)
+        self.outputOptionsLayout.addWidget(self.scenarioOffsetsWidget)
+        
+        self.profileRunCheckBox = QtWidgets.QCheckBox("Profile run (cProfile, memory)")
+        self.outputOptionsLayout.addWidget(self.profileRunCheckBox)
+        
+        self.verboseLogCheckBox = QtWidgets.QCheckBox("Verbose log")
+        self.outputOptionsLayout.addWidget(self.verboseLogCheckBox)
+        
         # Interpolation Options
         self.interpolateCheckBox = QtWidgets.QCheckBox("Generate interpolated surface")
         self.beachLayout.addWidget(self.interpolateCheckBox)
@@ -71,6 +160,16 @@ class Ui_Form(object):
         self.beachLayout.addWidget(self.interpolationGroup)
         self.interpolationLayout = QtWidgets.QVBoxLayout(self.interpolationGroup)
         
+        # Fill backend
+        self.backendWidget = QtWidgets.QWidget()
+        self.backendLayout = QtWidgets.QHBoxLayout(self.backendWidget)
+        self.backendLabel = QtWidgets.QLabel("Fill backend:")
+        self.backendCombo = QtWidgets.QComboBox()
+        self.backendCombo.addItems(['grass', 'numpy', 'gdal', 'analytic'])
+        self.backendLayout.addWidget(self.backendLabel)
+        self.backendLayout.addWidget(self.backendCombo)
+        self.interpolationLayout.addWidget(self.backendWidget)
+        
         # Interpolation Mode
         self.modeWidget = QtWidgets.QWidget()
         self.modeLayout = QtWidgets.QHBoxLayout(self.modeWidget)
@@ -140,9 +239,26 @@ class Ui_Form(object):
         self.overlapCheckBox = QtWidgets.QCheckBox("Only Generate Overlap Cells")
         self.volumeLayout.addWidget(self.overlapCheckBox)
 
+        # Volumes de corte e aterro por célula
+        self.volumesCheckBox = QtWidgets.QCheckBox("Compute cut/fill volumes against DEM")
+        self.volumeLayout.addWidget(self.volumesCheckBox)
+        self.volumeDemLabel = QtWidgets.QLabel("Input DEM")
+        self.volumeLayout.addWidget(self.volumeDemLabel)
+        self.volumeDemLayerCombo = QtWidgets.QComboBox()
+        self.volumeDemLayerCombo.setEnabled(False)
+        self.volumeLayout.addWidget(self.volumeDemLayerCombo)
+
+        # Grade virtual: raster de ids e tabela em vez de polígonos
+        self.virtualGridCheckBox = QtWidgets.QCheckBox("Raster-aligned virtual grid (no polygons)")
+        self.volumeLayout.addWidget(self.virtualGridCheckBox)
+
         # Add Generate Grid button
         self.generateGridButton = QtWidgets.QPushButton("Generate Grid")
         self.volumeLayout.addWidget(self.generateGridButton)
+
+        # Polígonos da grade virtual, só para a seleção ou a vista do mapa
+        self.buildCellsButton = QtWidgets.QPushButton("Build Cell Polygons")
+        self.volumeLayout.addWidget(self.buildCellsButton)
         
         # Spacer for second tab
         spacerVolume = QtWidgets.QSpacerItem(20, 40, QtWidgets.QSizePolicy.Minimum, QtWidgets.QSizePolicy.Expanding)
@@ -151,6 +267,11 @@ class Ui_Form(object):
         # Run button (outside tabs)
         self.runButton = QtWidgets.QPushButton("Generate")
         self.mainLayout.addWidget(self.runButton)
+
+        # Cancel button, enabled while a DEM is being generated
+        self.cancelButton = QtWidgets.QPushButton("Cancel")
+        self.cancelButton.setEnabled(False)
+        self.mainLayout.addWidget(self.cancelButton)
         
         # Progress bar and status label (outside tabs)
         self.statusLabel = QtWidgets.QLabel("Ready")
@@ -167,6 +288,10 @@ class Ui_Form(object):
         self.nodeBasedRadio.toggled.connect(self.onProfileOptionChanged)
         self.distanceIntervalRadio.toggled.connect(self.onProfileOptionChanged)
         self.interpolateCheckBox.toggled.connect(self.interpolationGroup.setVisible)
+        self.tiledCheckBox.toggled.connect(self.memoryBudgetInput.setEnabled)
+        self.cogCheckBox.toggled.connect(self.cogCompressionCombo.setEnabled)
+        self.cogCheckBox.toggled.connect(self.cogThreadsCheckBox.setEnabled)
+        self.volumesCheckBox.toggled.connect(self.volumeDemLayerCombo.setEnabled)
         
     def retranslateUi(self, Form):
         _translate = QtCore.QCoreApplication.translate
@@ -0,0 +1,190 @@
+"""
+In-process gap-fill backends for the raw profile DEM.
+
+These are alternatives to GRASS r.fill.stats that run inside the QGIS
+process with NumPy or GDAL, without setting up a temporary GRASS location.
+"""
+import math
+
+import numpy as np
+from osgeo import gdal
+
+
+FILL_BACKENDS = ('grass', 'numpy', 'gdal')
+
+# Target cells processed per batch by the median and mode statistics
+STATS_BATCH_CELLS = 200_000
+
+
+def window_offsets(distance):
+    """
+    (row, col) offsets and their distances, in cells, of the circular search
+    window used by r.fill.stats. As in r.fill.stats the window always holds
+    at least the full 3x3 neighbourhood (8 cells), whatever the distance.
+    """
+    radius = max(float(distance), math.sqrt(2.0))
+    reach = int(math.ceil(radius))
+    dr, dc = np.mgrid[-reach:reach + 1, -reach:reach + 1]
+    dist = np.hypot(dr, dc)
+    inside = (dist <= radius) & (dist > 0)
+    return dr[inside], dc[inside], dist[inside]
+
+
+def window_reach(distance):
+    """Largest row or column offset, in cells, of the search window."""
+    dr, dc, _ = window_offsets(distance)
+    return int(max(np.abs(dr).max(), np.abs(dc).max()))
+
+
+def check_cells(cells, distance):
+    """Raise ValueError when `cells` valid values can never fit in the search window."""
+    capacity = window_offsets(distance)[0].size
+    if int(cells) > capacity:
+        raise ValueError(f"cells={cells} can never be reached: a search distance of {distance} "
+                         f"holds at most {capacity} cells")
+    return capacity
+
+
+def _shifted(array, dr, dc, fill):
+    """array shifted so that out[r, c] == array[r + dr, c + dc]."""
+    rows, cols = array.shape
+    out = np.full(array.shape, fill, dtype=array.dtype)
+    r0, r1 = max(0, -dr), min(rows, rows - dr)
+    c0, c1 = max(0, -dc), min(cols, cols - dc)
+    if r0 < r1 and c0 < c1:
+        out[r0:r1, c0:c1] = array[r0 + dr:r1 + dr, c0 + dc:c1 + dc]
+    return out
+
+
+def fill_array(array, no_data, mode='wmean', power=2.0, cells=6, distance=0.5):
+    """
+    Fill the NoData cells of array with a statistic of the valid cells in a
+    circular window, following r.fill.stats:
+
+    - wmean: inverse distance weighted mean with the given power
+    - mean, median, mode: plain statistics of the window values
+
+    A cell is only filled when at least `cells` valid values fall inside the
+    window; otherwise it stays NoData. Original data cells are kept as they
+    are. Returns a new float32 array. Raises ValueError when `cells` is
+    larger than the window can hold, since nothing would ever be filled.
+    """
+    check_cells(cells, distance)
+    data = np.asarray(array, dtype=np.float64)
+    if no_data is None or np.isnan(no_data):
+        valid = ~np.isnan(data)
+    else:
+        valid = data != no_data
+    values = np.where(valid, data, np.nan)
+    targets = ~valid
+
+    dr, dc, dist = window_offsets(distance)
+
+    # Valid neighbour count for every cell
+    count = np.zeros(data.shape, dtype=np.int32)
+    for r, c in zip(dr, dc):
+        count += _shifted(valid, r, c, False)
+    fillable = targets & (count >= max(int(cells), 1))
+
+    result = data.astype(np.float32)
+    result[targets] = no_data
+    if not fillable.any():
+        return result
+
+    if mode in ('wmean', 'mean'):
+        weighted = np.zeros(data.shape, dtype=np.float64)
+        weights = np.zeros(data.shape, dtype=np.float64)
+        for r, c, d in zip(dr, dc, dist):
+            w = 1.0 / d ** power if mode == 'wmean' else 1.0
+            shifted = _shifted(values, r, c, np.nan)
+            ok = ~np.isnan(shifted)
+            weighted[ok] += shifted[ok] * w
+            weights[ok] += w
+        result[fillable] = (weighted[fillable] / weights[fillable]).astype(np.float32)
+        return result
+
+    if mode not in ('median', 'mode'):
+        raise ValueError(f"Unknown fill mode: {mode}")
+
+    # Median and mode need the window values of each target cell side by side
+    padded_reach = int(max(np.abs(dr).max(), np.abs(dc).max()))
+    padded = np.pad(values, padded_reach, constant_values=np.nan)
+    target_r, target_c = np.nonzero(fillable)
+    for lo in range(0, target_r.size, STATS_BATCH_CELLS):
+        tr = target_r[lo:lo + STATS_BATCH_CELLS] + padded_reach
+        tc = target_c[lo:lo + STATS_BATCH_CELLS] + padded_reach
+        window = padded[tr[:, None] + dr[None, :], tc[:, None] + dc[None, :]]
+        if mode == 'median':
+            stat = np.nanmedian(window, axis=1)
+        else:
+            stat = _nanmode(window)
+        result[tr - padded_reach, tc - padded_reach] = stat.astype(np.float32)
+    return result
+
+
+def _nanmode(window):
+    """Most frequent non-NaN value of each row; ties go to the smallest value."""
+    ordered = np.sort(window, axis=1)
+    n = ordered.shape[1]
+    # Length of the run of equal values starting at each position
+    same = ordered[:, 1:] == ordered[:, :-1]
+    run = np.ones(ordered.shape, dtype=np.int32)
+    for k in range(n - 2, -1, -1):
+        run[:, k] = np.where(same[:, k], run[:, k + 1] + 1, 1)
+    run[np.isnan(ordered)] = 0
+    best = np.argmax(run, axis=1)
+    return ordered[np.arange(ordered.shape[0]), best]
+
+
+def _write_like(reference_ds, output_path, array, no_data):
+    driver = gdal.GetDriverByName('GTiff')
+    out = driver.Create(output_path, reference_ds.RasterXSize, reference_ds.RasterYSize, 1, gdal.GDT_Float32)
+    out.SetGeoTransform(reference_ds.GetGeoTransform())
+    out.SetProjection(reference_ds.GetProjection())
+    band = out.GetRasterBand(1)
+    band.SetNoDataValue(no_data)
+    band.WriteArray(array)
+    band.FlushCache()
+    out = None
+
+
+def fill_raster_numpy(input_path, output_path, mode='wmean', power=2.0, cells=6, distance=0.5,
+                      default_no_data=-9999.0):
+    """
+    Fill the gaps of a single-band raster file with fill_array.
+    """
+    ds = gdal.Open(input_path, gdal.GA_ReadOnly)
+    if ds is None:
+        raise IOError(f"Could not open raster: {input_path}")
+    band = ds.GetRasterBand(1)
+    no_data = band.GetNoDataValue()
+    if no_data is None:
+        no_data = default_no_data
+    filled = fill_array(band.ReadAsArray(), no_data, mode=mode, power=power, cells=cells, distance=distance)
+    _write_like(ds, output_path, filled, no_data)
+    ds = None
+    return output_path
+
+
+def fill_raster_gdal(input_path, output_path, distance=0.5, smoothing_iterations=0,
+                     default_no_data=-9999.0):
+    """
+    Fill the gaps of a single-band raster file with gdal.FillNodata
+    (inverse distance weighting), searching up to `distance` cells away.
+    """
+    ds = gdal.Open(input_path, gdal.GA_ReadOnly)
+    if ds is None:
+        raise IOError(f"Could not open raster: {input_path}")
+    no_data = ds.GetRasterBand(1).GetNoDataValue()
+    if no_data is None:
+        no_data = default_no_data
+
+    driver = gdal.GetDriverByName('GTiff')
+    out = driver.CreateCopy(output_path, ds)
+    ds = None
+    band = out.GetRasterBand(1)
+    band.SetNoDataValue(no_data)
+    gdal.FillNodata(band, None, max(float(distance), 1.0), smoothing_iterations)
+    band.FlushCache()
+    out = None
+    return output_path
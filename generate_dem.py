@@ -19,12 +19,21 @@ from qgis.analysis import QgsRasterCalculator, QgsRasterCalculatorEntry
 from PyQt5.QtCore import QCoreApplication, QVariant
 import numpy as np
 import math
+import time
 import traceback
 from osgeo import gdal, ogr
 from processing.core.Processing import Processing
 import processing
 import os
 
+from .engine import (StableBeachProfiles, build_pair_profiles, check_output_format, lines_extent,
+                     open_dem_sampler, pair_line_features, remove_partial_outputs, snapshot_outputs,
+                     write_profile_outputs)
+from .geopackage import layer_display_name
+from .gap_fill import FILL_BACKENDS, fill_raster_gdal, fill_raster_numpy
+from .raster_io import clip_to_mask
+from .run_report import RunCancelled, RunReport, log
+
 
 def get_elevation_at_point(point, dem_provider, no_data):
     try:
@@ -34,402 +43,146 @@ def get_elevation_at_point(point, dem_provider, no_data):
             value = result[1]
             if value != no_data and isinstance(value, (int, float)):
                 return float(value)
-            
-        print(f"No valid elevation at point ({point.x()}, {point.y()})")
+
         return None
         
     except Exception as e:
-        print(f"Error getting elevation at point ({point.x()}, {point.y()}): {str(e)}")
+        log.debug(f"Error getting elevation at point ({point.x()}, {point.y()}): {str(e)}")
         return None
 
 
-def create_mask_polygon(output_path, points_layer):
+class ProviderSampler:
     """
-    Cria um polígono conectando os pontos pelo vertex_ind
+    Elevation sampler over a QGIS raster provider, for DEMs GDAL cannot open
+    directly. Same interface as DemWindowSampler.sample, one identify call
+    per point; with a report, each call reports its progress (and can be
+    cancelled) through it.
     """
-    try:
-        base_path = os.path.splitext(output_path)[0]
-        mask_path = f"{base_path}_mask.shp"
-        
-        # Criar campos para a camada de polígono
-        fields = QgsFields()
-        fields.append(QgsField('id', QVariant.Int))
-        
-        # Criar writer para o shapefile de polígono
-        writer = QgsVectorFileWriter(
-            mask_path, 'UTF-8', fields, QgsWkbTypes.Polygon,
-            points_layer.crs(), 'ESRI Shapefile'
-        )
-        
-        # Verificar se o campo vertex_ind existe
-        field_index = points_layer.fields().indexOf('vertex_ind')  # Corrigido aqui
-        if field_index == -1:
-            print("Field 'vertex_ind' not found in layer")
-            for field in points_layer.fields():
-                print(f"Available field: {field.name()}")
-            return None
-        
-        # Obter todos os pontos e ordená-los por vertex_ind
-        points = []
-        for feature in points_layer.getFeatures():
-            vertex_ind = feature.attributes()[field_index]  # Corrigido aqui
-            if vertex_ind is not None:
-                points.append({
-                    'vertex_ind': vertex_ind,
-                    'point': feature.geometry().asPoint()
-                })
-                print(f"Added point with vertex_ind: {vertex_ind}")
-        
-        # Verificar se temos pontos
-        if not points:
-            print("No points found to create mask")
-            return None
-            
-        # Ordenar pontos por vertex_ind
-        points.sort(key=lambda x: x['vertex_ind'])
-        print(f"Sorted {len(points)} points")
-        
-        # Criar lista de pontos para o polígono
-        polygon_points = []
-        for point_data in points:
-            polygon_points.append(point_data['point'])
-            print(f"Adding point to polygon: {point_data['point'].x()}, {point_data['point'].y()}")
-        
-        # Fechar o polígono adicionando o primeiro ponto novamente
-        if polygon_points:
-            polygon_points.append(polygon_points[0])
-            print("Closed polygon by adding first point")
-        
-        # Criar feature do polígono
-        feat = QgsFeature()
-        feat.setGeometry(QgsGeometry.fromPolygonXY([polygon_points]))
-        feat.setAttributes([1])  # ID do polígono
-        result = writer.addFeature(feat)
-        print(f"Feature added to writer: {result}")
-        
-        del writer
-        
-        # Carregar a camada no projeto
-        mask_layer = QgsVectorLayer(mask_path, os.path.splitext(os.path.basename(mask_path))[0], 'ogr')
-        if mask_layer.isValid():
-            QgsProject.instance().addMapLayer(mask_layer)
-            print(f"Mask layer created and loaded successfully: {mask_path}")
-        else:
-            print("Error loading mask layer")
-        
-        return mask_path
-        
-    except Exception as e:
-        print(f"Error creating mask polygon: {str(e)}")
-        print(traceback.format_exc())
-        return None
+
+    def __init__(self, dem_provider, no_data, report=None):
+        self.dem_provider = dem_provider
+        self.no_data = no_data
+        self.report = report
+
+    def sample(self, xs, ys):
+        values = np.full(len(xs), np.nan, dtype=np.float64)
+        for i, (x, y) in enumerate(zip(xs, ys)):
+            if self.report is not None:
+                self.report.progress(i, len(xs), 'points')
+            value = get_elevation_at_point(QgsPointXY(x, y), self.dem_provider, self.no_data)
+            if value is not None:
+                values[i] = value
+        return values
+
+
+def load_vector_layer(path):
+    """Add the vector layer at path (a file or GeoPackage layer path) to the project."""
+    layer = QgsVectorLayer(path, layer_display_name(path), 'ogr')
+    if layer.isValid():
+        QgsProject.instance().addMapLayer(layer)
+        print(f"Layer loaded: {path}")
+    else:
+        print(f"Error loading layer: {path}")
+    return layer
 
 
-def create_profile_points_layer(output_path, profiles_data, crs, dem_provider, no_data):
+def layer_line_features(layer, key_field=None):
     """
-    Cria uma camada de pontos com as elevações inicial e final dos perfis
+    Every feature of a line layer as (key, parts), like
+    engine.read_line_features: key is the key_field value (the feature id
+    without one) and parts the vertex lists of line_parts.
     """
-    base_path = os.path.splitext(output_path)[0]
-    points_path = f"{base_path}_profile_points.shp"
-    
-    fields = QgsFields()
-    fields.append(QgsField('ProfNumb', QVariant.Int))
-    fields.append(QgsField('PointType', QVariant.String))
-    fields.append(QgsField('Elevation', QVariant.Double, 'double', 10, 3))
-    fields.append(QgsField('X', QVariant.Double, 'double', 10, 3))
-    fields.append(QgsField('Y', QVariant.Double, 'double', 10, 3))
-    fields.append(QgsField('vertex_ind', QVariant.Int))  # Nova coluna
-    
-    writer = QgsVectorFileWriter(
-        points_path, 'UTF-8', fields, QgsWkbTypes.Point,
-        crs, 'ESRI Shapefile'
-    )
-    
-    # Carregar o shapefile dos perfis para obter as elevações finais
-    profiles_path = f"{base_path}_input_dem_profile_points.shp"
-    profiles_layer = QgsVectorLayer(profiles_path, "temp_profiles", "ogr")
-    
-    # Armazenar temporariamente os pontos para ordenação
-    start_points = []
-    end_points = []
-    
-    # Primeiro, coletar todos os pontos
-    for i, (start_point, end_point) in enumerate(profiles_data, 1):
-        # Ponto inicial
-        start_elev = get_elevation_at_point(start_point, dem_provider, no_data)
-        start_points.append({
-            'point': start_point,
-            'profnum': i,
-            'elev': start_elev if start_elev is not None else no_data,
-            'y': start_point.y()
-        })
-        
-        # Ponto final
-        profile_features = profiles_layer.getFeatures(f"ProfNumb = {i}")
-        profile_feat = next(profile_features)
-        end_elev = profile_feat['FinElev']
-        end_points.append({
-            'point': end_point,
-            'profnum': i,
-            'elev': end_elev,
-            'y': end_point.y()
-        })
-    
-    # Ordenar pontos iniciais por Y (de baixo para cima)
-    start_points.sort(key=lambda x: x['y'])
-    # Ordenar pontos finais por Y (de cima para baixo)
-    end_points.sort(key=lambda x: x['y'], reverse=True)
-    
-    # Criar features com vertex_ind
-    vertex_ind = 1
-    
-    # Adicionar pontos iniciais
-    for point_data in start_points:
-        feat = QgsFeature()
-        feat.setGeometry(QgsGeometry.fromPointXY(point_data['point']))
-        feat.setAttributes([
-            point_data['profnum'],
-            'Start',
-            point_data['elev'],
-            point_data['point'].x(),
-            point_data['point'].y(),
-            vertex_ind
-        ])
-        writer.addFeature(feat)
-        vertex_ind += 1
-    
-    # Adicionar pontos finais
-    for point_data in end_points:
-        feat = QgsFeature()
-        feat.setGeometry(QgsGeometry.fromPointXY(point_data['point']))
-        feat.setAttributes([
-            point_data['profnum'],
-            'End',
-            point_data['elev'],
-            point_data['point'].x(),
-            point_data['point'].y(),
-            vertex_ind
-        ])
-        writer.addFeature(feat)
-        vertex_ind += 1
-    
-    del writer
-    
-    # Carregar a camada no projeto
-    points_layer = QgsVectorLayer(points_path, os.path.splitext(os.path.basename(points_path))[0], 'ogr')
-    QgsProject.instance().addMapLayer(points_layer)
-    
-    # Criar a máscara de polígono
-    mask_path = create_mask_polygon(output_path, points_layer)
-    
-    return points_path, mask_path
-
-
-
-def interpolate_points_by_distance(geometry, distance):
+    features = []
+    for feat in layer.getFeatures():
+        geometry = feat.geometry()
+        if geometry is None or geometry.isEmpty():
+            continue
+        key = feat[key_field] if key_field else feat.id()
+        features.append((key, line_parts(geometry)))
+    return features
+
+
+def line_parts(geometry):
     """
-    Generate points along a line geometry at regular intervals
+    Vertex coordinates of each part of a (multi)line geometry as (xs, ys) lists
     """
-    points = []
-    
     if geometry.isMultipart():
         lines = geometry.asMultiPolyline()
     else:
         lines = [geometry.asPolyline()]
-    
-    for line in lines:
-        total_length = 0
-        for i in range(len(line) - 1):
-            segment = QgsGeometry.fromPolylineXY([QgsPointXY(line[i]), QgsPointXY(line[i + 1])])
-            total_length += segment.length()
-        
-        num_intervals = max(int(total_length / distance), 1)
-        
-        for i in range(num_intervals + 1):
-            dist_along = (i * total_length) / num_intervals if i < num_intervals else total_length
-            
-            current_dist = 0
-            for j in range(len(line) - 1):
-                segment = QgsGeometry.fromPolylineXY([QgsPointXY(line[j]), QgsPointXY(line[j + 1])])
-                segment_length = segment.length()
-                
-                if current_dist + segment_length >= dist_along:
-                    segment_fraction = (dist_along - current_dist) / segment_length
-                    x = line[j].x() + (line[j + 1].x() - line[j].x()) * segment_fraction
-                    y = line[j].y() + (line[j + 1].y() - line[j].y()) * segment_fraction
-                    points.append(QgsPointXY(x, y))
-                    break
-                
-                current_dist += segment_length
-    
-    return points
-
-def get_profile_points(geometry, interval=None):
-    """
-    Get points along the line either by nodes or by distance interval
-    """
-    if interval is None or interval <= 0:
-        # Node-based method
-        if geometry.isMultipart():
-            points = [QgsPointXY(p) for line in geometry.asMultiPolyline() for p in line]
-        else:
-            points = [QgsPointXY(p) for p in geometry.asPolyline()]
-    else:
-        # Distance-based method
-        points = interpolate_points_by_distance(geometry, interval)
-    
-    print(f"Generated {len(points)} profile points")
-    return points
-
-def find_closest_point_on_line(point, line_geometry):
-    """
-    Encontra o ponto mais próximo na linha B para um dado ponto da linha A
-    """
-    closest_point = line_geometry.nearestPoint(QgsGeometry.fromPointXY(point))
-    return closest_point.asPoint()
+    return [([p.x() for p in line], [p.y() for p in line]) for line in lines]
 
-def calculate_direction(point_a, point_b):
-    """
-    Calcula a direção entre dois pontos em graus (0 = Norte, 90 = Leste)
-    """
-    dx = point_b.x() - point_a.x()
-    dy = point_b.y() - point_a.y()
-    angle = math.degrees(math.atan2(dx, dy))
-    if angle < 0:
-        angle += 360
-    return angle
-
-def calculate_profile_azimuth(start_point, end_point):
-    """
-    Calcula o azimute do perfil em graus (0-360)
-    """
-    dx = end_point.x() - start_point.x()
-    dy = end_point.y() - start_point.y()
-    angle = math.degrees(math.atan2(dx, dy))
-    if angle < 0:
-        angle += 360
-    return angle
-
-def calculate_profile_length(start_point, end_point):
-    """
-    Calcula o comprimento do perfil em metros
-    """
-    dx = end_point.x() - start_point.x()
-    dy = end_point.y() - start_point.y()
-    return math.sqrt(dx * dx + dy * dy)
 
-def create_profiles_shapefile(output_path, profiles_data, crs, dem_provider, no_data, slope=None):
+def generate_stable_beach_dem(dem_layer, line_a, line_b, slope, output_path, distance_interval=None,
+                              tile_memory_mb=None, bigtiff=False, sparse=False, analytic_surface=False,
+                              report=None, load_layers=True, pair_field=None, workers=None,
+                              incremental=False, scenarios=None, geopackage=False):
     """
-    Cria um shapefile com as linhas dos perfis e seus atributos
+    Gera o DEM da praia estável a partir dos perfis entre a linha A e a linha B.
+
+    QGIS adapter over the engine: reads the layers, builds the
+    StableBeachProfiles (through the QGIS provider when GDAL cannot read
+    the DEM), writes them with engine.write_profile_outputs and loads the
+    vector outputs into the project.
+
+    With tile_memory_mb set, the raster is written as a tiled GeoTIFF one
+    tile at a time, with the tile size chosen so that the working memory
+    stays within that budget; bigtiff forces the BigTIFF format. With
+    sparse, only the blocks the profiles touch are allocated and stored.
+
+    With analytic_surface, the complete surface between neighbouring
+    profiles is also written to <output>_surface.tif in the same pass, so
+    no gap filling or cropping is needed.
+
+    report: RunReport that receives the stage timings and counters. When
+    None, a report covering this function is written to
+    <output>_run_report.json.
+
+    load_layers: add the points and mask layers to the current project.
+    Must be False when running outside the main thread (e.g. Processing).
+
+    Every Line A feature is paired with a Line B feature, by equal
+    pair_field values when given or else by proximity. The pairs are
+    processed on a pool of `workers` threads and merged into one set of
+    outputs; where pairs overlap, the first pair keeps the cell.
+
+    With incremental, a run over the outputs of an earlier incremental run
+    only rasterizes again the tiles of the profiles that changed and patches
+    the DEM, analytic surface and vector files in place (see the
+    incremental module); the windows rewritten are kept in the state
+    sidecar for the surface refill.
+
+    scenarios: list of (slope, offset) pairs. Each becomes one band of
+    <output>_scenarios.tif (and of <output>_scenarios_surface.tif with
+    analytic_surface), from the same profile traversal. With
+    analytic_surface their cut / fill volumes against the DEM go to
+    <output>_scenarios_volumes.csv; the raw bands only cover the profile
+    traces, so there is no volume table without it. The volume table also
+    needs a DEM GDAL can read.
+
+    With geopackage, the profiles, points and mask are written as tables
+    of <output>.gpkg (replaced by the run) instead of shapefiles, and the
+    returned profiles path is a "<file>|layername=<table>" path. The
+    rasters stay GeoTIFF so they can be filled and cropped; move them into
+    the container afterwards with engine.pack_raster_outputs. Not
+    available with incremental.
+
+    Calling report.cancel() from another thread stops the run at its next
+    progress check; the files written so far are removed and
+    (False, "Cancelled by user", None) is returned.
     """
+    own_report = report is None
+    if own_report:
+        report = RunReport().start()
+    report.set_parameters(
+        slope=slope, distance_interval=distance_interval, tile_memory_mb=tile_memory_mb,
+        bigtiff=bigtiff, sparse=sparse, analytic_surface=analytic_surface,
+        pair_field=pair_field, workers=workers, incremental=incremental,
+        scenarios=[list(scenario) for scenario in scenarios or []], geopackage=geopackage
+    )
+    snapshot = snapshot_outputs([output_path])
     try:
-        print("Starting profiles shapefile creation...")
-        
-        base_path = os.path.splitext(output_path)[0]
-        profiles_path = f"{base_path}_input_dem_profile_points.shp"
-        print(f"Profiles will be saved to: {profiles_path}")
-        
-        # Remover arquivos existentes
-        for ext in ['.shp', '.shx', '.dbf', '.prj']:
-            old_file = f"{base_path}_profiles{ext}"
-            if os.path.exists(old_file):
-                try:
-                    os.remove(old_file)
-                    print(f"Removed existing file: {old_file}")
-                except Exception as e:
-                    print(f"Warning: Could not remove existing file {old_file}: {str(e)}")
-        
-        # Criar campos com precisão específica para controlar as casas decimais
-        fields = QgsFields()
-        fields.append(QgsField('ProfNumb', QVariant.Int))
-        fields.append(QgsField('ProfileAz', QVariant.Double, 'double', 10, 3))
-        fields.append(QgsField('IniElev', QVariant.Double, 'double', 10, 3))
-        fields.append(QgsField('FinElev', QVariant.Double, 'double', 10, 3))
-        fields.append(QgsField('Dist_profile', QVariant.Double, 'double', 10, 3))
-        
-        # Criar layer em memória primeiro
-        memory_layer = QgsVectorLayer("LineString?crs=" + crs.authid(), "profiles", "memory")
-        memory_provider = memory_layer.dataProvider()
-        memory_provider.addAttributes(fields.toList())
-        memory_layer.updateFields()
-        
-        # Adicionar features
-        features = []
-        for i, (start_point, end_point) in enumerate(profiles_data, start=1):
-            # Verificar se os pontos são válidos
-            if not (start_point and end_point):
-                print(f"Warning: Invalid points for profile {i}")
-                continue
-                
-            # Criar geometria
-            line_geom = QgsGeometry.fromPolylineXY([start_point, end_point])
-            if not line_geom.isGeosValid():
-                print(f"Warning: Invalid geometry for profile {i}")
-                continue
-            
-            # Obter elevações com validação extra
-            ini_elev = get_elevation_at_point(start_point, dem_provider, no_data)
-            fin_elev = get_elevation_at_point(end_point, dem_provider, no_data)
-            
-            if ini_elev is None:
-                print(f"Warning: No initial elevation for profile {i}")
-                ini_elev = no_data
-            if fin_elev is None:
-                if slope is not None and ini_elev != no_data:
-                    distance = calculate_profile_length(start_point, end_point)
-                    fin_elev = ini_elev - (distance * math.tan(math.radians(slope)))
-                else:
-                    fin_elev = no_data
-            
-            # Calcular outros atributos
-            profile_az = calculate_profile_azimuth(start_point, end_point)
-            dist_profile = calculate_profile_length(start_point, end_point)
-            
-            # Criar e configurar feature
-            feat = QgsFeature()
-            feat.setGeometry(line_geom)
-            feat.setAttributes([
-                i,                              # ProfNumb
-                float(round(profile_az, 3)),    # ProfileAz
-                float(round(ini_elev, 3)),      # IniElev
-                float(round(fin_elev, 3)),      # FinElev
-                float(round(dist_profile, 3))   # Dist_profile
-            ])
-            
-            features.append(feat)
-        
-        # Adicionar todas as features à camada em memória
-        memory_provider.addFeatures(features)
-        
-        # Salvar como shapefile
-        print(f"Saving {len(features)} features to shapefile...")
-        options = QgsVectorFileWriter.SaveVectorOptions()
-        options.driverName = "ESRI Shapefile"
-        options.fileEncoding = "UTF-8"
-        options.layerOptions = ['DECIMAL_POINT=.']
-        
-        write_result = QgsVectorFileWriter.writeAsVectorFormat(
-            memory_layer,
-            profiles_path,
-            "UTF-8",
-            crs,
-            "ESRI Shapefile",
-            layerOptions=['DECIMAL_POINT=.']
-        )
-        
-        if write_result[0] != QgsVectorFileWriter.NoError:
-            raise Exception(f"Error saving shapefile: {write_result}")
-
-        print(f"Shapefile created successfully with {len(features)} profiles!")
-        return profiles_path
-
-    except Exception as e:
-        print(f"Error in create_profiles_shapefile: {str(e)}")
-        print(traceback.format_exc())
-        return None
-
-def generate_stable_beach_dem(dem_layer, line_a, line_b, slope, output_path, distance_interval=None):
-    try:
+        check_output_format(incremental, geopackage)
         print("Starting DEM generation process")
         if distance_interval:
             print(f"Using distance-based interval: {distance_interval}m")
@@ -440,156 +193,104 @@ def generate_stable_beach_dem(dem_layer, line_a, line_b, slope, output_path, dis
         dem_extent = dem_layer.extent()
         pixel_size_x = dem_extent.width() / provider.xSize()
         pixel_size_y = dem_extent.height() / provider.ySize()
+        projection = dem_layer.crs().toWkt()
 
         no_data = provider.sourceNoDataValue(1) or -9999.0
         print(f"Using NoData value: {no_data}")
 
-        # Get geometries
-        line_a_geom = list(line_a.getFeatures())[0].geometry()
-        line_b_geom = list(line_b.getFeatures())[0].geometry()
-
-        # Get profile points based on selected method
-        profile_points = get_profile_points(line_a_geom, distance_interval)
-        print(f"Generated {len(profile_points)} profile points")
+        with report.stage('profiles'):
+            # Get geometries
+            features_a = layer_line_features(line_a, pair_field)
+            features_b = layer_line_features(line_b, pair_field)
+            pairs = pair_line_features(features_a, features_b, by_key=pair_field is not None)
+            if not pairs:
+                raise ValueError("No Line A / Line B feature pairs found")
+            report.count('feature_pairs', len(pairs))
+            print(f"Processing {len(pairs)} Line A / Line B feature pairs")
+
+            # Each worker reads the DEM window under its own pair with GDAL;
+            # other providers are sampled through QGIS, one pair at a time
+            if provider.name() == 'gdal':
+                dem = dem_layer.source()
+            else:
+                dem = ProviderSampler(provider, no_data, report)
+                workers = 1
+
+            # Grelha comum a todos os pares, para que os perfis possam ser juntos
+            extent = lines_extent(*[features_a[i][1] for i, _ in pairs], *[features_b[j][1] for _, j in pairs])
+            profiles = StableBeachProfiles.merge(build_pair_profiles(
+                pairs, features_a, features_b, dem, slope, pixel_size_x, pixel_size_y,
+                no_data=no_data, distance_interval=distance_interval, extent=extent,
+                workers=workers, use_processes=False,
+                progress=lambda done, total: report.progress(done, total, 'pairs'),
+                tile_memory_mb=tile_memory_mb
+            ))
+        profiles.count_into(report)
+
+        dem_sampler = None
+        if scenarios and analytic_surface:
+            if provider.name() == 'gdal':
+                dem_sampler = open_dem_sampler(dem_layer.source(), profiles.extent, no_data, tile_memory_mb)
+            else:
+                print("Scenario volumes need a GDAL DEM; writing the scenario rasters only")
+
+        outputs, _ = write_profile_outputs(
+            profiles, output_path, projection, tile_memory_mb, bigtiff, sparse,
+            analytic_surface=analytic_surface, incremental=incremental, scenarios=scenarios,
+            dem_sampler=dem_sampler, geopackage=geopackage, report=report
+        )
 
-        # Compute extent and dimensions
-        bbox = line_a_geom.boundingBox()
-        bbox.combineExtentWith(line_b_geom.boundingBox())
-        cols = max(int((bbox.xMaximum() - bbox.xMinimum()) / pixel_size_x), 1)
-        rows = max(int((bbox.yMaximum() - bbox.yMinimum()) / pixel_size_y), 1)
-
-        result_array = np.full((rows, cols), no_data, dtype=np.float32)
-        
-        slope_radians = math.radians(slope)
-        step_size = math.sqrt(pixel_size_x**2 + pixel_size_y**2)
-        elevation_step = math.tan(slope_radians) * step_size
-
-        # Lista para armazenar perfis
-        lines_for_shp = []
-
-        # Process each profile point
-        for start_point in profile_points:
-            # Get elevation at start point
-            elevation = get_elevation_at_point(start_point, provider, no_data)
-            if elevation == no_data:
-                continue
-
-            # Convert to raster coordinates
-            col = int((start_point.x() - bbox.xMinimum()) / pixel_size_x)
-            row = int((bbox.yMaximum() - start_point.y()) / pixel_size_y)
-            
-            # Find closest point on Line B
-            end_point = find_closest_point_on_line(start_point, line_b_geom)
-            lines_for_shp.append((start_point, end_point))
-            
-            # Calculate direction for this specific profile
-            direction = calculate_direction(start_point, end_point)
-            direction_radians = math.radians((450 - direction) % 360)
-            
-            # Calculate direction vector
-            dx = math.cos(direction_radians) * step_size
-            dy = -math.sin(direction_radians) * step_size
-
-            # Interpolate profile
-            current_elevation = elevation
-            current_row = float(row)
-            current_col = float(col)
-            steps = 0
-            max_steps = int(math.sqrt(cols**2 + rows**2))
-
-            while steps < max_steps:
-                if not (0 <= int(round(current_row)) < rows and 
-                       0 <= int(round(current_col)) < cols):
-                    break
-
-                # Check if we reached line B
-                world_x = bbox.xMinimum() + current_col * pixel_size_x
-                world_y = bbox.yMaximum() - current_row * pixel_size_y
-                current_point = QgsPointXY(world_x, world_y)
-                if line_b_geom.distance(QgsGeometry.fromPointXY(current_point)) < pixel_size_x:
-                    break
-
-                # Update raster values
-                r = int(round(current_row))
-                c = int(round(current_col))
-                if result_array[r, c] == no_data:
-                    result_array[r, c] = current_elevation
-
-                # Fill surrounding pixels to avoid gaps
-                for r_offset in [-1, 0, 1]:
-                    for c_offset in [-1, 0, 1]:
-                        new_row = r + r_offset
-                        new_col = c + c_offset
-                        if (0 <= new_row < rows and 
-                            0 <= new_col < cols and 
-                            result_array[new_row, new_col] == no_data):
-                            result_array[new_row, new_col] = current_elevation
-
-                current_elevation -= elevation_step
-                current_row += dy / pixel_size_y
-                current_col += dx / pixel_size_x
-                steps += 1
-
-        # Save the DEM raster
-        driver = gdal.GetDriverByName('GTiff')
-        out_raster = driver.Create(output_path, cols, rows, 1, gdal.GDT_Float32)
-        geotransform = [
-            bbox.xMinimum(), pixel_size_x, 0,
-            bbox.yMaximum(), 0, -pixel_size_y
-        ]
-        out_raster.SetGeoTransform(geotransform)
-        out_raster.SetProjection(dem_layer.crs().toWkt())
-        out_band = out_raster.GetRasterBand(1)
-        out_band.SetNoDataValue(no_data)
-        out_band.WriteArray(result_array)
-        out_band.FlushCache()
-        out_raster = None
-
-        # Criar shapefile dos perfis
-        print(f"Number of profiles to create: {len(lines_for_shp)}")
-        profiles_path = None
-        if lines_for_shp:
-            try:
-                profiles_path = create_profiles_shapefile(
-                    output_path, 
-                    lines_for_shp, 
-                    dem_layer.crs(),
-                    provider,
-                    no_data,
-                    slope
-                )
-                if profiles_path:
-                    print(f"Profiles shapefile created at: {profiles_path}")
-                    # Criar camada de pontos e máscara
-                    points_path, mask_path = create_profile_points_layer(
-                        output_path,
-                        lines_for_shp,
-                        dem_layer.crs(),
-                        provider,
-                        no_data
-                    )
-                    print(f"Points layer created at: {points_path}")
-                    print(f"Mask layer created at: {mask_path}")
-                else:
-                    print("Failed to create profiles shapefile")
-            except Exception as e:
-                print(f"Error creating profiles shapefile: {str(e)}")
-                print(traceback.format_exc())
+        if load_layers:
+            for key in ('points', 'mask'):
+                if key in outputs:
+                    load_vector_layer(outputs[key])
 
         print("DEM generation completed!")
-        return True, "DEM generated successfully!", profiles_path
+        return True, "DEM generated successfully!", outputs.get('profiles')
+
+    except RunCancelled as e:
+        print(str(e))
+        remove_partial_outputs([output_path], snapshot)
+        return False, str(e), None
 
     except Exception as e:
         print(traceback.format_exc())
         return False, f"Error: {str(e)}", None
 
-def interpolate_surface(input_dem_path, output_surface_path, mode='wmean', power=2.0, cells=6, distance=0.5, no_nulls=True):
+    finally:
+        if own_report:
+            try:
+                report.finish().write(output_path)
+            except Exception as e:
+                print(f"Could not write run report: {str(e)}")
+
+def interpolate_surface(input_dem_path, output_surface_path, mode='wmean', power=2.0, cells=6, distance=0.5, no_nulls=True,
+                        backend='grass', feedback=None):
     """
-    Interpola uma superfície contínua usando r.fill.stats do GRASS
+    Interpola uma superfície contínua a partir dos perfis.
+
+    backend selects the gap-fill engine: 'grass' (r.fill.stats through
+    Processing), 'numpy' (in-process r.fill.stats equivalent) or 'gdal'
+    (gdal.FillNodata). The in-process backends always keep the original
+    profile cells, so no_nulls only applies to GRASS.
+
+    feedback: QgsProcessingFeedback passed on to the GRASS algorithm.
     """
     try:
         print("Starting surface interpolation...")
-        print(f"Parameters: mode={mode}, power={power}, cells={cells}, distance={distance}")
+        print(f"Parameters: backend={backend}, mode={mode}, power={power}, cells={cells}, distance={distance}")
+
+        if backend == 'numpy':
+            fill_raster_numpy(input_dem_path, output_surface_path, mode=mode, power=power,
+                              cells=cells, distance=distance)
+            print("Surface interpolation completed successfully!")
+            return True
+        if backend == 'gdal':
+            fill_raster_gdal(input_dem_path, output_surface_path, distance=distance)
+            print("Surface interpolation completed successfully!")
+            return True
+        if backend != 'grass':
+            raise ValueError(f"Unknown fill backend: {backend}")
         
         # Converter modo para número conforme r.fill.stats
         mode_map = {'wmean': 0, 'mean': 1, 'median': 2, 'mode': 3}
@@ -609,7 +310,8 @@ def interpolate_surface(input_dem_path, output_surface_path, mode='wmean', power
             'GRASS_RASTER_FORMAT_META': ''
         }
         
-        feedback = QgsProcessingFeedback()
+        if feedback is None:
+            feedback = QgsProcessingFeedback()
         result = processing.run("grass7:r.fill.stats", params, feedback=feedback)
         print("Surface interpolation completed successfully!")
         return True
@@ -618,37 +320,65 @@ def interpolate_surface(input_dem_path, output_surface_path, mode='wmean', power
         print(f"Error in surface interpolation: {str(e)}")
         print(traceback.format_exc())
         return False
-        
-def crop_surface_with_mask(surface_path, mask_path):
+
+
+def benchmark_fill_backends(input_dem_path, output_dir=None, mode='wmean', power=2.0, cells=6, distance=0.5,
+                            no_nulls=True, backends=FILL_BACKENDS):
+    """
+    Run every gap-fill backend on the same raw DEM and report the wall time of
+    each one and its speedup over GRASS. Intended to be called from the QGIS
+    Python console, where the GRASS provider is available.
+    """
+    if output_dir is None:
+        output_dir = os.path.dirname(input_dem_path)
+    base_name = os.path.splitext(os.path.basename(input_dem_path))[0]
+
+    timings = {}
+    for backend in backends:
+        output_path = os.path.join(output_dir, f"{base_name}_fill_{backend}.tif")
+        start = time.perf_counter()
+        ok = interpolate_surface(input_dem_path, output_path, mode=mode, power=power, cells=cells,
+                                 distance=distance, no_nulls=no_nulls, backend=backend)
+        timings[backend] = time.perf_counter() - start if ok else None
+
+    grass_time = timings.get('grass')
+    for backend, seconds in timings.items():
+        if seconds is None:
+            print(f"{backend:>6}: failed")
+        elif grass_time:
+            print(f"{backend:>6}: {seconds:8.3f} s  ({grass_time / seconds:6.1f}x vs grass)")
+        else:
+            print(f"{backend:>6}: {seconds:8.3f} s")
+    return timings
+
+
+def crop_surface_with_mask(surface_path, mask_path, output_path=None, load_layer=True, feedback=None,
+                           progress=None):
     """
     Recorta a superfície usando a máscara do polígono
+
+    output_path defaults to <surface>_cropped.tif. With load_layer False the
+    result is not added to the project. The crop runs in process (see
+    raster_io.clip_to_mask) and keeps the surface's NoData value.
+
+    progress: optional callable(blocks_done, total_blocks), e.g. a run
+    report's progress, which may raise RunCancelled. feedback: Processing
+    feedback that follows the blocks and can cancel the crop instead.
     """
     try:
         base_path = os.path.splitext(surface_path)[0]
-        cropped_path = f"{base_path}_cropped.tif"
-        
-        # Obter o valor NoData da camada original
-        original_layer = QgsRasterLayer(surface_path)
-        no_data = original_layer.dataProvider().sourceNoDataValue(1)
-        
-        params = {
-            'INPUT': surface_path,
-            'MASK': mask_path,
-            'SOURCE_CRS': None,
-            'TARGET_CRS': None,
-            'NODATA': no_data,  # Usar o mesmo valor NoData da camada original
-            'ALPHA_BAND': False,
-            'CROP_TO_CUTLINE': True,
-            'KEEP_RESOLUTION': True,
-            'SET_MASK_NO_DATA': True,  # Definir valores fora da máscara como NoData
-            'OPTIONS': '',
-            'DATA_TYPE': 0,
-            'OUTPUT': cropped_path
-        }
-        
+        cropped_path = output_path or f"{base_path}_cropped.tif"
+
+        if progress is None and feedback is not None:
+            def progress(done, total):
+                if feedback.isCanceled():
+                    raise RunCancelled("Cancelled by user")
+                feedback.setProgress(int(100 * done / total) if total else 100)
+
         print("Starting surface cropping...")
-        print(f"Using NoData value: {no_data}")
-        result = processing.run("gdal:cliprasterbymasklayer", params)
+        clip_to_mask(surface_path, mask_path, cropped_path, progress=progress)
+        if not load_layer:
+            return cropped_path
         
         # Carregar a camada recortada
         cropped_layer = QgsRasterLayer(cropped_path, os.path.splitext(os.path.basename(cropped_path))[0])
@@ -659,7 +389,10 @@ def crop_surface_with_mask(surface_path, mask_path):
         else:
             print("Error loading cropped surface")
             return None
-            
+
+    except RunCancelled:
+        raise
+
     except Exception as e:
         print(f"Error cropping surface: {str(e)}")
         print(traceback.format_exc())
@@ -0,0 +1,166 @@
+"""
+Single GeoPackage output container.
+
+With the GeoPackage option a run writes its vector layers straight into
+<output>.gpkg, each table in one transaction with an R-tree spatial index,
+and moves its rasters into the same file as raster tables once they are
+complete. Layers are addressed with the QGIS source syntax
+"<file>.gpkg|layername=<table>" and raster tables as
+"GPKG:<file>.gpkg:<table>", both of which QGIS and GDAL open directly.
+
+The rasters are still produced as GeoTIFF first, since the tiled and sparse
+writers, the gap fill and the crop update them in place.
+"""
+import os
+
+from osgeo import gdal, ogr, osr
+
+from .run_report import log
+
+
+LAYER_SEPARATOR = '|layername='
+
+# Ficheiros auxiliares do SQLite que acompanham o contentor
+SQLITE_SIDECARS = ('-wal', '-shm', '-journal')
+
+
+def layer_path(container_path, layer_name):
+    return f"{container_path}{LAYER_SEPARATOR}{layer_name}"
+
+
+def split_layer_path(path):
+    """(file, layer name) of a "<file>|layername=<name>" path; the layer is None for plain files."""
+    if LAYER_SEPARATOR in path:
+        file_path, layer_name = path.split(LAYER_SEPARATOR, 1)
+        return file_path, layer_name.split('|')[0]
+    return path.split('|')[0], None
+
+
+def open_layer(path):
+    """(dataset, layer) of a file or "<file>|layername=<table>" path, read only."""
+    file_path, layer_name = split_layer_path(path)
+    ds = ogr.Open(file_path)
+    if ds is None:
+        raise IOError(f"Could not open layer: {path}")
+    layer = ds.GetLayerByName(layer_name) if layer_name else ds.GetLayer(0)
+    if layer is None:
+        raise IOError(f"Could not open layer: {path}")
+    return ds, layer
+
+
+def layer_display_name(path):
+    """Layer name for the project: the table name, or the file name without extension."""
+    layer_name = split_layer_path(path)[1]
+    return layer_name or os.path.splitext(os.path.basename(path))[0]
+
+
+def raster_table_path(container_path, table):
+    return f"GPKG:{container_path}:{table}"
+
+
+def layer_file(path):
+    """File on disk behind a layer path or raster table source."""
+    if path.startswith('GPKG:'):
+        return path[len('GPKG:'):].rsplit(':', 1)[0]
+    return split_layer_path(path)[0]
+
+
+def reset_container(container_path):
+    """Remove the container (and its SQLite sidecars) so that a run starts from an empty file."""
+    for path in [container_path] + [container_path + suffix for suffix in SQLITE_SIDECARS]:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def create_layer(path, geometry_type, srs):
+    """
+    (dataset, layer) of a new table in the GeoPackage of a layer path,
+    creating the file if needed and replacing a table of the same name.
+    """
+    container_path, layer_name = split_layer_path(path)
+    ds = ogr.Open(container_path, 1) if os.path.exists(container_path) else None
+    if ds is None:
+        ds = ogr.GetDriverByName('GPKG').CreateDataSource(container_path)
+    if ds is None:
+        raise IOError(f"Could not open GeoPackage: {container_path}")
+    for index in range(ds.GetLayerCount()):
+        if ds.GetLayer(index).GetName() == layer_name:
+            ds.DeleteLayer(index)
+            break
+    layer = ds.CreateLayer(layer_name, srs, geometry_type, options=['SPATIAL_INDEX=YES'])
+    if layer is None:
+        raise IOError(f"Could not create layer {layer_name} in {container_path}")
+    return ds, layer
+
+
+def create_vector_layer(path, geometry_type, fields, projection):
+    """
+    (dataset, layer) of a new shapefile, or of a new GeoPackage table when
+    path is "<file>.gpkg|layername=<table>"; fields are (name, ogr type,
+    width, precision) tuples. An existing file or table at path is replaced.
+    """
+    srs = None
+    if projection:
+        srs = osr.SpatialReference()
+        srs.ImportFromWkt(projection)
+    if split_layer_path(path)[1] is not None:
+        ds, layer = create_layer(path, geometry_type, srs)
+    else:
+        driver = ogr.GetDriverByName('ESRI Shapefile')
+        if os.path.exists(path):
+            driver.DeleteDataSource(path)
+        ds = driver.CreateDataSource(path)
+        if ds is None:
+            raise IOError(f"Could not create vector file: {path}")
+        layer = ds.CreateLayer(os.path.splitext(os.path.basename(path))[0], srs, geometry_type)
+    for name, field_type, width, precision in fields:
+        field = ogr.FieldDefn(name, field_type)
+        if width:
+            field.SetWidth(width)
+            field.SetPrecision(precision)
+        layer.CreateField(field)
+    return ds, layer
+
+
+def write_raster_table(container_path, table, raster_path, band=None):
+    """
+    Copy a raster (one band of it with band) into the GeoPackage as the
+    raster table `table`. Float data is stored as a gridded coverage with
+    TIFF tiles, so the values and NoData are kept exactly.
+    """
+    options = [f'RASTER_TABLE={table}', 'TILE_FORMAT=TIFF']
+    if os.path.exists(container_path):
+        options.append('APPEND_SUBDATASET=YES')
+    result = gdal.Translate(container_path, raster_path, format='GPKG', creationOptions=options,
+                            bandList=[band] if band else None)
+    if result is None:
+        raise IOError(f"Could not write {raster_path} into {container_path}")
+    result = None
+    return raster_table_path(container_path, table)
+
+
+def pack_rasters(container_path, rasters, remove=True):
+    """
+    Move GeoTIFFs into the GeoPackage. rasters maps output keys to GeoTIFF
+    paths; missing files are skipped. A multi-band raster becomes one table
+    per band (<table>_1, <table>_2...). With remove, each GeoTIFF is
+    deleted once copied. Returns {key: raster table source, or a list of
+    them for multi-band rasters}.
+    """
+    packed = {}
+    for key, raster_path in rasters.items():
+        if not raster_path or not os.path.exists(raster_path):
+            continue
+        table = os.path.splitext(os.path.basename(raster_path))[0]
+        ds = gdal.Open(raster_path, gdal.GA_ReadOnly)
+        band_count = ds.RasterCount if ds is not None else 1
+        ds = None
+        if band_count > 1:
+            packed[key] = [write_raster_table(container_path, f"{table}_{band}", raster_path, band)
+                           for band in range(1, band_count + 1)]
+        else:
+            packed[key] = write_raster_table(container_path, table, raster_path)
+        log.info(f"Raster {raster_path} packed into {container_path}")
+        if remove:
+            os.remove(raster_path)
+    return packed
@@ -0,0 +1,245 @@
+"""
+Fast calculation grid: which cells to create, row by row, and a bulk
+shapefile writer for them.
+
+The mask is given as polygons made of closed (xs, ys) rings. For each grid
+row, the x intervals where the mask meets the row's band are found from its
+edges (the edge pieces inside the band, and the mask's crossings of the
+band's top and bottom lines), so the overlapping cells of a whole row come
+from a few interval tests instead of one geometry test per cell. Cell
+polygons are packed as WKB for a whole batch at once and written in one
+transaction per batch, so memory stays flat whatever the grid size.
+"""
+import numpy as np
+from osgeo import ogr
+
+from .geopackage import create_vector_layer
+from .grid_volumes import VOLUME_FIELDS
+
+
+# Células escritas por transação
+GRID_BATCH_SIZE = 50_000
+
+GRID_FIELDS = [
+    ('id', ogr.OFTInteger, 0, 0),
+    ('centroid_x', ogr.OFTReal, 0, 0),
+    ('centroid_y', ogr.OFTReal, 0, 0),
+    ('area', ogr.OFTReal, 0, 0),
+]
+
+# Little-endian WKB polygon with one closed 5-point ring
+_CELL_WKB = np.dtype([('order', 'u1'), ('type', '<u4'), ('rings', '<u4'), ('points', '<u4'),
+                      ('xy', '<f8', (10,))])
+
+
+def polygon_edges(rings):
+    """(x0, y0, x1, y1) arrays of every edge of a polygon's closed rings."""
+    parts = [[], [], [], []]
+    for xs, ys in rings:
+        xs = np.asarray(xs, dtype=np.float64)
+        ys = np.asarray(ys, dtype=np.float64)
+        parts[0].append(xs[:-1])
+        parts[1].append(ys[:-1])
+        parts[2].append(xs[1:])
+        parts[3].append(ys[1:])
+    return tuple(np.concatenate(part) if part else np.empty(0) for part in parts)
+
+
+def scanline_intervals(edges, y):
+    """(start, end) x intervals inside the polygon along the line at y (even-odd rule)."""
+    x0, y0, x1, y1 = edges
+    crossing = (y0 <= y) != (y1 <= y)
+    if not crossing.any():
+        return np.empty((0, 2))
+    t = (y - y0[crossing]) / (y1[crossing] - y0[crossing])
+    xs = np.sort(x0[crossing] + t * (x1[crossing] - x0[crossing]))
+    return xs.reshape(-1, 2)
+
+
+def band_intervals(edges, y_low, y_high):
+    """
+    x intervals of the part of the polygon between y_low and y_high,
+    unmerged. Every vertical line through that part crosses its boundary,
+    so the edge pieces inside the band plus the polygon's intervals along
+    both band lines cover it exactly.
+    """
+    x0, y0, x1, y1 = edges
+    inside = (np.maximum(y0, y1) >= y_low) & (np.minimum(y0, y1) <= y_high)
+    x0, y0, x1, y1 = x0[inside], y0[inside], x1[inside], y1[inside]
+
+    dy = y1 - y0
+    flat = dy == 0
+    safe_dy = np.where(flat, 1.0, dy)
+    # Parâmetro do troço dentro da faixa, de cada lado
+    t_low = np.clip((y_low - y0) / safe_dy, 0.0, 1.0)
+    t_high = np.clip((y_high - y0) / safe_dy, 0.0, 1.0)
+    t_low = np.where(flat, 0.0, t_low)
+    t_high = np.where(flat, 1.0, t_high)
+    xa = x0 + t_low * (x1 - x0)
+    xb = x0 + t_high * (x1 - x0)
+    pieces = np.column_stack((np.minimum(xa, xb), np.maximum(xa, xb)))
+    return np.concatenate((pieces, scanline_intervals(edges, y_low), scanline_intervals(edges, y_high)))
+
+
+def merge_intervals(intervals):
+    """Sorted union of closed intervals."""
+    if len(intervals) == 0:
+        return intervals
+    intervals = intervals[np.argsort(intervals[:, 0], kind='stable')]
+    ends = np.maximum.accumulate(intervals[:, 1])
+    # Novo grupo quando o início passa o fim de tudo o que veio antes
+    new_group = np.concatenate(([True], intervals[1:, 0] > ends[:-1]))
+    starts = np.flatnonzero(new_group)
+    group_ends = np.concatenate((starts[1:], [len(intervals)])) - 1
+    return np.column_stack((intervals[starts, 0], ends[group_ends]))
+
+
+def row_columns(polygons, origin_x, origin_y, cell_size, rows, cols, only_overlap=False, row_order=None):
+    """
+    Yield (row, columns) for every grid row, row 0 at the bottom. With
+    only_overlap, columns are only the cells that intersect a polygon
+    (touching counts, as QgsGeometry.intersects); otherwise every column.
+    row_order: the rows to yield, in that order (bottom up by default).
+    """
+    all_columns = np.arange(cols, dtype=np.int64)
+    edges = [polygon_edges(rings) for rings in polygons]
+    for row in (range(rows) if row_order is None else row_order):
+        if not only_overlap:
+            yield row, all_columns
+            continue
+        y_low = origin_y + row * cell_size
+        y_high = y_low + cell_size
+        intervals = merge_intervals(np.concatenate(
+            [band_intervals(polygon, y_low, y_high) for polygon in edges] or [np.empty((0, 2))]
+        ))
+        # Célula j toca [a, b] se x_j <= b e x_j + cell_size >= a
+        first = np.maximum(np.ceil((intervals[:, 0] - origin_x) / cell_size).astype(np.int64) - 1, 0)
+        last = np.minimum(np.floor((intervals[:, 1] - origin_x) / cell_size).astype(np.int64), cols - 1)
+        keep = first <= last
+        if not keep.any():
+            yield row, np.empty(0, dtype=np.int64)
+            continue
+        counts = last[keep] - first[keep] + 1
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        yield row, np.unique(np.repeat(first[keep], counts) + offsets)
+
+
+def iter_cell_batches(polygons, origin_x, origin_y, cell_size, rows, cols, only_overlap=False,
+                      batch_size=GRID_BATCH_SIZE, progress=None):
+    """
+    Yield (ids, row_index, col_index, x_min, y_min) arrays of the grid
+    cells, in batches of about batch_size. Ids run from 1 over the cells
+    created, row by row. progress: optional callable(rows_done, rows).
+    """
+    pending = []
+    pending_size = 0
+    next_id = 1
+
+    def flush():
+        row_index = np.concatenate([r for r, _ in pending])
+        col_index = np.concatenate([c for _, c in pending])
+        ids = np.arange(next_id, next_id + row_index.size, dtype=np.int64)
+        return (ids, row_index, col_index,
+                origin_x + col_index * cell_size, origin_y + row_index * cell_size)
+
+    for row, columns in row_columns(polygons, origin_x, origin_y, cell_size, rows, cols, only_overlap):
+        if progress is not None:
+            progress(row, rows)
+        # Linhas muito largas são repartidas pelo tamanho do lote
+        for lo in range(0, columns.size, batch_size):
+            part = columns[lo:lo + batch_size]
+            pending.append((np.full(part.size, row, dtype=np.int64), part))
+            pending_size += part.size
+            if pending_size >= batch_size:
+                batch = flush()
+                next_id += batch[0].size
+                pending, pending_size = [], 0
+                yield batch
+    if pending_size:
+        yield flush()
+    if progress is not None:
+        progress(rows, rows)
+
+
+def cell_polygons_wkb(x_min, y_min, cell_size):
+    """WKB of the square cells with lower left corners (x_min, y_min), one bytes object each."""
+    records = np.zeros(x_min.size, dtype=_CELL_WKB)
+    records['order'] = 1
+    records['type'] = ogr.wkbPolygon
+    records['rings'] = 1
+    records['points'] = 5
+    x_max = x_min + cell_size
+    y_max = y_min + cell_size
+    records['xy'] = np.column_stack((x_min, y_min, x_max, y_min, x_max, y_max, x_min, y_max, x_min, y_min))
+    data = records.tobytes()
+    size = _CELL_WKB.itemsize
+    return [data[i * size:(i + 1) * size] for i in range(x_min.size)]
+
+
+def _add_cells(layer, ids, x_min, y_min, cell_size, values=None):
+    """Cell polygons with id, centre and area (and values, one list per cell) in one transaction."""
+    defn = layer.GetLayerDefn()
+    geometries = cell_polygons_wkb(x_min, y_min, cell_size)
+    # Centroide aritmético: o centro do quadrado
+    centre_x = (x_min + cell_size / 2).tolist()
+    centre_y = (y_min + cell_size / 2).tolist()
+    area = cell_size * cell_size
+
+    layer.StartTransaction()
+    for k, cell_id in enumerate(ids.tolist()):
+        feat = ogr.Feature(defn)
+        feat.SetGeometryDirectly(ogr.CreateGeometryFromWkb(geometries[k]))
+        feat.SetField(0, cell_id)
+        feat.SetField(1, centre_x[k])
+        feat.SetField(2, centre_y[k])
+        feat.SetField(3, area)
+        if values is not None:
+            for j, value in enumerate(values[k]):
+                feat.SetField(4 + j, value)
+        layer.CreateFeature(feat)
+    layer.CommitTransaction()
+
+
+def write_grid(path, polygons, origin_x, origin_y, cell_size, rows, cols, projection, only_overlap=False,
+               volumes=None, batch_size=GRID_BATCH_SIZE, progress=None):
+    """
+    Write the calculation grid as a polygon shapefile with id, centroid_x,
+    centroid_y and area, plus the VOLUME_FIELDS of volumes (a GridVolumes
+    of the same grid) when given. Returns the number of cells written.
+    """
+    fields = list(GRID_FIELDS)
+    if volumes is not None:
+        fields += [(name, ogr.OFTReal, 0, 0) for name in VOLUME_FIELDS]
+    ds, layer = create_vector_layer(path, ogr.wkbPolygon, fields, projection)
+
+    written = 0
+    for ids, row_index, col_index, x_min, y_min in iter_cell_batches(
+            polygons, origin_x, origin_y, cell_size, rows, cols, only_overlap, batch_size, progress):
+        values = None
+        if volumes is not None:
+            values = np.column_stack((
+                volumes.covered[row_index, col_index], volumes.coverage[row_index, col_index],
+                volumes.fill[row_index, col_index], volumes.cut[row_index, col_index],
+                volumes.net[row_index, col_index],
+            )).round(4).tolist()
+        _add_cells(layer, ids, x_min, y_min, cell_size, values)
+        written += ids.size
+    ds = None
+    return written
+
+
+def write_cells(path, ids, x_min, y_min, cell_size, projection, extra_fields=(), values=None,
+                batch_size=GRID_BATCH_SIZE):
+    """
+    Write chosen cells (ids and lower left corners) as a polygon shapefile
+    with the GRID_FIELDS, then extra_fields (OFTReal) filled from values,
+    one list per cell. Returns the number of cells written.
+    """
+    fields = list(GRID_FIELDS) + [(name, ogr.OFTReal, 0, 0) for name in extra_fields]
+    ds, layer = create_vector_layer(path, ogr.wkbPolygon, fields, projection)
+    for lo in range(0, ids.size, batch_size):
+        part = slice(lo, lo + batch_size)
+        _add_cells(layer, ids[part], x_min[part], y_min[part], cell_size,
+                   None if values is None else values[part])
+    ds = None
+    return int(ids.size)
@@ -0,0 +1,348 @@
+"""
+Incremental regeneration of the raw DEM when only a few profiles change.
+
+A run with incremental enabled leaves two sidecars next to the DEM:
+
+- <name>_provenance.tif: Int32 raster holding, for every cell, the ProfNumb
+  of the profile that wrote it (0 = none)
+- <name>_profiles_state.npz: the per-profile inputs of that run (start and
+  end points, elevations, raster steps) and the grid they were burned into
+
+The next incremental run compares its profiles with the state. When the
+grid and the number of profiles are unchanged, only the tiles touched by
+the changed profiles (their old cells, found in the provenance raster, and
+their new footprint) are rasterized again and written in place; the
+surface is refilled on those tiles only. Otherwise the caller falls back
+to a full run, which writes fresh sidecars.
+"""
+import os
+
+import numpy as np
+from osgeo import gdal
+
+from .gap_fill import check_cells, fill_array, window_reach
+from .profile_engine import profile_cell_bounds, rasterize_profiles
+from .profile_records import ProfileRecords
+from .raster_io import TILE_ALIGNMENT, iter_tiles
+from .run_report import log
+from .surface_model import joined_quads, quad_cell_bounds, quads_in_window, render_envelope_surface
+
+
+STATE_VERSION = 1
+
+# Processing tile of an incremental update; a few blocks of the GeoTIFFs
+UPDATE_TILE_SIZE = 2 * TILE_ALIGNMENT
+
+PROVENANCE_NO_DATA = 0
+
+# Arrays of StableBeachProfiles whose change alters the raster
+RASTER_INPUTS = ('start_rows', 'start_cols', 'row_steps', 'col_steps', 'n_steps')
+# Arrays of ProfileRecords kept in the state
+RECORD_INPUTS = ('start_x', 'start_y', 'end_x', 'end_y', 'ini_elev', 'fin_elev', 'part_id', 'pair_id')
+
+
+def save_state(path, profiles, tiles=None):
+    """
+    Write the per-profile inputs of a profile set. tiles lists the
+    (row_off, col_off, height, width) windows rewritten by the update that
+    produced it; None marks a full run.
+    """
+    records = profiles.records
+    arrays = {name: getattr(profiles, name) for name in RASTER_INPUTS}
+    arrays.update({name: getattr(records, name) for name in RECORD_INPUTS})
+    np.savez(
+        path,
+        version=STATE_VERSION,
+        geotransform=np.asarray(profiles.geotransform, dtype=np.float64),
+        shape=np.array([profiles.rows, profiles.cols]),
+        no_data=profiles.no_data,
+        elevation_step=profiles.elevation_step,
+        full=tiles is None,
+        tiles=np.asarray(tiles if tiles is not None else [], dtype=np.int64).reshape(-1, 4),
+        **arrays
+    )
+    return path
+
+
+def load_state(path):
+    """The state saved at path as a dict of arrays, or None when missing or outdated."""
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path) as data:
+            state = {name: data[name] for name in data.files}
+    except (OSError, ValueError) as e:
+        log.warning(f"Could not read incremental state {path}: {str(e)}")
+        return None
+    if int(state.get('version', -1)) != STATE_VERSION:
+        return None
+    return state
+
+
+def state_records(state):
+    """ProfileRecords of the run that saved state."""
+    return ProfileRecords(*(state[name] for name in RECORD_INPUTS[:6]), part_id=state['part_id'],
+                          no_data=float(state['no_data']), pair_id=state['pair_id'])
+
+
+def last_update_tiles(path):
+    """
+    Windows rewritten by the last run that saved the state at path, or None
+    when that run was a full one (or there is no state).
+    """
+    state = load_state(path)
+    if state is None or bool(state['full']):
+        return None
+    return [tuple(int(v) for v in tile) for tile in state['tiles']]
+
+
+def compare_state(state, profiles):
+    """
+    (raster_changed, record_changed) boolean arrays over the profiles, or
+    None when the state cannot be reused: no state, another grid, another
+    NoData or slope, or a different number of profiles.
+
+    raster_changed marks the profiles whose raster footprint or elevation
+    changed; record_changed also includes changes that only affect the
+    vector outputs and the analytic surface (end points, end elevation,
+    part and pair).
+    """
+    if state is None or len(state['n_steps']) != len(profiles.records):
+        return None
+    if (tuple(state['shape']) != (profiles.rows, profiles.cols)
+            or not np.array_equal(state['geotransform'], np.asarray(profiles.geotransform, dtype=np.float64))
+            or float(state['no_data']) != profiles.no_data
+            or float(state['elevation_step']) != profiles.elevation_step):
+        return None
+
+    records = profiles.records
+    raster_changed = state['ini_elev'] != records.ini_elev
+    for name in RASTER_INPUTS:
+        raster_changed |= state[name] != getattr(profiles, name)
+    record_changed = raster_changed.copy()
+    for name in RECORD_INPUTS:
+        record_changed |= state[name] != getattr(records, name)
+    return raster_changed, record_changed
+
+
+def _tiles_touching(rows, cols, tile_size, row_min, row_max, col_min, col_max):
+    """Windows of the tile grid that intersect any of the given cell bounds."""
+    touched = []
+    for row_off, col_off, height, width in iter_tiles(rows, cols, tile_size):
+        hit = ((row_max >= row_off) & (row_min < row_off + height) &
+               (col_max >= col_off) & (col_min < col_off + width))
+        if hit.any():
+            touched.append((row_off, col_off, height, width))
+    return touched
+
+
+def _touching(profiles, window, bounds):
+    """Profiles whose cell bounds intersect window."""
+    row_off, col_off, height, width = window
+    row_min, row_max, col_min, col_max = bounds
+    return ((row_max >= row_off) & (row_min < row_off + height) &
+            (col_max >= col_off) & (col_min < col_off + width) &
+            (profiles.n_steps > 0))
+
+
+def _render_tile(profiles, window, touching, values, elevation_step, no_data, dtype):
+    """
+    One window rasterized from the touching profiles, with values as the
+    start value of each profile. Returns (array, cells_written).
+    """
+    row_off, col_off, height, width = window
+    array = np.full((height, width), no_data, dtype=dtype)
+    cells = rasterize_profiles(
+        array, profiles.start_rows[touching], profiles.start_cols[touching],
+        profiles.row_steps[touching], profiles.col_steps[touching], values[touching],
+        elevation_step, profiles.n_steps[touching], no_data,
+        window=(row_off, col_off, profiles.rows, profiles.cols)
+    )
+    return array, cells
+
+
+def _render_owner(profiles, window, touching):
+    # Mesmo percurso, com a "elevação" igual ao número do perfil e sem declive
+    return _render_tile(profiles, window, touching, profiles.records.profile_numbers.astype(np.float64),
+                        0.0, PROVENANCE_NO_DATA, np.int32)
+
+
+def write_provenance(path, profiles, projection, progress=None):
+    """
+    Write the provenance raster of a profile set as a sparse tiled Int32
+    GeoTIFF. progress(tiles_done, total_tiles) is called per tile.
+    """
+    driver = gdal.GetDriverByName('GTiff')
+    ds = driver.Create(path, profiles.cols, profiles.rows, 1, gdal.GDT_Int32, options=[
+        'TILED=YES', f'BLOCKXSIZE={TILE_ALIGNMENT}', f'BLOCKYSIZE={TILE_ALIGNMENT}',
+        'SPARSE_OK=TRUE', 'BIGTIFF=IF_SAFER',
+    ])
+    if ds is None:
+        raise IOError(f"Could not create raster: {path}")
+    ds.SetGeoTransform(profiles.geotransform)
+    ds.SetProjection(projection)
+    band = ds.GetRasterBand(1)
+    band.SetNoDataValue(PROVENANCE_NO_DATA)
+
+    bounds = profile_cell_bounds(*(getattr(profiles, name) for name in RASTER_INPUTS))
+    tiles = _tiles_touching(profiles.rows, profiles.cols, UPDATE_TILE_SIZE, *bounds)
+    for k, window in enumerate(tiles):
+        if progress is not None:
+            progress(k, len(tiles))
+        owner, written = _render_owner(profiles, window, _touching(profiles, window, bounds))
+        if written:
+            band.WriteArray(owner, window[1], window[0])
+    if progress is not None:
+        progress(len(tiles), len(tiles))
+    band.FlushCache()
+    ds = None
+    return path
+
+
+def update_raster(profiles, state, raster_changed, dem_path, provenance_path, progress=None):
+    """
+    Rasterize again, in place, every tile of dem_path and provenance_path
+    that a changed profile touches now or wrote before. The tiles are
+    rendered from all the profiles that reach them, so the result equals a
+    full run. Returns (tiles, cells_written).
+    """
+    changed = np.flatnonzero(raster_changed)
+    if changed.size == 0:
+        return [], 0
+
+    rows, cols = profiles.rows, profiles.cols
+    new_bounds = profile_cell_bounds(*(getattr(profiles, name)[changed] for name in RASTER_INPUTS))
+    old_bounds = profile_cell_bounds(*(state[name][changed] for name in RASTER_INPUTS))
+    new_tiles = set(_tiles_touching(rows, cols, UPDATE_TILE_SIZE, *new_bounds))
+    old_tiles = set(_tiles_touching(rows, cols, UPDATE_TILE_SIZE, *old_bounds)) - new_tiles
+
+    dem_ds = gdal.Open(dem_path, gdal.GA_Update)
+    provenance_ds = gdal.Open(provenance_path, gdal.GA_Update)
+    if dem_ds is None or provenance_ds is None:
+        raise IOError(f"Could not open {dem_path} or {provenance_path} for update")
+    dem_band = dem_ds.GetRasterBand(1)
+    provenance_band = provenance_ds.GetRasterBand(1)
+
+    # A caixa dos perfis antigos é larga; a proveniência diz onde eles escreveram de facto
+    changed_numbers = changed + 1
+    tiles = sorted(new_tiles)
+    for row_off, col_off, height, width in sorted(old_tiles):
+        owner = provenance_band.ReadAsArray(col_off, row_off, width, height)
+        if np.isin(owner, changed_numbers).any():
+            tiles.append((row_off, col_off, height, width))
+
+    bounds = profile_cell_bounds(*(getattr(profiles, name) for name in RASTER_INPUTS))
+    cells_written = 0
+    for k, window in enumerate(tiles):
+        if progress is not None:
+            progress(k, len(tiles))
+        row_off, col_off, _, _ = window
+        touching = _touching(profiles, window, bounds)
+        dem, cells = _render_tile(profiles, window, touching, profiles.records.ini_elev,
+                                  profiles.elevation_step, profiles.no_data, np.float32)
+        owner, _ = _render_owner(profiles, window, touching)
+        dem_band.WriteArray(dem, col_off, row_off)
+        provenance_band.WriteArray(owner, col_off, row_off)
+        cells_written += cells
+    if progress is not None:
+        progress(len(tiles), len(tiles))
+    dem_band.FlushCache()
+    provenance_band.FlushCache()
+    dem_ds = provenance_ds = None
+    return tiles, cells_written
+
+
+def _quad_cell_bounds(records, quads, geotransform):
+    """surface_model.quad_cell_bounds of the quads of records."""
+    return quad_cell_bounds(records.start_x, records.start_y, records.end_x, records.end_y,
+                            quads, geotransform)
+
+
+def update_analytic_surface(profiles, state, record_changed, surface_path, progress=None):
+    """
+    Render again, in place, the tiles of the analytic surface covered by a
+    quad next to a changed profile, before or after the change. Each tile
+    is rendered from the quads that reach it only, in profile order, so the
+    result equals a full run. Returns the tiles rewritten.
+    """
+    changed = np.flatnonzero(record_changed)
+    records = profiles.records
+    n_quads = len(records) - 1
+    if changed.size == 0 or n_quads < 1:
+        return []
+    old = state_records(state)
+
+    # Cada perfil entra nos quadriláteros com o anterior e com o seguinte
+    affected = np.unique(np.concatenate([changed - 1, changed]))
+    affected = affected[(affected >= 0) & (affected < n_quads)]
+    new_bounds = _quad_cell_bounds(records, affected, profiles.geotransform)
+    old_bounds = _quad_cell_bounds(old, affected, profiles.geotransform)
+    tiles = sorted(set(_tiles_touching(profiles.rows, profiles.cols, UPDATE_TILE_SIZE, *new_bounds)) |
+                   set(_tiles_touching(profiles.rows, profiles.cols, UPDATE_TILE_SIZE, *old_bounds)))
+
+    # Quadriláteros de toda a superfície, para escolher os de cada tile
+    quads = joined_quads(len(records), profiles.part_breaks)
+    bounds = _quad_cell_bounds(records, quads, profiles.geotransform)
+
+    origin_x, pixel_size_x, _, origin_y, _, neg_pixel_size_y = profiles.geotransform
+    ds = gdal.Open(surface_path, gdal.GA_Update)
+    if ds is None:
+        raise IOError(f"Could not open {surface_path} for update")
+    band = ds.GetRasterBand(1)
+    for k, (row_off, col_off, height, width) in enumerate(tiles):
+        if progress is not None:
+            progress(k, len(tiles))
+        tile = np.full((height, width), profiles.no_data, dtype=np.float32)
+        reaching = quads_in_window(quads, bounds, (row_off, col_off, height, width))
+        if reaching.size:
+            tile_geotransform = [
+                origin_x + col_off * pixel_size_x, pixel_size_x, 0,
+                origin_y + row_off * neg_pixel_size_y, 0, neg_pixel_size_y
+            ]
+            render_envelope_surface(
+                tile, tile_geotransform, records.start_x, records.start_y,
+                records.end_x, records.end_y, records.ini_elev,
+                profiles.tan_slope, profiles.no_data, quads=reaching
+            )
+        band.WriteArray(tile, col_off, row_off)
+    if progress is not None:
+        progress(len(tiles), len(tiles))
+    band.FlushCache()
+    ds = None
+    return tiles
+
+
+def refill_surface(dem_path, surface_path, tiles, mode='wmean', power=2.0, cells=6, distance=0.5,
+                   progress=None):
+    """
+    Refill, in place, the part of a numpy-filled surface that depends on the
+    given windows of the raw DEM: each window grown by the search radius,
+    computed from the raw cells one more radius around it. The result
+    equals filling the whole DEM again with gap_fill.fill_array.
+    """
+    check_cells(cells, distance)
+    reach = window_reach(distance)
+    dem_ds = gdal.Open(dem_path, gdal.GA_ReadOnly)
+    surface_ds = gdal.Open(surface_path, gdal.GA_Update)
+    if dem_ds is None or surface_ds is None:
+        raise IOError(f"Could not open {dem_path} or {surface_path}")
+    rows, cols = dem_ds.RasterYSize, dem_ds.RasterXSize
+    dem_band = dem_ds.GetRasterBand(1)
+    surface_band = surface_ds.GetRasterBand(1)
+    no_data = dem_band.GetNoDataValue()
+
+    for k, (row_off, col_off, height, width) in enumerate(tiles):
+        if progress is not None:
+            progress(k, len(tiles))
+        r0, r1 = max(row_off - reach, 0), min(row_off + height + reach, rows)
+        c0, c1 = max(col_off - reach, 0), min(col_off + width + reach, cols)
+        ir0, ir1 = max(r0 - reach, 0), min(r1 + reach, rows)
+        ic0, ic1 = max(c0 - reach, 0), min(c1 + reach, cols)
+        raw = dem_band.ReadAsArray(ic0, ir0, ic1 - ic0, ir1 - ir0)
+        filled = fill_array(raw, no_data, mode=mode, power=power, cells=cells, distance=distance)
+        surface_band.WriteArray(filled[r0 - ir0:r1 - ir0, c0 - ic0:c1 - ic0], c0, r0)
+    if progress is not None:
+        progress(len(tiles), len(tiles))
+    surface_band.FlushCache()
+    dem_ds = surface_ds = None
+    return surface_path
@@ -8,6 +8,8 @@ from qgis.PyQt.QtWidgets import (
     QLabel
 )
 from qgis.core import (
+    QgsApplication,
+    QgsFeedback,
     QgsProject, 
     QgsRasterLayer, 
     QgsVectorLayer,
@@ -21,17 +23,73 @@ from qgis.core import (
 from qgis.PyQt.QtCore import QVariant
 from .form import Ui_Form
 from .generate_dem import generate_stable_beach_dem, interpolate_surface, crop_surface_with_mask
-from .volume_calculation_grid import generate_grid, find_mask_layer
+from .volume_calculation_grid import (generate_grid, generate_virtual_grid, find_mask_layer, grid_output_path,
+                                      load_grid_layers, materialize_grid_cells)
+from .engine import (changed_outputs, check_output_format, cog_raster_outputs, output_paths, pack_raster_outputs,
+                     remove_partial_outputs, snapshot_outputs)
+from .geopackage import layer_display_name, layer_file
+from .incremental import last_update_tiles, refill_surface
+from .run_report import RunCancelled, RunReport, format_progress, set_verbose, stage_percent
+from .scenarios import scenario_list
+from .processing_provider import StableBeachProvider
 from qgis.PyQt import QtCore
 import os
 
+# Progress (%) at the start of each stage of a DEM run from the dialog
+THREAD_STAGE_PROGRESS = {
+    'profiles': 10,
+    'rasterize': 30,
+    'rasterize_and_write': 30,
+    'rasterize_update': 30,
+    'write_geotiff': 50,
+    'analytic_surface': 55,
+    'analytic_surface_update': 55,
+    'vector_outputs': 60,
+    'provenance': 62,
+    'scenarios': 63,
+    'fill': 65,
+    'clip': 85,
+    'cog': 88,
+    'geopackage': 90,
+    'finalize': 95,
+}
+
+
+class ThreadReport(RunReport):
+    """
+    RunReport that drives the dialog through the thread's signals: the
+    progress bar follows the stages and the progress within them, and the
+    status label shows the current stage with its rate and ETA. Updates
+    come at most every PROGRESS_INTERVAL seconds, so the hot loops do not
+    flood the GUI thread.
+    """
+
+    def __init__(self, thread, profile=False):
+        super().__init__(profile=profile)
+        self.thread = thread
+
+    def on_stage(self, name):
+        percent = stage_percent(THREAD_STAGE_PROGRESS, name)
+        if percent is not None:
+            self.thread.progress.emit(percent)
+
+    def on_progress(self, stage, done, total, unit, rate, eta):
+        self.thread.status.emit(format_progress(stage, done, total, unit, rate, eta))
+        percent = stage_percent(THREAD_STAGE_PROGRESS, stage, done / total if total else 1.0)
+        if percent is not None:
+            self.thread.progress.emit(percent)
+
+
 class DEMGenerationThread(QThread):
     progress = pyqtSignal(int)
     status = pyqtSignal(str)
     finished = pyqtSignal(bool, str)
 
     def __init__(self, dem_layer, line_a, line_b, slope, output_path, distance_interval=None, interpolate=False,
-                 power=2.0, cells=6, distance=0.5, mode='wmean', no_nulls=True):
+                 power=2.0, cells=6, distance=0.5, mode='wmean', no_nulls=True, backend='grass',
+                 tile_memory_mb=None, bigtiff=False, sparse=False, profile_run=False, verbose=False,
+                 pair_field=None, workers=None, incremental=False, scenarios=None, geopackage=False,
+                 cog_compression=None, cog_threads=None):
         super().__init__()
         self.dem_layer = dem_layer
         self.line_a = line_a
@@ -45,44 +103,97 @@ class DEMGenerationThread(QThread):
         self.distance = distance
         self.mode = mode
         self.no_nulls = no_nulls
+        self.backend = backend
+        self.tile_memory_mb = tile_memory_mb
+        self.bigtiff = bigtiff
+        self.sparse = sparse
+        self.profile_run = profile_run
+        self.verbose = verbose
+        self.pair_field = pair_field
+        self.workers = workers
+        self.incremental = incremental
+        self.scenarios = scenarios
+        self.geopackage = geopackage
+        self.cog_compression = cog_compression
+        self.cog_threads = cog_threads
+        self.report = ThreadReport(self, profile=profile_run)
         print(f"Thread initialized with output path: {output_path}")
 
+    def cancel(self):
+        """Stop the run at its next progress check (called from the GUI thread)."""
+        self.report.cancel()
+
     def run(self):
         print("Starting DEM generation process")
         self.status.emit("Starting DEM generation...")
-        self.progress.emit(10)
+        self.progress.emit(0)
         
+        set_verbose(self.verbose)
+        report = self.report.start()
+        snapshot = snapshot_outputs([self.output_path])
         try:
             self.status.emit("Generating DEM...")
-            self.progress.emit(30)
             
+            # The analytic surface is built with the DEM and needs no fill or crop
+            analytic_surface = self.interpolate and self.backend == 'analytic'
+            cropped_path = None
+
             success, message, profiles_path = generate_stable_beach_dem(
                 self.dem_layer, 
                 self.line_a, 
                 self.line_b, 
                 self.slope,
                 self.output_path,
-                self.distance_interval
+                self.distance_interval,
+                tile_memory_mb=self.tile_memory_mb,
+                bigtiff=self.bigtiff,
+                sparse=self.sparse,
+                analytic_surface=analytic_surface,
+                report=report,
+                pair_field=self.pair_field,
+                workers=self.workers,
+                incremental=self.incremental,
+                scenarios=self.scenarios,
+                geopackage=self.geopackage
             )
+            report.check_cancelled()
             
-            if success and self.interpolate:
+            if success and self.interpolate and not analytic_surface:
                 self.status.emit("Interpolating surface...")
                 surface_path = f"{os.path.splitext(self.output_path)[0]}_surface.tif"
                 
-                interpolation_success = interpolate_surface(
-                    self.output_path,
-                    surface_path,
-                    mode=self.mode,
-                    power=self.power,
-                    cells=self.cells,
-                    distance=self.distance,
-                    no_nulls=self.no_nulls
-                )
+                report.set_parameters(fill_backend=self.backend, fill_mode=self.mode, power=self.power,
+                                      cells=self.cells, distance=self.distance, no_nulls=self.no_nulls)
+                # Na atualização incremental só se preenchem as janelas reescritas
+                tiles = None
+                if self.incremental and self.backend == 'numpy' and os.path.exists(surface_path):
+                    tiles = last_update_tiles(output_paths(self.output_path)['state'])
+                with report.stage('fill'):
+                    if tiles is not None:
+                        refill_surface(self.output_path, surface_path, tiles, mode=self.mode, power=self.power,
+                                       cells=self.cells, distance=self.distance,
+                                       progress=lambda done, total: report.progress(done, total, 'tiles'))
+                        interpolation_success = True
+                    else:
+                        interpolation_success = interpolate_surface(
+                            self.output_path,
+                            surface_path,
+                            mode=self.mode,
+                            power=self.power,
+                            cells=self.cells,
+                            distance=self.distance,
+                            no_nulls=self.no_nulls,
+                            backend=self.backend
+                        )
                 
                 if interpolation_success:
-                    mask_path = f"{os.path.splitext(self.output_path)[0]}_mask.shp"
-                    if os.path.exists(mask_path):
-                        cropped_path = crop_surface_with_mask(surface_path, mask_path)
+                    mask_path = output_paths(self.output_path, self.geopackage)['mask']
+                    if os.path.exists(layer_file(mask_path)):
+                        with report.stage('clip'):
+                            # Carregada no fim, depois do COG e do GeoPackage
+                            cropped_path = crop_surface_with_mask(
+                                surface_path, mask_path, load_layer=False,
+                                progress=lambda done, total: report.progress(done, total, 'blocks'))
                         if cropped_path:
                             print(f"Surface cropped successfully: {cropped_path}")
                         else:
@@ -91,23 +202,48 @@ class DEMGenerationThread(QThread):
                     print("Warning: Error during surface interpolation")
                     self.status.emit("Warning: Error during surface interpolation")
             
-            self.progress.emit(90)
+            report.check_cancelled()
+            self.progress.emit(THREAD_STAGE_PROGRESS['finalize'])
             self.status.emit("Finalizing...")
+
+            if success and self.cog_compression:
+                # Só no fim: o preenchimento e o recorte ainda leem e escrevem os GeoTIFF
+                self.status.emit("Writing COG outputs...")
+                report.set_parameters(cog_compression=self.cog_compression, cog_threads=self.cog_threads)
+                with report.stage('cog'):
+                    cog_raster_outputs(self.output_path, self.cog_compression, self.cog_threads, self.bigtiff,
+                                       progress=lambda done, total: report.progress(done, total, 'rasters'))
+
+            layer_name = os.path.splitext(os.path.basename(self.output_path))[0]
+            dem_source = self.output_path
+            surface_source = output_paths(self.output_path)['surface']
+            cropped_source = output_paths(self.output_path)['cropped']
+            if success and self.geopackage:
+                # Rasters copiados para o GeoPackage, junto das camadas vetoriais
+                with report.stage('geopackage'):
+                    packed = pack_raster_outputs(self.output_path)
+                dem_source = packed.get('dem', dem_source)
+                surface_source = packed.get('surface', surface_source)
+                cropped_source = packed.get('cropped', cropped_source)
+
+            # O recorte só existe quando foi escrito nesta corrida
+            if success and self.interpolate and cropped_path and os.path.exists(layer_file(cropped_source)):
+                cropped_layer = QgsRasterLayer(cropped_source, f"{layer_name}_surface_cropped")
+                if cropped_layer.isValid():
+                    QgsProject.instance().addMapLayer(cropped_layer)
             
-            if os.path.exists(self.output_path):
-                layer_name = os.path.splitext(os.path.basename(self.output_path))[0]
-                layer = QgsRasterLayer(self.output_path, layer_name)
+            if os.path.exists(layer_file(dem_source)):
+                layer = QgsRasterLayer(dem_source, layer_name)
                 if layer.isValid():
                     QgsProject.instance().addMapLayer(layer)
                     
                     if self.interpolate:
-                        surface_path = f"{os.path.splitext(self.output_path)[0]}_surface.tif"
-                        if os.path.exists(surface_path):
-                            surface_layer = QgsRasterLayer(surface_path, os.path.splitext(os.path.basename(surface_path))[0])
+                        if os.path.exists(layer_file(surface_source)):
+                            surface_layer = QgsRasterLayer(surface_source, f"{layer_name}_surface")
                             if surface_layer.isValid():
                                 QgsProject.instance().addMapLayer(surface_layer)
                     
-                    if profiles_path and os.path.exists(profiles_path):
+                    if profiles_path and os.path.exists(layer_file(profiles_path)):
                         profiles_layer = QgsVectorLayer(profiles_path, f"{layer_name}_profiles", "ogr")
                         if profiles_layer.isValid():
                             QgsProject.instance().addMapLayer(profiles_layer)
@@ -124,145 +260,87 @@ class DEMGenerationThread(QThread):
             else:
                 self.status.emit("Error: file not found after processing.")
 
+            self.write_report(report)
             self.progress.emit(100)
             self.finished.emit(success, message)
             
+        except RunCancelled as e:
+            print("DEM generation cancelled")
+            self.discard_outputs(snapshot)
+            self.write_report(report)
+            self.status.emit("Cancelled")
+            self.finished.emit(False, str(e))
+
         except Exception as e:
             print(f"Error in thread: {str(e)}")
+            self.write_report(report)
             self.status.emit(f"Error: {str(e)}")
             self.finished.emit(False, str(e))
 
+    def write_report(self, report):
+        try:
+            report.finish().write(self.output_path)
+        except Exception as e:
+            print(f"Could not write run report: {str(e)}")
+
+    def discard_outputs(self, snapshot):
+        """Unload and delete the files written by a cancelled run."""
+        changed = {os.path.normcase(os.path.abspath(path))
+                   for path in changed_outputs([self.output_path], snapshot)}
+        # Camadas já carregadas a partir desses ficheiros saem do projeto primeiro
+        for layer in list(QgsProject.instance().mapLayers().values()):
+            source = os.path.normcase(os.path.abspath(layer.source().split('|')[0]))
+            if source in changed:
+                QgsProject.instance().removeMapLayer(layer.id())
+        remove_partial_outputs([self.output_path], snapshot)
+
 
 class VolumeGridThread(QThread):
+    """
+    Calculation grid of the mask (one polygon per cell, or the virtual
+    grid) with its optional cell volumes, off the GUI thread. Progress and
+    cancellation go through a QgsFeedback; the grid layers are loaded by
+    the plugin once the thread has finished.
+    """
     progress = pyqtSignal(int)
     status = pyqtSignal(str)
     finished = pyqtSignal(bool, str)
 
-    def __init__(self, polygon_layer, grid_size):
+    def __init__(self, mask_layer, grid_size, only_overlap=False, dem_path=None, virtual=False):
         super().__init__()
-        self.polygon_layer = polygon_layer
+        self.mask_layer = mask_layer
         self.grid_size = grid_size
-        
+        self.only_overlap = only_overlap
+        self.dem_path = dem_path
+        self.virtual = virtual
+        self.output_path = grid_output_path(mask_layer, virtual)
+        self.feedback = QgsFeedback()
+        self.feedback.progressChanged.connect(lambda percent: self.progress.emit(int(percent)))
+
+    def cancel(self):
+        """Stop the grid at its next progress check (called from the GUI thread)."""
+        self.feedback.cancel()
+
     def run(self):
-        try:
-            self.status.emit("Starting grid generation...")
-            self.progress.emit(10)
-            
-            # Encontrar a máscara existente
-            mask_layer = find_mask_layer()
-            if not mask_layer:
-                self.status.emit("No mask layer found")
-                self.finished.emit(False, "No mask layer found")
-                return
-                
-            # Get the extent of the polygon layer
-            extent = self.polygon_layer.extent()
-            
-            # Calculate number of cells in each direction
-            cols = int((extent.xMaximum() - extent.xMinimum()) / self.grid_size)
-            rows = int((extent.yMaximum() - extent.yMinimum()) / self.grid_size)
-            
-            self.status.emit(f"Creating grid with {rows}x{cols} cells...")
-            self.progress.emit(30)
-            
-            # Create a new memory layer for the grid
-            grid_layer = QgsVectorLayer("Polygon", "calculation_grid", "memory")
-            provider = grid_layer.dataProvider()
-            
-            # Add fields for the grid
-            provider.addAttributes([
-                QgsField("id", QVariant.Int),
-                QgsField("centroid_x", QVariant.Double),
-                QgsField("centroid_y", QVariant.Double),
-                QgsField("area", QVariant.Double)
-            ])
-            grid_layer.updateFields()
-            
-            # Create grid cells
-            features = []
-            cell_id = 1
-            
-            for row in range(rows):
-                self.progress.emit(30 + int(60 * row / rows))
-                for col in range(cols):
-                    # Calculate cell coordinates
-                    x_min = extent.xMinimum() + col * self.grid_size
-                    x_max = x_min + self.grid_size
-                    y_min = extent.yMinimum() + row * self.grid_size
-                    y_max = y_min + self.grid_size
-                    
-                    # Create cell geometry
-                    points = [
-                        QgsPointXY(x_min, y_min),
-                        QgsPointXY(x_max, y_min),
-                        QgsPointXY(x_max, y_max),
-                        QgsPointXY(x_min, y_max),
-                        QgsPointXY(x_min, y_min)  # Close the polygon
-                    ]
-                    
-                    # Create feature
-                    feat = QgsFeature()
-                    feat.setGeometry(QgsGeometry.fromPolygonXY([points]))
-                    
-                    # Calculate centroid
-                    centroid = feat.geometry().centroid().asPoint()
-                    
-                    # Set attributes
-                    feat.setAttributes([
-                        cell_id,
-                        centroid.x(),
-                        centroid.y(),
-                        self.grid_size * self.grid_size
-                    ])
-                    
-                    features.append(feat)
-                    cell_id += 1
-            
-            # Add features to layer
-            provider.addFeatures(features)
-            
-            # Save grid layer
-            save_path, _ = QFileDialog.getSaveFileName(None, "Save Grid Layer", "", "ESRI Shapefile (*.shp)")
-            if save_path:
-                # Add .shp extension if not present
-                if not save_path.lower().endswith('.shp'):
-                    save_path += '.shp'
-                    
-                # Save the layer
-                options = QgsVectorFileWriter.SaveVectorOptions()
-                options.driverName = "ESRI Shapefile"
-                error = QgsVectorFileWriter.writeAsVectorFormat(
-                    grid_layer,
-                    save_path,
-                    "UTF-8",
-                    self.polygon_layer.crs(),
-                    "ESRI Shapefile"
-                )
-                
-                if error[0] == QgsVectorFileWriter.NoError:
-                    # Load the saved layer
-                    saved_layer = QgsVectorLayer(save_path, "Calculation Grid", "ogr")
-                    if saved_layer.isValid():
-                        QgsProject.instance().addMapLayer(saved_layer)
-                        self.status.emit("Grid layer created and saved successfully")
-                        self.finished.emit(True, "Grid generation completed successfully")
-                    else:
-                        self.status.emit("Error loading saved grid layer")
-                        self.finished.emit(False, "Error loading saved grid layer")
-                else:
-                    self.status.emit("Error saving grid layer")
-                    self.finished.emit(False, "Error saving grid layer")
-            else:
-                # User cancelled save operation
-                self.status.emit("Operation cancelled by user")
-                self.finished.emit(False, "Operation cancelled by user")
-            
-            self.progress.emit(100)
-            
-        except Exception as e:
-            print(f"Error in grid generation: {str(e)}")
-            self.status.emit(f"Error: {str(e)}")
-            self.finished.emit(False, str(e))
+        self.progress.emit(0)
+        if self.dem_path:
+            self.status.emit("Computing grid volumes...")
+        else:
+            self.status.emit("Generating grid...")
+
+        # Grade virtual alinhada à superfície, ou um polígono por célula
+        generate = generate_virtual_grid if self.virtual else generate_grid
+        success, message = generate(
+            mask_layer=self.mask_layer,
+            cell_size=self.grid_size,
+            only_overlap=self.only_overlap,
+            output_path=self.output_path,
+            load_layer=False,
+            feedback=self.feedback,
+            dem_path=self.dem_path
+        )
+        self.progress.emit(100)
+        self.finished.emit(success, message)
 
 
 class StableBeachDEMPlugin:
@@ -271,14 +349,23 @@ class StableBeachDEMPlugin:
         self.dialog = None
         self.thread = None
         self.current_tab = 0
+        self.provider = None
+
+    def initProcessing(self):
+        self.provider = StableBeachProvider()
+        QgsApplication.processingRegistry().addProvider(self.provider)
 
     def initGui(self):
+        self.initProcessing()
         self.action = QAction("Beach Analysis Tool", self.iface.mainWindow())
         self.action.triggered.connect(self.run)
         self.iface.addPluginToMenu("&Stable Beach Tool", self.action)
 
     def unload(self):
         self.iface.removePluginMenu("&Stable Beach Tool", self.action)
+        if self.provider is not None:
+            QgsApplication.processingRegistry().removeProvider(self.provider)
+            self.provider = None
         
     def run(self):
         self.dialog = QDialog()
@@ -292,7 +379,9 @@ class StableBeachDEMPlugin:
         
         # Connect buttons
         self.ui.runButton.clicked.connect(self.start_processing)
+        self.ui.cancelButton.clicked.connect(self.cancel_processing)
         self.ui.generateGridButton.clicked.connect(self.start_grid_generation)
+        self.ui.buildCellsButton.clicked.connect(self.build_grid_cells)
         
         self.dialog.show()
 
@@ -304,11 +393,13 @@ class StableBeachDEMPlugin:
         self.ui.lineALayerCombo.clear()
         self.ui.lineBLayerCombo.clear()
         self.ui.polygonLayerCombo.clear()
+        self.ui.volumeDemLayerCombo.clear()
         
         # Populate combos based on layer type
         for layer in layers:
             if isinstance(layer, QgsRasterLayer):
                 self.ui.demLayerCombo.addItem(layer.name(), layer)
+                self.ui.volumeDemLayerCombo.addItem(layer.name(), layer)
             elif isinstance(layer, QgsVectorLayer):
                 if layer.geometryType() == QgsWkbTypes.LineGeometry:
                     self.ui.lineALayerCombo.addItem(layer.name(), layer)
@@ -341,6 +432,9 @@ class StableBeachDEMPlugin:
 
     def start_grid_generation(self):
         """Inicia o processo de geração da grade"""
+        if self.thread is not None and self.thread.isRunning():
+            self.iface.messageBar().pushMessage("Error", "Another run is still in progress", level=2)
+            return
         try:
             grid_size = float(self.ui.gridSizeInput.text())
             if grid_size <= 0:
@@ -357,16 +451,29 @@ class StableBeachDEMPlugin:
 
             only_overlap = self.ui.overlapCheckBox.isChecked()
 
-            success, message = generate_grid(
-                mask_layer=mask_layer,
-                cell_size=grid_size,
-                only_overlap=only_overlap
-            )
+            # Volumes por célula entre a superfície estável e o DEM escolhido
+            dem_path = None
+            if self.ui.volumesCheckBox.isChecked():
+                dem_layer = self.ui.volumeDemLayerCombo.currentData()
+                if dem_layer is None or dem_layer.providerType() != 'gdal':
+                    self.iface.messageBar().pushMessage(
+                        "Error", "Please select a file-based DEM for the volumes", level=2)
+                    return
+                dem_path = dem_layer.source()
 
-            if success:
-                self.iface.messageBar().pushMessage("Success", message, level=3)
-            else:
-                self.iface.messageBar().pushMessage("Error", message, level=2)
+            # Grade e volumes numa thread, para o QGIS não congelar
+            self.thread = VolumeGridThread(
+                mask_layer, grid_size,
+                only_overlap=only_overlap,
+                dem_path=dem_path,
+                virtual=self.ui.virtualGridCheckBox.isChecked()
+            )
+            self.thread.progress.connect(self.ui.progressBar.setValue)
+            self.thread.status.connect(self.ui.statusLabel.setText)
+            self.thread.finished.connect(self.on_thread_finished)
+            self.ui.generateGridButton.setEnabled(False)
+            self.ui.cancelButton.setEnabled(True)
+            self.thread.start()
 
         except Exception as e:
             self.iface.messageBar().pushMessage(
@@ -375,6 +482,45 @@ class StableBeachDEMPlugin:
                 level=2
             )
 
+    def build_grid_cells(self):
+        """
+        Polígonos da grade virtual da máscara: the cells selected in the
+        <mask>_grid_cells table, or else the cells in the map view.
+        """
+        try:
+            mask_layer = find_mask_layer()
+            if not mask_layer:
+                self.iface.messageBar().pushMessage(
+                    "Error", "No mask layer found. Please generate a DEM first.", level=2)
+                return
+            base_path = os.path.join(os.path.dirname(layer_file(mask_layer.source())),
+                                     layer_display_name(mask_layer.source()))
+            definition_path = f"{base_path}_grid.json"
+            if not os.path.exists(definition_path):
+                self.iface.messageBar().pushMessage(
+                    "Error", "No virtual grid found. Generate one with Raster-aligned virtual grid.", level=2)
+                return
+
+            ids = None
+            table_name = f"{os.path.basename(base_path)}_grid_cells"
+            for layer in QgsProject.instance().mapLayersByName(table_name):
+                if layer.selectedFeatureCount():
+                    ids = [int(feat['id']) for feat in layer.selectedFeatures()]
+                    break
+
+            if ids is not None:
+                success, message = materialize_grid_cells(definition_path, ids=ids)
+            else:
+                success, message = materialize_grid_cells(definition_path, extent=self.iface.mapCanvas().extent())
+
+            if success:
+                self.iface.messageBar().pushMessage("Success", message, level=3)
+            else:
+                self.iface.messageBar().pushMessage("Error", message, level=2)
+
+        except Exception as e:
+            self.iface.messageBar().pushMessage("Error", f"Error building grid cells: {str(e)}", level=2)
+
     def start_dem_generation(self):
         print("\n=== Starting DEM Generation Process ===")
         
@@ -413,6 +559,46 @@ class StableBeachDEMPlugin:
                 self.ui.runButton.setEnabled(True)
                 return
 
+        # Tiled output keeps memory use within the given budget
+        tile_memory_mb = None
+        bigtiff = self.ui.bigTiffCheckBox.isChecked()
+        sparse = self.ui.sparseCheckBox.isChecked()
+        if self.ui.tiledCheckBox.isChecked():
+            try:
+                tile_memory_mb = float(self.ui.memoryBudgetInput.text())
+                if tile_memory_mb <= 0:
+                    raise ValueError("Memory budget must be greater than 0")
+                print(f"Using tiled output: budget={tile_memory_mb}MB, bigtiff={bigtiff}, sparse={sparse}")
+            except ValueError as e:
+                print(f"Error parsing memory budget: {e}")
+                self.iface.messageBar().pushMessage("Error", "Invalid memory budget", level=2)
+                self.ui.runButton.setEnabled(True)
+                return
+
+        # Pares de feições A/B: por campo, ou pela feição B mais próxima
+        pair_field = self.ui.pairFieldInput.text().strip() or None
+        try:
+            workers = int(self.ui.workersInput.text() or 0) or None
+            if workers is not None and workers < 0:
+                raise ValueError("Worker count must not be negative")
+        except ValueError as e:
+            print(f"Error parsing worker count: {e}")
+            self.iface.messageBar().pushMessage("Error", "Invalid worker count", level=2)
+            self.ui.runButton.setEnabled(True)
+            return
+
+        # Cenários: cada declive com cada desnível, numa só passagem pelos perfis
+        try:
+            scenarios = scenario_list(self.ui.scenarioSlopesInput.text(),
+                                      self.ui.scenarioOffsetsInput.text()) or None
+            if scenarios:
+                print(f"Scenarios (slope, offset): {scenarios}")
+        except ValueError as e:
+            print(f"Error parsing scenarios: {e}")
+            self.iface.messageBar().pushMessage("Error", "Invalid scenario slopes or offsets", level=2)
+            self.ui.runButton.setEnabled(True)
+            return
+
         if not (dem_layer and line_a_layer and line_b_layer):
             print("Error: Missing input layers")
             self.iface.messageBar().pushMessage("Error", "Please select all input layers.", level=2)
@@ -436,7 +622,7 @@ class StableBeachDEMPlugin:
 
         # Get interpolation parameters if enabled
         interpolate = self.ui.interpolateCheckBox.isChecked()
-        power = cells = distance = mode = no_nulls = None
+        power = cells = distance = mode = no_nulls = backend = None
         if interpolate:
             try:
                 power = float(self.ui.powerInput.text())
@@ -444,13 +630,28 @@ class StableBeachDEMPlugin:
                 distance = float(self.ui.distanceSearchInput.text())
                 mode = self.ui.modeCombo.currentText()
                 no_nulls = self.ui.noNullsCheckBox.isChecked()
-                print(f"Interpolation parameters: mode={mode}, power={power}, cells={cells}, distance={distance}, no_nulls={no_nulls}")
+                backend = self.ui.backendCombo.currentText()
+                print(f"Interpolation parameters: backend={backend}, mode={mode}, power={power}, cells={cells}, distance={distance}, no_nulls={no_nulls}")
             except ValueError as e:
                 print(f"Error parsing interpolation parameters: {e}")
                 self.iface.messageBar().pushMessage("Error", "Invalid interpolation parameters", level=2)
                 self.ui.runButton.setEnabled(True)
                 return
 
+        # Compressão COG das saídas raster, aplicada no fim da corrida
+        cog_compression = None
+        if self.ui.cogCheckBox.isChecked():
+            cog_compression = self.ui.cogCompressionCombo.currentText()
+        cog_threads = 'ALL_CPUS' if cog_compression and self.ui.cogThreadsCheckBox.isChecked() else None
+
+        try:
+            check_output_format(self.ui.incrementalCheckBox.isChecked(), self.ui.geopackageCheckBox.isChecked(),
+                                cog_compression)
+        except ValueError as e:
+            self.iface.messageBar().pushMessage("Error", str(e), level=2)
+            self.ui.runButton.setEnabled(True)
+            return
+
         # Initialize and start the processing thread
         print("Starting processing thread...")
         self.thread = DEMGenerationThread(
@@ -465,40 +666,44 @@ class StableBeachDEMPlugin:
             cells,
             distance,
             mode,
-            no_nulls
+            no_nulls,
+            backend,
+            tile_memory_mb=tile_memory_mb,
+            bigtiff=bigtiff,
+            sparse=sparse,
+            profile_run=self.ui.profileRunCheckBox.isChecked(),
+            verbose=self.ui.verboseLogCheckBox.isChecked(),
+            pair_field=pair_field,
+            workers=workers,
+            incremental=self.ui.incrementalCheckBox.isChecked(),
+            scenarios=scenarios,
+            geopackage=self.ui.geopackageCheckBox.isChecked(),
+            cog_compression=cog_compression,
+            cog_threads=cog_threads
         )
         self.thread.progress.connect(self.ui.progressBar.setValue)
         self.thread.status.connect(self.ui.statusLabel.setText)
         self.thread.finished.connect(self.on_thread_finished)
+        self.ui.cancelButton.setEnabled(True)
         self.thread.start()
 
-    def start_volume_calculation(self):
-        self.ui.runButton.setEnabled(False)
-        
-        # Get selected polygon layer
-        polygon_layer = self.ui.polygonLayerCombo.currentData()
-        if not polygon_layer:
-            self.iface.messageBar().pushMessage("Error", "Please select a polygon layer", level=2)
-            self.ui.runButton.setEnabled(True)
-            return
-            
-        try:
-            grid_size = float(self.ui.gridSizeInput.text())
-            if grid_size <= 0:
-                raise ValueError("Grid size must be greater than 0")
-        except ValueError as e:
-            self.iface.messageBar().pushMessage("Error", "Invalid grid size value", level=2)
-            self.ui.runButton.setEnabled(True)
-            return
+    def cancel_processing(self):
+        if isinstance(self.thread, (DEMGenerationThread, VolumeGridThread)):
+            print("Cancelling run...")
+            self.ui.cancelButton.setEnabled(False)
+            self.ui.statusLabel.setText("Cancelling...")
+            self.thread.cancel()
 
-        # Initialize and start the grid generation thread
-        self.thread = VolumeGridThread(polygon_layer, grid_size)
-        self.thread.progress.connect(self.ui.progressBar.setValue)
-        self.thread.status.connect(self.ui.statusLabel.setText)
-        self.thread.finished.connect(self.on_thread_finished)
-        self.thread.start()
+    def start_volume_calculation(self):
+        """Grade de cálculo (e volumes) do separador da grade."""
+        self.start_grid_generation()
 
     def on_thread_finished(self, success, message):
+        if success and isinstance(self.thread, VolumeGridThread):
+            # Camadas carregadas na thread principal
+            loaded, error = load_grid_layers(self.thread.output_path, self.thread.virtual)
+            if not loaded:
+                success, message = False, error
         if success:
             self.iface.messageBar().pushMessage("Success", message, level=0)
         else:
@@ -507,4 +712,6 @@ class StableBeachDEMPlugin:
         self.ui.progressBar.setValue(0)
         self.ui.statusLabel.setText("Ready")
         self.ui.runButton.setEnabled(True)
+        self.ui.generateGridButton.setEnabled(True)
+        self.ui.cancelButton.setEnabled(False)
         self.thread = None
\ No newline at end of file
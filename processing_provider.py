@@ -0,0 +1,731 @@
+"""
+QGIS Processing provider exposing the pipeline as algorithms.
+
+The algorithms run from the toolbox, the graphical modeler, batch mode and
+qgis_process. They never touch the current project: outputs are returned
+to Processing, which loads or chains them.
+"""
+from qgis.core import (
+    QgsCoordinateReferenceSystem,
+    QgsFeatureSink,
+    QgsProcessing,
+    QgsProcessingAlgorithm,
+    QgsProcessingException,
+    QgsProcessingOutputFile,
+    QgsProcessingOutputNumber,
+    QgsProcessingOutputRasterLayer,
+    QgsProcessingOutputVectorLayer,
+    QgsProcessingParameterBoolean,
+    QgsProcessingParameterEnum,
+    QgsProcessingParameterExtent,
+    QgsProcessingParameterFeatureSink,
+    QgsProcessingParameterFeatureSource,
+    QgsProcessingParameterField,
+    QgsProcessingParameterFile,
+    QgsProcessingParameterFileDestination,
+    QgsProcessingParameterMultipleLayers,
+    QgsProcessingParameterNumber,
+    QgsProcessingParameterRasterDestination,
+    QgsProcessingParameterRasterLayer,
+    QgsProcessingParameterString,
+    QgsProcessingParameterVectorLayer,
+    QgsProcessingProvider,
+    QgsWkbTypes
+)
+from qgis.PyQt.QtCore import QCoreApplication
+import os
+
+from .engine import check_output_format, cog_raster_outputs, output_paths, pack_raster_outputs
+from .epochs import compare_epochs
+from .gap_fill import FILL_BACKENDS
+from .generate_dem import generate_stable_beach_dem, interpolate_surface, crop_surface_with_mask
+from .geopackage import layer_file
+from .grid_cells import GRID_BATCH_SIZE
+from .raster_io import COG_COMPRESSIONS, write_cog
+from .run_report import RunCancelled, RunReport, format_progress, report_paths, stage_percent
+from .scenarios import parse_values, scenario_list
+from .virtual_grid import load_virtual_grid, virtual_grid_paths
+from .volume_calculation_grid import (
+    compute_grid_volumes, generate_virtual_grid, grid_features, grid_fields, materialize_grid_cells
+)
+
+
+FILL_MODES = ('wmean', 'mean', 'median', 'mode')
+
+# Primeira opção: GeoTIFF sem compressão, como até aqui
+COG_OPTIONS = ('None',) + COG_COMPRESSIONS
+
+# Progress (%) at the start of each stage of generate_stable_beach_dem
+DEM_STAGE_PROGRESS = {
+    'profiles': 0,
+    'rasterize': 20,
+    'rasterize_and_write': 20,
+    'rasterize_update': 20,
+    'write_geotiff': 50,
+    'analytic_surface': 60,
+    'analytic_surface_update': 60,
+    'vector_outputs': 85,
+    'provenance': 92,
+    'scenarios': 94,
+    'cog': 95,
+    'geopackage': 96,
+}
+
+# Progress (%) at the start of each stage of epochs.compare_epochs
+EPOCH_STAGE_PROGRESS = {
+    'epochs': 0,
+    'cog': 90,
+}
+
+
+class FeedbackReport(RunReport):
+    """
+    RunReport that forwards the run to a Processing feedback: stage names
+    go to the log, the progress bar follows each stage's share and the
+    progress within it, and cancelling the feedback cancels the run at its
+    next progress check.
+    """
+
+    def __init__(self, feedback, stage_progress):
+        super().__init__()
+        self.feedback = feedback
+        self.stage_progress = stage_progress
+
+    def is_cancelled(self):
+        return self.feedback.isCanceled() or super().is_cancelled()
+
+    def on_stage(self, name):
+        self.feedback.pushInfo(f"Stage: {name}")
+        percent = stage_percent(self.stage_progress, name)
+        if percent is not None:
+            self.feedback.setProgress(percent)
+
+    def on_progress(self, stage, done, total, unit, rate, eta):
+        self.feedback.setProgressText(format_progress(stage, done, total, unit, rate, eta))
+        percent = stage_percent(self.stage_progress, stage, done / total if total else 1.0)
+        if percent is not None:
+            self.feedback.setProgress(percent)
+
+
+class StableBeachAlgorithm(QgsProcessingAlgorithm):
+    """Common boilerplate of the provider's algorithms."""
+
+    def tr(self, string):
+        return QCoreApplication.translate('StableBeachDEM', string)
+
+    def createInstance(self):
+        return type(self)()
+
+    def group(self):
+        return self.tr('Stable beach')
+
+    def groupId(self):
+        return 'stablebeach'
+
+    def add_cog_parameters(self):
+        self.addParameter(QgsProcessingParameterEnum(
+            'COG_COMPRESSION', self.tr('Raster compression (Cloud Optimized GeoTIFF with overviews)'),
+            options=list(COG_OPTIONS), defaultValue=0))
+        self.addParameter(QgsProcessingParameterBoolean(
+            'COG_THREADS', self.tr('Multi-threaded compression'), defaultValue=False))
+
+    def cog_settings(self, parameters, context):
+        """(compression, NUM_THREADS value) of the COG parameters; compression is None when off."""
+        compression = COG_OPTIONS[self.parameterAsEnum(parameters, 'COG_COMPRESSION', context)]
+        if compression == 'None':
+            return None, None
+        threads = 'ALL_CPUS' if self.parameterAsBool(parameters, 'COG_THREADS', context) else None
+        return compression, threads
+
+    def write_cog_output(self, output_path, parameters, context):
+        """Rewrite a finished raster output as COG when the COG parameters ask for it."""
+        compression, threads = self.cog_settings(parameters, context)
+        if compression is None:
+            return
+        if os.path.splitext(output_path)[1].lower() not in ('.tif', '.tiff'):
+            raise QgsProcessingException(self.tr('The COG output needs a GeoTIFF (.tif) destination'))
+        write_cog(output_path, compression, threads)
+
+    def mask_source_path(self, parameters, context, feedback):
+        """
+        File path OGR can open for the MASK feature source, or None when it
+        is not set. Layers OGR cannot read directly (memory layers,
+        selections, other providers) are exported to a GeoPackage first.
+        """
+        if self.parameterAsSource(parameters, 'MASK', context) is None:
+            return None
+        return self.parameterAsCompatibleSourceLayerPath(
+            parameters, 'MASK', context, ['shp', 'gpkg'], 'gpkg', feedback)
+
+
+class GenerateStableBeachDemAlgorithm(StableBeachAlgorithm):
+    DEM = 'DEM'
+    LINE_A = 'LINE_A'
+    LINE_B = 'LINE_B'
+    SLOPE = 'SLOPE'
+    DISTANCE_INTERVAL = 'DISTANCE_INTERVAL'
+    PAIR_FIELD = 'PAIR_FIELD'
+    TILE_MEMORY_MB = 'TILE_MEMORY_MB'
+    BIGTIFF = 'BIGTIFF'
+    SPARSE = 'SPARSE'
+    ANALYTIC_SURFACE = 'ANALYTIC_SURFACE'
+    INCREMENTAL = 'INCREMENTAL'
+    SCENARIO_SLOPES = 'SCENARIO_SLOPES'
+    SCENARIO_OFFSETS = 'SCENARIO_OFFSETS'
+    GEOPACKAGE = 'GEOPACKAGE'
+    OUTPUT = 'OUTPUT'
+    PROFILES = 'PROFILES'
+    POINTS = 'POINTS'
+    MASK = 'MASK'
+    SURFACE = 'SURFACE'
+    SCENARIOS = 'SCENARIOS'
+    SCENARIO_VOLUMES = 'SCENARIO_VOLUMES'
+    CONTAINER = 'CONTAINER'
+    REPORT = 'REPORT'
+
+    def name(self):
+        return 'generatestablebeachdem'
+
+    def displayName(self):
+        return self.tr('Generate stable beach DEM')
+
+    def shortHelpString(self):
+        return self.tr(
+            'Casts profiles from Line A to Line B at a constant slope and burns them into a raw DEM. '
+            'Also writes the profile lines, the profile end points and the mask polygon next to the '
+            'output raster, and optionally the analytic surface between profiles. Scenario slopes '
+            'and offsets add a multi-band raster with one band per scenario and, with the analytic '
+            'surface, its volume table. '
+            'With the GeoPackage option every layer and raster goes into one <output>.gpkg. '
+            'Raster compression rewrites every raster as a compressed Cloud Optimized GeoTIFF '
+            'with internal overviews once the run is complete.'
+        )
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(QgsProcessingParameterRasterLayer(self.DEM, self.tr('DEM')))
+        self.addParameter(QgsProcessingParameterVectorLayer(
+            self.LINE_A, self.tr('Line A (profile start)'), [QgsProcessing.TypeVectorLine]))
+        self.addParameter(QgsProcessingParameterVectorLayer(
+            self.LINE_B, self.tr('Line B (profile end)'), [QgsProcessing.TypeVectorLine]))
+        self.addParameter(QgsProcessingParameterNumber(
+            self.SLOPE, self.tr('Slope (degrees)'), QgsProcessingParameterNumber.Double,
+            defaultValue=5.0, minValue=0.0, maxValue=89.0))
+        self.addParameter(QgsProcessingParameterNumber(
+            self.DISTANCE_INTERVAL, self.tr('Profile interval (0 = one profile per Line A vertex)'),
+            QgsProcessingParameterNumber.Double, defaultValue=0.0, minValue=0.0))
+        self.addParameter(QgsProcessingParameterField(
+            self.PAIR_FIELD, self.tr('Pair Line A / Line B features by field (nearest feature if empty)'),
+            parentLayerParameterName=self.LINE_A, optional=True))
+        self.addParameter(QgsProcessingParameterNumber(
+            self.TILE_MEMORY_MB, self.tr('Tiled output memory budget in MB (0 = not tiled)'),
+            QgsProcessingParameterNumber.Double, defaultValue=0.0, minValue=0.0))
+        self.addParameter(QgsProcessingParameterBoolean(self.BIGTIFF, self.tr('BigTIFF'), defaultValue=False))
+        self.addParameter(QgsProcessingParameterBoolean(
+            self.SPARSE, self.tr('Sparse output (skip empty blocks)'), defaultValue=False))
+        self.addParameter(QgsProcessingParameterBoolean(
+            self.ANALYTIC_SURFACE, self.tr('Also write the analytic surface'), defaultValue=False))
+        self.addParameter(QgsProcessingParameterBoolean(
+            self.INCREMENTAL, self.tr('Incremental (only update the profiles changed since the last run)'),
+            defaultValue=False))
+        self.addParameter(QgsProcessingParameterString(
+            self.SCENARIO_SLOPES, self.tr('Scenario slopes in degrees (comma separated)'), optional=True))
+        self.addParameter(QgsProcessingParameterString(
+            self.SCENARIO_OFFSETS, self.tr('Scenario vertical offsets in m (comma separated, default 0)'),
+            optional=True))
+        self.addParameter(QgsProcessingParameterBoolean(
+            self.GEOPACKAGE, self.tr('Write every output into one GeoPackage'), defaultValue=False))
+        self.add_cog_parameters()
+        self.addParameter(QgsProcessingParameterRasterDestination(self.OUTPUT, self.tr('Stable beach DEM')))
+
+        self.addOutput(QgsProcessingOutputVectorLayer(self.PROFILES, self.tr('Profiles'), QgsProcessing.TypeVectorLine))
+        self.addOutput(QgsProcessingOutputVectorLayer(self.POINTS, self.tr('Profile points'), QgsProcessing.TypeVectorPoint))
+        self.addOutput(QgsProcessingOutputVectorLayer(self.MASK, self.tr('Mask'), QgsProcessing.TypeVectorPolygon))
+        self.addOutput(QgsProcessingOutputRasterLayer(self.SURFACE, self.tr('Analytic surface')))
+        self.addOutput(QgsProcessingOutputRasterLayer(self.SCENARIOS, self.tr('Scenarios')))
+        self.addOutput(QgsProcessingOutputFile(self.SCENARIO_VOLUMES, self.tr('Scenario volumes')))
+        self.addOutput(QgsProcessingOutputFile(self.CONTAINER, self.tr('GeoPackage')))
+        self.addOutput(QgsProcessingOutputFile(self.REPORT, self.tr('Run report')))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        dem_layer = self.parameterAsRasterLayer(parameters, self.DEM, context)
+        line_a = self.parameterAsVectorLayer(parameters, self.LINE_A, context)
+        line_b = self.parameterAsVectorLayer(parameters, self.LINE_B, context)
+        if dem_layer is None or line_a is None or line_b is None:
+            raise QgsProcessingException(self.tr('Invalid input layers'))
+
+        slope = self.parameterAsDouble(parameters, self.SLOPE, context)
+        distance_interval = self.parameterAsDouble(parameters, self.DISTANCE_INTERVAL, context) or None
+        tile_memory_mb = self.parameterAsDouble(parameters, self.TILE_MEMORY_MB, context) or None
+        analytic_surface = self.parameterAsBool(parameters, self.ANALYTIC_SURFACE, context)
+        geopackage = self.parameterAsBool(parameters, self.GEOPACKAGE, context)
+        incremental = self.parameterAsBool(parameters, self.INCREMENTAL, context)
+        bigtiff = self.parameterAsBool(parameters, self.BIGTIFF, context)
+        cog_compression, cog_threads = self.cog_settings(parameters, context)
+        output_path = self.parameterAsOutputLayer(parameters, self.OUTPUT, context)
+        try:
+            check_output_format(incremental, geopackage, cog_compression)
+        except ValueError as e:
+            raise QgsProcessingException(str(e))
+        try:
+            scenarios = scenario_list(self.parameterAsString(parameters, self.SCENARIO_SLOPES, context),
+                                      self.parameterAsString(parameters, self.SCENARIO_OFFSETS, context))
+        except ValueError:
+            raise QgsProcessingException(self.tr('Invalid scenario slopes or offsets'))
+
+        report = FeedbackReport(feedback, DEM_STAGE_PROGRESS).start()
+        success, message, profiles_path = generate_stable_beach_dem(
+            dem_layer, line_a, line_b, slope, output_path, distance_interval,
+            tile_memory_mb=tile_memory_mb,
+            bigtiff=bigtiff,
+            sparse=self.parameterAsBool(parameters, self.SPARSE, context),
+            analytic_surface=analytic_surface,
+            report=report,
+            load_layers=False,
+            pair_field=self.parameterAsString(parameters, self.PAIR_FIELD, context) or None,
+            incremental=incremental,
+            scenarios=scenarios or None,
+            geopackage=geopackage
+        )
+        if feedback.isCanceled():
+            return {}
+        if not success:
+            raise QgsProcessingException(message)
+
+        paths = output_paths(output_path, geopackage)
+        rasters = {'dem': output_path, 'surface': paths['surface'], 'scenarios': paths['scenarios']}
+        if cog_compression:
+            report.set_parameters(cog_compression=cog_compression, cog_threads=cog_threads)
+            with report.stage('cog'):
+                cog_raster_outputs(output_path, cog_compression, cog_threads, bigtiff,
+                                   progress=lambda done, total: report.progress(done, total, 'rasters'))
+        if geopackage:
+            with report.stage('geopackage'):
+                rasters.update(pack_raster_outputs(output_path))
+            # Só a primeira banda dos cenários como saída raster
+            if isinstance(rasters['scenarios'], list):
+                rasters['scenarios'] = rasters['scenarios'][0]
+        report.finish()
+        report.write(output_path)
+        feedback.setProgress(100)
+
+        results = {
+            self.OUTPUT: rasters['dem'],
+            self.PROFILES: profiles_path,
+            self.POINTS: paths['points'] if os.path.exists(layer_file(paths['points'])) else None,
+            self.MASK: paths['mask'] if os.path.exists(layer_file(paths['mask'])) else None,
+            self.SURFACE: rasters['surface'] if analytic_surface else None,
+            self.SCENARIOS: rasters['scenarios'] if scenarios else None,
+            self.SCENARIO_VOLUMES: (paths['scenario_volumes']
+                                    if scenarios and os.path.exists(paths['scenario_volumes']) else None),
+            self.CONTAINER: paths['geopackage'] if geopackage else None,
+            self.REPORT: report_paths(output_path)[0],
+        }
+        return results
+
+
+class InterpolateSurfaceAlgorithm(StableBeachAlgorithm):
+    INPUT = 'INPUT'
+    BACKEND = 'BACKEND'
+    MODE = 'MODE'
+    POWER = 'POWER'
+    CELLS = 'CELLS'
+    DISTANCE = 'DISTANCE'
+    NO_NULLS = 'NO_NULLS'
+    OUTPUT = 'OUTPUT'
+
+    def name(self):
+        return 'interpolatesurface'
+
+    def displayName(self):
+        return self.tr('Interpolate stable beach surface')
+
+    def shortHelpString(self):
+        return self.tr(
+            'Fills the gaps between the profiles of a raw stable beach DEM with GRASS r.fill.stats, '
+            'its in-process NumPy equivalent or gdal.FillNodata.'
+        )
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(QgsProcessingParameterRasterLayer(self.INPUT, self.tr('Raw stable beach DEM')))
+        self.addParameter(QgsProcessingParameterEnum(
+            self.BACKEND, self.tr('Fill backend'), options=list(FILL_BACKENDS), defaultValue=0))
+        self.addParameter(QgsProcessingParameterEnum(
+            self.MODE, self.tr('Interpolation mode'), options=list(FILL_MODES), defaultValue=0))
+        self.addParameter(QgsProcessingParameterNumber(
+            self.POWER, self.tr('Power'), QgsProcessingParameterNumber.Double, defaultValue=2.0, minValue=0.0))
+        self.addParameter(QgsProcessingParameterNumber(
+            self.CELLS, self.tr('Number of cells'), QgsProcessingParameterNumber.Integer,
+            defaultValue=6, minValue=1, maxValue=100))
+        self.addParameter(QgsProcessingParameterNumber(
+            self.DISTANCE, self.tr('Search distance'), QgsProcessingParameterNumber.Double,
+            defaultValue=0.5, minValue=0.0, maxValue=100.0))
+        self.addParameter(QgsProcessingParameterBoolean(
+            self.NO_NULLS, self.tr('Do not propagate nulls'), defaultValue=True))
+        self.addParameter(QgsProcessingParameterRasterDestination(self.OUTPUT, self.tr('Surface')))
+        self.add_cog_parameters()
+
+    def processAlgorithm(self, parameters, context, feedback):
+        input_layer = self.parameterAsRasterLayer(parameters, self.INPUT, context)
+        if input_layer is None:
+            raise QgsProcessingException(self.tr('Invalid input raster'))
+        output_path = self.parameterAsOutputLayer(parameters, self.OUTPUT, context)
+
+        ok = interpolate_surface(
+            input_layer.source(),
+            output_path,
+            mode=FILL_MODES[self.parameterAsEnum(parameters, self.MODE, context)],
+            power=self.parameterAsDouble(parameters, self.POWER, context),
+            cells=self.parameterAsInt(parameters, self.CELLS, context),
+            distance=self.parameterAsDouble(parameters, self.DISTANCE, context),
+            no_nulls=self.parameterAsBool(parameters, self.NO_NULLS, context),
+            backend=FILL_BACKENDS[self.parameterAsEnum(parameters, self.BACKEND, context)],
+            feedback=feedback
+        )
+        if feedback.isCanceled():
+            return {}
+        if not ok:
+            raise QgsProcessingException(self.tr('Surface interpolation failed, see the log'))
+        self.write_cog_output(output_path, parameters, context)
+        return {self.OUTPUT: output_path}
+
+
+class CropSurfaceAlgorithm(StableBeachAlgorithm):
+    INPUT = 'INPUT'
+    MASK = 'MASK'
+    OUTPUT = 'OUTPUT'
+
+    def name(self):
+        return 'cropsurfacewithmask'
+
+    def displayName(self):
+        return self.tr('Crop surface with mask')
+
+    def shortHelpString(self):
+        return self.tr(
+            'Clips the interpolated surface to the profile envelope mask, keeping its NoData value. '
+            'The mask is rasterized once on the surface grid and applied in process, block by block.'
+        )
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(QgsProcessingParameterRasterLayer(self.INPUT, self.tr('Surface')))
+        self.addParameter(QgsProcessingParameterFeatureSource(
+            self.MASK, self.tr('Mask'), [QgsProcessing.TypeVectorPolygon]))
+        self.addParameter(QgsProcessingParameterRasterDestination(self.OUTPUT, self.tr('Cropped surface')))
+        self.add_cog_parameters()
+
+    def processAlgorithm(self, parameters, context, feedback):
+        surface_layer = self.parameterAsRasterLayer(parameters, self.INPUT, context)
+        if surface_layer is None:
+            raise QgsProcessingException(self.tr('Invalid input layers'))
+        mask_path = self.mask_source_path(parameters, context, feedback)
+        if mask_path is None:
+            raise QgsProcessingException(self.invalidSourceError(parameters, self.MASK))
+        output_path = self.parameterAsOutputLayer(parameters, self.OUTPUT, context)
+
+        try:
+            cropped_path = crop_surface_with_mask(
+                surface_layer.source(), mask_path,
+                output_path=output_path, load_layer=False, feedback=feedback
+            )
+        except RunCancelled:
+            return {}
+        if not cropped_path:
+            raise QgsProcessingException(self.tr('Cropping failed, see the log'))
+        self.write_cog_output(cropped_path, parameters, context)
+        return {self.OUTPUT: cropped_path}
+
+
+class GenerateGridAlgorithm(StableBeachAlgorithm):
+    MASK = 'MASK'
+    CELL_SIZE = 'CELL_SIZE'
+    ONLY_OVERLAP = 'ONLY_OVERLAP'
+    SURFACE = 'SURFACE'
+    DEM = 'DEM'
+    OUTPUT = 'OUTPUT'
+    FILL = 'FILL'
+    CUT = 'CUT'
+    NET = 'NET'
+
+    def name(self):
+        return 'generatevolumegrid'
+
+    def displayName(self):
+        return self.tr('Generate volume calculation grid')
+
+    def shortHelpString(self):
+        return self.tr(
+            'Square grid over the extent of the mask, optionally only the cells that overlap it. With a '
+            'stable surface and a DEM, every cell also gets its covered area, coverage fraction and the '
+            'fill, cut and net volume between them.'
+        )
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(QgsProcessingParameterFeatureSource(
+            self.MASK, self.tr('Mask'), [QgsProcessing.TypeVectorPolygon]))
+        self.addParameter(QgsProcessingParameterNumber(
+            self.CELL_SIZE, self.tr('Grid cell size'), QgsProcessingParameterNumber.Double,
+            defaultValue=10.0, minValue=0.000001))
+        self.addParameter(QgsProcessingParameterBoolean(
+            self.ONLY_OVERLAP, self.tr('Only generate overlap cells'), defaultValue=False))
+        self.addParameter(QgsProcessingParameterRasterLayer(
+            self.SURFACE, self.tr('Stable surface (for volumes)'), optional=True))
+        self.addParameter(QgsProcessingParameterRasterLayer(
+            self.DEM, self.tr('DEM (for volumes)'), optional=True))
+        self.addParameter(QgsProcessingParameterFeatureSink(
+            self.OUTPUT, self.tr('Calculation grid'), QgsProcessing.TypeVectorPolygon))
+        self.addOutput(QgsProcessingOutputNumber(self.FILL, self.tr('Fill volume')))
+        self.addOutput(QgsProcessingOutputNumber(self.CUT, self.tr('Cut volume')))
+        self.addOutput(QgsProcessingOutputNumber(self.NET, self.tr('Net volume')))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        source = self.parameterAsSource(parameters, self.MASK, context)
+        if source is None:
+            raise QgsProcessingException(self.invalidSourceError(parameters, self.MASK))
+        mask_geometries = [feat.geometry() for feat in source.getFeatures()]
+        if not mask_geometries:
+            raise QgsProcessingException(self.tr('The mask layer has no features'))
+
+        cell_size = self.parameterAsDouble(parameters, self.CELL_SIZE, context)
+        surface_layer = self.parameterAsRasterLayer(parameters, self.SURFACE, context)
+        dem_layer = self.parameterAsRasterLayer(parameters, self.DEM, context)
+        volumes = None
+        if surface_layer is not None and dem_layer is not None:
+            feedback.pushInfo(self.tr('Computing cut / fill volumes per cell'))
+            try:
+                volumes = compute_grid_volumes(source.sourceExtent(), cell_size, surface_layer.source(),
+                                               dem_layer.source(), feedback)
+            except RunCancelled:
+                return {}
+        elif surface_layer is not None or dem_layer is not None:
+            raise QgsProcessingException(self.tr('Volumes need both the stable surface and the DEM'))
+
+        sink, dest_id = self.parameterAsSink(
+            parameters, self.OUTPUT, context, grid_fields(volumes is not None), QgsWkbTypes.Polygon,
+            source.sourceCrs()
+        )
+        if sink is None:
+            raise QgsProcessingException(self.invalidSinkError(parameters, self.OUTPUT))
+
+        batch = []
+        for feat in grid_features(
+            source.sourceExtent(), mask_geometries, cell_size,
+            self.parameterAsBool(parameters, self.ONLY_OVERLAP, context),
+            feedback, volumes
+        ):
+            batch.append(feat)
+            if len(batch) >= GRID_BATCH_SIZE:
+                sink.addFeatures(batch, QgsFeatureSink.FastInsert)
+                batch = []
+        if batch:
+            sink.addFeatures(batch, QgsFeatureSink.FastInsert)
+
+        results = {self.OUTPUT: dest_id}
+        if volumes is not None:
+            totals = volumes.summary()
+            feedback.pushInfo(self.tr(f"Fill {totals['fill']}, cut {totals['cut']}, net {totals['net']}"))
+            results.update({self.FILL: totals['fill'], self.CUT: totals['cut'], self.NET: totals['net']})
+        return results
+
+
+class GenerateVirtualGridAlgorithm(StableBeachAlgorithm):
+    MASK = 'MASK'
+    CELL_SIZE = 'CELL_SIZE'
+    ONLY_OVERLAP = 'ONLY_OVERLAP'
+    SURFACE = 'SURFACE'
+    DEM = 'DEM'
+    OUTPUT = 'OUTPUT'
+    IDS = 'IDS'
+    CELLS = 'CELLS'
+
+    def name(self):
+        return 'generatevirtualgrid'
+
+    def displayName(self):
+        return self.tr('Generate raster-aligned virtual grid')
+
+    def shortHelpString(self):
+        return self.tr(
+            'Calculation grid snapped to the pixels of the stable surface, stored as a JSON definition, a '
+            'cell-id raster and a CSV table of cell attributes instead of one polygon per cell. The cell '
+            'size is rounded to a whole number of pixels. With a DEM the table gets the per-cell volumes. '
+            'Raster compression writes the cell-id raster as a compressed Cloud Optimized GeoTIFF.'
+        )
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(QgsProcessingParameterVectorLayer(
+            self.MASK, self.tr('Mask'), [QgsProcessing.TypeVectorPolygon]))
+        self.addParameter(QgsProcessingParameterNumber(
+            self.CELL_SIZE, self.tr('Grid cell size'), QgsProcessingParameterNumber.Double,
+            defaultValue=10.0, minValue=0.000001))
+        self.addParameter(QgsProcessingParameterBoolean(
+            self.ONLY_OVERLAP, self.tr('Only generate overlap cells'), defaultValue=False))
+        self.addParameter(QgsProcessingParameterRasterLayer(self.SURFACE, self.tr('Stable surface')))
+        self.addParameter(QgsProcessingParameterRasterLayer(
+            self.DEM, self.tr('DEM (for volumes)'), optional=True))
+        self.addParameter(QgsProcessingParameterFileDestination(
+            self.OUTPUT, self.tr('Grid definition'), self.tr('JSON files (*.json)')))
+        self.add_cog_parameters()
+        self.addOutput(QgsProcessingOutputRasterLayer(self.IDS, self.tr('Cell ids')))
+        self.addOutput(QgsProcessingOutputFile(self.CELLS, self.tr('Cell table')))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        mask_layer = self.parameterAsVectorLayer(parameters, self.MASK, context)
+        surface_layer = self.parameterAsRasterLayer(parameters, self.SURFACE, context)
+        if mask_layer is None or surface_layer is None:
+            raise QgsProcessingException(self.tr('Invalid input layers'))
+        dem_layer = self.parameterAsRasterLayer(parameters, self.DEM, context)
+        output_path = self.parameterAsFileOutput(parameters, self.OUTPUT, context)
+
+        ok, message = generate_virtual_grid(
+            mask_layer, self.parameterAsDouble(parameters, self.CELL_SIZE, context),
+            only_overlap=self.parameterAsBool(parameters, self.ONLY_OVERLAP, context),
+            output_path=output_path, load_layer=False, feedback=feedback,
+            dem_path=dem_layer.source() if dem_layer is not None else None,
+            surface_path=surface_layer.source()
+        )
+        if feedback.isCanceled():
+            return {}
+        if not ok:
+            raise QgsProcessingException(message)
+        feedback.pushInfo(message)
+        paths = virtual_grid_paths(output_path)
+        self.write_cog_output(paths['ids'], parameters, context)
+        return {self.OUTPUT: output_path, self.IDS: paths['ids'], self.CELLS: paths['cells']}
+
+
+class MaterializeGridCellsAlgorithm(StableBeachAlgorithm):
+    GRID = 'GRID'
+    EXTENT = 'EXTENT'
+    CELL_IDS = 'CELL_IDS'
+    OUTPUT = 'OUTPUT'
+
+    def name(self):
+        return 'materializegridcells'
+
+    def displayName(self):
+        return self.tr('Build virtual grid cell polygons')
+
+    def shortHelpString(self):
+        return self.tr(
+            'Polygons of some cells of a virtual grid, with the attributes of its cell table: the cells '
+            'touching the extent and / or with the listed ids, or every cell when neither is given.'
+        )
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(QgsProcessingParameterFile(
+            self.GRID, self.tr('Virtual grid definition'), extension='json'))
+        self.addParameter(QgsProcessingParameterExtent(self.EXTENT, self.tr('Extent'), optional=True))
+        self.addParameter(QgsProcessingParameterString(
+            self.CELL_IDS, self.tr('Cell ids (e.g. 12, 13, 40)'), optional=True))
+        self.addParameter(QgsProcessingParameterFileDestination(
+            self.OUTPUT, self.tr('Grid cells'), self.tr('ESRI Shapefile (*.shp)')))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        definition_path = self.parameterAsFile(parameters, self.GRID, context)
+        grid, _ = load_virtual_grid(definition_path)
+        crs = QgsCoordinateReferenceSystem.fromWkt(grid.projection) if grid.projection else QgsCoordinateReferenceSystem()
+        extent = self.parameterAsExtent(parameters, self.EXTENT, context, crs)
+        if extent.isNull():
+            extent = None
+        ids = [int(value) for value in parse_values(self.parameterAsString(parameters, self.CELL_IDS, context))]
+        output_path = self.parameterAsFileOutput(parameters, self.OUTPUT, context)
+
+        ok, message = materialize_grid_cells(definition_path, extent=extent, ids=ids or None,
+                                             output_path=output_path, load_layer=False)
+        if not ok:
+            raise QgsProcessingException(message)
+        feedback.pushInfo(message)
+        return {self.OUTPUT: output_path}
+
+
+class CompareEpochsAlgorithm(StableBeachAlgorithm):
+    SURFACE = 'SURFACE'
+    EPOCHS = 'EPOCHS'
+    MASK = 'MASK'
+    DIFFERENCES = 'DIFFERENCES'
+    OUTPUT = 'OUTPUT'
+    DIFFERENCES_RASTER = 'DIFFERENCES_RASTER'
+    REPORT = 'REPORT'
+
+    def name(self):
+        return 'compareepochs'
+
+    def displayName(self):
+        return self.tr('Compare survey epochs with the stable surface')
+
+    def shortHelpString(self):
+        return self.tr(
+            'Cut, fill and net volume and coverage of the stable surface against each survey DEM, in '
+            'the order given, within the mask. The surveys are read block by block alongside the '
+            'surface, so any number of them runs in bounded memory. Optionally writes the surface '
+            'minus each survey as one band per epoch, as a compressed Cloud Optimized GeoTIFF with '
+            'raster compression.'
+        )
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(QgsProcessingParameterRasterLayer(self.SURFACE, self.tr('Stable surface')))
+        self.addParameter(QgsProcessingParameterMultipleLayers(
+            self.EPOCHS, self.tr('Survey DEMs (oldest first)'), QgsProcessing.TypeRaster))
+        self.addParameter(QgsProcessingParameterFeatureSource(
+            self.MASK, self.tr('Mask'), [QgsProcessing.TypeVectorPolygon], optional=True))
+        self.addParameter(QgsProcessingParameterBoolean(
+            self.DIFFERENCES, self.tr('Also write the difference rasters'), defaultValue=False))
+        self.addParameter(QgsProcessingParameterFileDestination(
+            self.OUTPUT, self.tr('Epoch volumes'), self.tr('CSV files (*.csv)')))
+        self.add_cog_parameters()
+
+        self.addOutput(QgsProcessingOutputRasterLayer(self.DIFFERENCES_RASTER, self.tr('Differences')))
+        self.addOutput(QgsProcessingOutputFile(self.REPORT, self.tr('Run report')))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        surface_layer = self.parameterAsRasterLayer(parameters, self.SURFACE, context)
+        epoch_layers = self.parameterAsLayerList(parameters, self.EPOCHS, context)
+        if surface_layer is None or not epoch_layers:
+            raise QgsProcessingException(self.tr('Invalid input layers'))
+        mask_path = self.mask_source_path(parameters, context, feedback)
+        differences = self.parameterAsBool(parameters, self.DIFFERENCES, context)
+        output_path = self.parameterAsFileOutput(parameters, self.OUTPUT, context)
+
+        report = FeedbackReport(feedback, EPOCH_STAGE_PROGRESS).start()
+        success, message, outputs = compare_epochs(
+            surface_layer.source(), [layer.source() for layer in epoch_layers], output_path,
+            mask_path=mask_path,
+            differences=differences, report=report
+        )
+        if feedback.isCanceled():
+            return {}
+        if not success:
+            raise QgsProcessingException(message)
+        differences_path = outputs.get('differences')
+        if differences_path:
+            with report.stage('cog'):
+                self.write_cog_output(differences_path, parameters, context)
+        report.finish()
+        report.write(output_path)
+        feedback.pushInfo(message)
+        return {
+            self.OUTPUT: output_path,
+            self.DIFFERENCES_RASTER: differences_path,
+            self.REPORT: report_paths(output_path)[0],
+        }
+
+
+class StableBeachProvider(QgsProcessingProvider):
+
+    def id(self):
+        return 'stablebeachdem'
+
+    def name(self):
+        return 'Stable Beach DEM'
+
+    def longName(self):
+        return self.name()
+
+    def loadAlgorithms(self):
+        self.addAlgorithm(GenerateStableBeachDemAlgorithm())
+        self.addAlgorithm(InterpolateSurfaceAlgorithm())
+        self.addAlgorithm(CropSurfaceAlgorithm())
+        self.addAlgorithm(GenerateGridAlgorithm())
+        self.addAlgorithm(GenerateVirtualGridAlgorithm())
+        self.addAlgorithm(MaterializeGridCellsAlgorithm())
+        self.addAlgorithm(CompareEpochsAlgorithm())
@@ -0,0 +1,441 @@
+"""
+Vectorized profile engine used by generate_dem.
+
+Everything in this module works on plain NumPy arrays so that a whole set of
+cross-shore profiles can be processed in one batch instead of one pixel at a
+time.
+"""
+import math
+
+import numpy as np
+
+
+# Offsets of the 3x3 neighbourhood, in the same order used by the original
+# per-pixel loop (row offset outer, column offset inner)
+NEIGHBOUR_ROW_OFFSETS = np.repeat(np.array([-1, 0, 1], dtype=np.int64), 3)
+NEIGHBOUR_COL_OFFSETS = np.tile(np.array([-1, 0, 1], dtype=np.int64), 3)
+
+# Number of profile samples handled per batch by rasterize_profiles
+DEFAULT_CHUNK_SAMPLES = 1_000_000
+
+
+def interpolate_line_by_distance(xs, ys, distance):
+    """
+    Sample a polyline at regular intervals.
+
+    The line is split into max(int(length / distance), 1) equal intervals and
+    both endpoints are included. Segment lengths are accumulated once and
+    every sample is located with a single searchsorted call, so the cost is
+    O((vertices + samples) log vertices). Returns (x, y) arrays.
+    """
+    xs = np.asarray(xs, dtype=np.float64)
+    ys = np.asarray(ys, dtype=np.float64)
+    if xs.size < 2:
+        return np.empty(0, dtype=np.float64), np.empty(0, dtype=np.float64)
+
+    seg_dx = np.diff(xs)
+    seg_dy = np.diff(ys)
+    seg_len = np.hypot(seg_dx, seg_dy)
+    cum_end = np.cumsum(seg_len)
+    total_length = cum_end[-1]
+
+    num_intervals = max(int(total_length / distance), 1)
+    dist_along = np.arange(num_intervals + 1, dtype=np.float64) * total_length / num_intervals
+    dist_along[-1] = total_length
+
+    # First segment whose end reaches each sample distance
+    seg = np.searchsorted(cum_end, dist_along, side='left')
+    seg = np.minimum(seg, seg_len.size - 1)
+    seg_start = cum_end[seg] - seg_len[seg]
+
+    fraction = np.zeros_like(dist_along)
+    nonzero = seg_len[seg] > 0
+    fraction[nonzero] = (dist_along[nonzero] - seg_start[nonzero]) / seg_len[seg][nonzero]
+
+    return xs[seg] + seg_dx[seg] * fraction, ys[seg] + seg_dy[seg] * fraction
+
+
+class LineSegmentIndex:
+    """
+    Bucketed grid index over the segments of a (multi)polyline, answering
+    nearest-point queries for many points at once.
+
+    Each segment is registered in every grid cell its bounding box touches.
+    A query scans square rings of cells around its own cell and stops as soon
+    as the best distance found cannot be beaten by any unscanned cell, so the
+    cost per query depends on the local segment density and not on the total
+    vertex count of the line.
+    """
+
+    def __init__(self, parts, cell_size=None):
+        """
+        parts: iterable of (xs, ys) vertex sequences, one per line part
+        cell_size: grid bucket size; defaults to the larger of the mean
+                   segment length and the spacing that gives about one
+                   segment per cell over the line's bounding box
+        """
+        x0, y0, x1, y1 = [], [], [], []
+        for xs, ys in parts:
+            xs = np.asarray(xs, dtype=np.float64)
+            ys = np.asarray(ys, dtype=np.float64)
+            if xs.size < 2:
+                continue
+            x0.append(xs[:-1])
+            y0.append(ys[:-1])
+            x1.append(xs[1:])
+            y1.append(ys[1:])
+        if not x0:
+            raise ValueError("Line has no segments")
+
+        self.x0 = np.concatenate(x0)
+        self.y0 = np.concatenate(y0)
+        self.x1 = np.concatenate(x1)
+        self.y1 = np.concatenate(y1)
+
+        self.min_x = float(min(self.x0.min(), self.x1.min()))
+        self.min_y = float(min(self.y0.min(), self.y1.min()))
+        max_x = float(max(self.x0.max(), self.x1.max()))
+        max_y = float(max(self.y0.max(), self.y1.max()))
+
+        if cell_size is None:
+            seg_len = np.hypot(self.x1 - self.x0, self.y1 - self.y0)
+            area = (max_x - self.min_x) * (max_y - self.min_y)
+            cell_size = max(float(seg_len.mean()), math.sqrt(area / seg_len.size))
+        if not cell_size > 0:
+            cell_size = 1.0
+        self.cell_size = cell_size
+
+        self.nx = int((max_x - self.min_x) / cell_size) + 1
+        self.ny = int((max_y - self.min_y) / cell_size) + 1
+
+        # Cell range covered by each segment's bounding box
+        ci0 = self._cell(np.minimum(self.x0, self.x1), self.min_x, self.nx)
+        ci1 = self._cell(np.maximum(self.x0, self.x1), self.min_x, self.nx)
+        cj0 = self._cell(np.minimum(self.y0, self.y1), self.min_y, self.ny)
+        cj1 = self._cell(np.maximum(self.y0, self.y1), self.min_y, self.ny)
+        span_i = ci1 - ci0 + 1
+        span_j = cj1 - cj0 + 1
+        per_seg = span_i * span_j
+
+        seg_ids = np.repeat(np.arange(per_seg.size), per_seg)
+        local = np.arange(int(per_seg.sum())) - np.repeat(np.cumsum(per_seg) - per_seg, per_seg)
+        cell_i = ci0[seg_ids] + local % span_i[seg_ids]
+        cell_j = cj0[seg_ids] + local // span_i[seg_ids]
+        cell_ids = cell_j * self.nx + cell_i
+
+        # Compressed (CSR) cell -> segment table
+        order = np.argsort(cell_ids, kind='stable')
+        self.cell_segments = seg_ids[order]
+        counts = np.bincount(cell_ids, minlength=self.nx * self.ny)
+        self.cell_start = np.concatenate(([0], np.cumsum(counts)))
+
+    def _cell(self, v, origin, n):
+        return np.clip(((v - origin) / self.cell_size).astype(np.int64), 0, n - 1)
+
+    def _project(self, px, py, seg):
+        """Closest point of each segment in seg to the matching query point."""
+        ax, ay = self.x0[seg], self.y0[seg]
+        bx, by = self.x1[seg], self.y1[seg]
+        vx, vy = bx - ax, by - ay
+        len2 = vx * vx + vy * vy
+        t = np.zeros_like(len2)
+        nonzero = len2 > 0
+        t[nonzero] = ((px[nonzero] - ax[nonzero]) * vx[nonzero] +
+                      (py[nonzero] - ay[nonzero]) * vy[nonzero]) / len2[nonzero]
+        t = np.clip(t, 0.0, 1.0)
+        qx = ax + t * vx
+        qy = ay + t * vy
+        return qx, qy, np.hypot(px - qx, py - qy)
+
+    def nearest(self, px, py):
+        """
+        Nearest point on the line for every query point.
+
+        Returns (x, y, distance) arrays.
+        """
+        px = np.atleast_1d(np.asarray(px, dtype=np.float64))
+        py = np.atleast_1d(np.asarray(py, dtype=np.float64))
+        n = px.size
+
+        best_x = np.full(n, np.nan)
+        best_y = np.full(n, np.nan)
+        best_d = np.full(n, np.inf)
+
+        # Unclamped cell of each query; points outside the grid are fine
+        qi = np.floor((px - self.min_x) / self.cell_size).astype(np.int64)
+        qj = np.floor((py - self.min_y) / self.cell_size).astype(np.int64)
+
+        # Ring beyond which no grid cell remains for each query
+        last_ring = np.maximum.reduce([
+            np.abs(qi), np.abs(qi - (self.nx - 1)),
+            np.abs(qj), np.abs(qj - (self.ny - 1))
+        ])
+
+        pending = np.arange(n)
+        ring = 0
+        while pending.size:
+            if ring == 0:
+                di = np.zeros(1, dtype=np.int64)
+                dj = np.zeros(1, dtype=np.int64)
+            else:
+                side = np.arange(-ring, ring + 1, dtype=np.int64)
+                inner = side[1:-1]
+                di = np.concatenate((side, side, np.full(inner.size, -ring), np.full(inner.size, ring)))
+                dj = np.concatenate((np.full(side.size, -ring), np.full(side.size, ring), inner, inner))
+
+            # Every (query, cell of the ring) pair at once
+            owners = np.repeat(pending, di.size)
+            ci = np.repeat(qi[pending], di.size) + np.tile(di, pending.size)
+            cj = np.repeat(qj[pending], di.size) + np.tile(dj, pending.size)
+            valid = (ci >= 0) & (ci < self.nx) & (cj >= 0) & (cj < self.ny)
+            owners = owners[valid]
+            cells = cj[valid] * self.nx + ci[valid]
+            counts = self.cell_start[cells + 1] - self.cell_start[cells]
+
+            if counts.sum() > 0:
+                pair_owner = np.repeat(owners, counts)
+                first = np.repeat(self.cell_start[cells], counts)
+                local = np.arange(int(counts.sum())) - np.repeat(np.cumsum(counts) - counts, counts)
+                seg = self.cell_segments[first + local]
+
+                qx, qy, d = self._project(px[pair_owner], py[pair_owner], seg)
+
+                # Best candidate of this ring for each query
+                order = np.lexsort((d, pair_owner))
+                owner_sorted = pair_owner[order]
+                head = np.concatenate(([True], owner_sorted[1:] != owner_sorted[:-1]))
+                pick = order[head]
+                owner = pair_owner[pick]
+                better = d[pick] < best_d[owner]
+                owner = owner[better]
+                pick = pick[better]
+                best_d[owner] = d[pick]
+                best_x[owner] = qx[pick]
+                best_y[owner] = qy[pick]
+
+            # Cells beyond this ring are at least ring * cell_size away
+            done = (best_d[pending] <= ring * self.cell_size) | (ring >= last_ring[pending])
+            pending = pending[~done]
+            ring += 1
+
+        return best_x, best_y, best_d
+
+
+def _unit_vectors(start_x, start_y, end_x, end_y):
+    """
+    Unit direction of each start -> end vector. A profile whose start and end
+    coincide points north (atan2(0, 0) is 0, i.e. north).
+    """
+    dx = np.asarray(end_x, dtype=np.float64) - np.asarray(start_x, dtype=np.float64)
+    dy = np.asarray(end_y, dtype=np.float64) - np.asarray(start_y, dtype=np.float64)
+    length = np.hypot(dx, dy)
+
+    unit_x = np.zeros_like(length)
+    unit_y = np.ones_like(length)
+    moving = length > 0
+    unit_x[moving] = dx[moving] / length[moving]
+    unit_y[moving] = dy[moving] / length[moving]
+    return unit_x, unit_y
+
+
+def profile_step_vectors(start_x, start_y, end_x, end_y, step_size, pixel_size_x, pixel_size_y):
+    """
+    Per-step displacement of each profile in raster coordinates.
+
+    Returns (row_steps, col_steps).
+    """
+    unit_x, unit_y = _unit_vectors(start_x, start_y, end_x, end_y)
+
+    row_steps = -unit_y * step_size / pixel_size_y
+    col_steps = unit_x * step_size / pixel_size_x
+    return row_steps, col_steps
+
+
+def profile_step_counts(origin_x, origin_y, start_x, start_y, end_x, end_y,
+                        step_size, tolerance, max_steps):
+    """
+    Number of raster steps each profile takes before reaching Line B.
+
+    The walk starts at origin (the corner of the start pixel) and heads in the
+    start -> end direction. Since end is the point of Line B closest to the
+    start, the distance left to Line B after s steps is the along-profile
+    distance to end minus s * step_size, so the count of steps that stay at
+    least tolerance away from Line B is known up front and no per-step
+    distance query is needed.
+    """
+    unit_x, unit_y = _unit_vectors(start_x, start_y, end_x, end_y)
+
+    # Along-profile distance from the walk origin to the end point
+    remaining = ((np.asarray(end_x, dtype=np.float64) - np.asarray(origin_x, dtype=np.float64)) * unit_x +
+                 (np.asarray(end_y, dtype=np.float64) - np.asarray(origin_y, dtype=np.float64)) * unit_y)
+
+    counts = np.floor((remaining - tolerance) / step_size).astype(np.int64) + 1
+    counts[remaining < tolerance] = 0
+    return np.clip(counts, 0, max_steps)
+
+
+def _expand_samples(start_rows, start_cols, row_steps, col_steps, elevations,
+                    elevation_step, n_steps, rows, cols):
+    """
+    Build the (row, col, elevation) samples of a group of profiles.
+
+    Each profile is cut at its first step that falls outside the raster, like
+    the original walk did. Samples are returned in profile order, then step
+    order.
+    """
+    total = int(n_steps.sum())
+    if total == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, np.empty(0, dtype=np.float64)
+
+    profile_idx = np.repeat(np.arange(n_steps.size), n_steps)
+    first_sample = np.cumsum(n_steps) - n_steps
+    step = np.arange(total, dtype=np.int64) - np.repeat(first_sample, n_steps)
+
+    r = np.rint(start_rows[profile_idx] + step * row_steps[profile_idx]).astype(np.int64)
+    c = np.rint(start_cols[profile_idx] + step * col_steps[profile_idx]).astype(np.int64)
+
+    # Truncate every profile at its first out-of-bounds step
+    outside = (r < 0) | (r >= rows) | (c < 0) | (c >= cols)
+    outside_step = np.where(outside, step, np.iinfo(np.int64).max)
+    active = n_steps > 0
+    first_outside = np.full(n_steps.size, np.iinfo(np.int64).max, dtype=np.int64)
+    first_outside[active] = np.minimum.reduceat(outside_step, first_sample[active])
+    keep = step < first_outside[profile_idx]
+
+    z = elevations[profile_idx] - step * elevation_step
+    return r[keep], c[keep], z[keep]
+
+
+def profile_cell_bounds(start_rows, start_cols, row_steps, col_steps, n_steps):
+    """
+    Inclusive (row_min, row_max, col_min, col_max) of the cells each profile
+    can write, including its 3x3 neighbourhood.
+    """
+    start_rows = np.asarray(start_rows, dtype=np.float64)
+    start_cols = np.asarray(start_cols, dtype=np.float64)
+    last = np.maximum(np.asarray(n_steps, dtype=np.float64) - 1, 0)
+    end_rows = start_rows + last * np.asarray(row_steps, dtype=np.float64)
+    end_cols = start_cols + last * np.asarray(col_steps, dtype=np.float64)
+    row_min = np.floor(np.minimum(start_rows, end_rows)).astype(np.int64) - 2
+    row_max = np.ceil(np.maximum(start_rows, end_rows)).astype(np.int64) + 2
+    col_min = np.floor(np.minimum(start_cols, end_cols)).astype(np.int64) - 2
+    col_max = np.ceil(np.maximum(start_cols, end_cols)).astype(np.int64) + 2
+    return row_min, row_max, col_min, col_max
+
+
+def iter_profile_cells(start_rows, start_cols, row_steps, col_steps, elevations,
+                       elevation_step, n_steps, raster_shape, window=None,
+                       chunk_samples=DEFAULT_CHUNK_SAMPLES, progress=None):
+    """
+    Yield the cells written by a batch of constant-slope profiles, one batch
+    of roughly chunk_samples profile steps at a time.
+
+    Every step writes its elevation to the 3x3 neighbourhood around the
+    sampled pixel. Each yielded (rows, cols, values) triple holds unique
+    cells with the first value the original walk would have written there,
+    following profile order and then step order. Batches come out in
+    profile order, so a consumer that never overwrites a cell holding data
+    reproduces the walk exactly.
+
+    raster_shape is (rows, cols) of the full raster; profiles are cut at
+    its edge. window (row_off, col_off, height, width) restricts the cells
+    yielded to a sub-window, in full raster coordinates.
+
+    progress: optional callable(profiles_done, total_profiles), called
+    after every batch.
+    """
+    rows, cols = raster_shape
+    if window is None:
+        window = (0, 0, rows, cols)
+    row_off, col_off, height, width = window
+
+    start_rows = np.asarray(start_rows, dtype=np.float64)
+    start_cols = np.asarray(start_cols, dtype=np.float64)
+    row_steps = np.asarray(row_steps, dtype=np.float64)
+    col_steps = np.asarray(col_steps, dtype=np.float64)
+    elevations = np.asarray(elevations, dtype=np.float64)
+    n_steps = np.maximum(np.asarray(n_steps, dtype=np.int64), 0)
+
+    # Group profiles so that each batch holds roughly chunk_samples steps
+    boundaries = [0]
+    running = 0
+    for i, n in enumerate(n_steps):
+        running += int(n)
+        if running >= chunk_samples:
+            boundaries.append(i + 1)
+            running = 0
+    if boundaries[-1] != n_steps.size:
+        boundaries.append(n_steps.size)
+
+    for lo, hi in zip(boundaries[:-1], boundaries[1:]):
+        if progress is not None:
+            progress(lo, n_steps.size)
+        r, c, z = _expand_samples(
+            start_rows[lo:hi], start_cols[lo:hi],
+            row_steps[lo:hi], col_steps[lo:hi],
+            elevations[lo:hi], elevation_step, n_steps[lo:hi],
+            rows, cols
+        )
+        if r.size == 0:
+            continue
+
+        # Sample-major ordering keeps the "first writer wins" rule intact
+        nr = (r[:, None] + NEIGHBOUR_ROW_OFFSETS[None, :]).reshape(-1)
+        nc = (c[:, None] + NEIGHBOUR_COL_OFFSETS[None, :]).reshape(-1)
+        nz = np.repeat(z, NEIGHBOUR_ROW_OFFSETS.size)
+
+        inside = ((nr >= row_off) & (nr < row_off + height) &
+                  (nc >= col_off) & (nc < col_off + width))
+        nr = nr[inside]
+        nc = nc[inside]
+        nz = nz[inside]
+        if nr.size == 0:
+            continue
+
+        cells, first = np.unique(nr * cols + nc, return_index=True)
+        yield cells // cols, cells % cols, nz[first]
+
+    if progress is not None:
+        progress(n_steps.size, n_steps.size)
+
+
+def rasterize_profiles(result_array, start_rows, start_cols, row_steps, col_steps,
+                       elevations, elevation_step, n_steps, no_data,
+                       chunk_samples=DEFAULT_CHUNK_SAMPLES, window=None, progress=None):
+    """
+    Burn a batch of constant-slope profiles into result_array in place,
+    using the cells from iter_profile_cells. Cells that already hold data
+    are never overwritten.
+
+    window: (row_off, col_off, raster_rows, raster_cols) when result_array
+    is only one tile of a larger raster. Profile coordinates stay in full
+    raster coordinates, profiles are still cut at the edge of the full
+    raster, and only the cells that fall inside the tile are written, so
+    rasterizing every tile gives the same result as one full-size array.
+
+    progress: passed on to iter_profile_cells.
+
+    Returns the number of cells written.
+    """
+    tile_rows, tile_cols = result_array.shape
+    if window is None:
+        row_off, col_off = 0, 0
+        raster_shape = (tile_rows, tile_cols)
+    else:
+        row_off, col_off, rows, cols = window
+        raster_shape = (rows, cols)
+
+    cells_written = 0
+    for r, c, z in iter_profile_cells(
+            start_rows, start_cols, row_steps, col_steps, elevations,
+            elevation_step, n_steps, raster_shape,
+            window=(row_off, col_off, tile_rows, tile_cols),
+            chunk_samples=chunk_samples, progress=progress):
+        r = r - row_off
+        c = c - col_off
+        empty = result_array[r, c] == no_data
+        result_array[r[empty], c[empty]] = z[empty]
+        cells_written += int(np.count_nonzero(empty))
+
+    return cells_written
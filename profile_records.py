@@ -0,0 +1,131 @@
+"""
+Array-backed store of the per-profile data shared by every output writer.
+
+The profile lines, the start/end points layer and the mask polygon all
+describe the same profiles. They are computed once here, when the DEM is
+generated, and every writer reads from this store instead of re-sampling
+the DEM or re-reading files written earlier in the run.
+"""
+import numpy as np
+
+
+class ProfileRecords:
+    """
+    One entry per profile, in Line A order. Profile numbers (ProfNumb) are
+    1-based positions in this store.
+
+    Arrays: start_x, start_y, end_x, end_y, ini_elev, fin_elev, azimuth
+    (degrees clockwise from north), length, part_id (Line A part the
+    profile starts on) and pair_id (Line A / Line B feature pair).
+    """
+
+    def __init__(self, start_x, start_y, end_x, end_y, ini_elev, fin_elev, part_id=None, no_data=-9999.0,
+                 pair_id=None):
+        self.start_x = np.asarray(start_x, dtype=np.float64)
+        self.start_y = np.asarray(start_y, dtype=np.float64)
+        self.end_x = np.asarray(end_x, dtype=np.float64)
+        self.end_y = np.asarray(end_y, dtype=np.float64)
+        self.ini_elev = np.asarray(ini_elev, dtype=np.float64)
+        self.fin_elev = np.asarray(fin_elev, dtype=np.float64)
+        if part_id is None:
+            part_id = np.zeros(self.start_x.size, dtype=np.int64)
+        self.part_id = np.asarray(part_id, dtype=np.int64)
+        if pair_id is None:
+            pair_id = np.zeros(self.start_x.size, dtype=np.int64)
+        self.pair_id = np.asarray(pair_id, dtype=np.int64)
+        self.no_data = no_data
+
+        dx = self.end_x - self.start_x
+        dy = self.end_y - self.start_y
+        self.length = np.hypot(dx, dy)
+        self.azimuth = np.degrees(np.arctan2(dx, dy)) % 360.0
+
+    @classmethod
+    def build(cls, start_x, start_y, end_x, end_y, ini_elev, end_elev_sampled,
+              slope=None, part_id=None, no_data=-9999.0):
+        """
+        Assemble the records from the profile geometry and the DEM samples.
+
+        end_elev_sampled holds the DEM value at each end point, NaN where the
+        DEM has none. Those ends get the start elevation lowered by the
+        stable slope over the profile length, or no_data without a slope.
+        ini_elev NaN values become no_data.
+        """
+        ini_elev = np.asarray(ini_elev, dtype=np.float64)
+        fin_elev = np.array(end_elev_sampled, dtype=np.float64)
+        length = np.hypot(np.asarray(end_x, dtype=np.float64) - np.asarray(start_x, dtype=np.float64),
+                          np.asarray(end_y, dtype=np.float64) - np.asarray(start_y, dtype=np.float64))
+
+        missing_ini = np.isnan(ini_elev) | (ini_elev == no_data)
+        missing_fin = np.isnan(fin_elev)
+        if slope is not None:
+            projected = ini_elev - length * np.tan(np.radians(slope))
+            fin_elev[missing_fin] = np.where(missing_ini[missing_fin], no_data, projected[missing_fin])
+        else:
+            fin_elev[missing_fin] = no_data
+
+        ini_elev = np.where(missing_ini, no_data, ini_elev)
+        return cls(start_x, start_y, end_x, end_y, ini_elev, fin_elev, part_id=part_id, no_data=no_data)
+
+    @classmethod
+    def concatenate(cls, records_list):
+        """
+        One store holding every record of records_list in order. Entry k
+        keeps pair_id k, and part ids are offset so that no two pairs share
+        a part.
+        """
+        part_ids, pair_ids = [], []
+        offset = 0
+        for k, records in enumerate(records_list):
+            part_ids.append(records.part_id + offset)
+            pair_ids.append(np.full(len(records), k, dtype=np.int64))
+            if len(records):
+                offset += int(records.part_id.max()) + 1
+
+        def joined(name):
+            return np.concatenate([getattr(records, name) for records in records_list] or [np.empty(0)])
+
+        no_data = records_list[0].no_data if records_list else -9999.0
+        return cls(joined('start_x'), joined('start_y'), joined('end_x'), joined('end_y'),
+                   joined('ini_elev'), joined('fin_elev'),
+                   part_id=np.concatenate(part_ids or [np.empty(0, dtype=np.int64)]),
+                   no_data=no_data,
+                   pair_id=np.concatenate(pair_ids or [np.empty(0, dtype=np.int64)]))
+
+    def __len__(self):
+        return self.start_x.size
+
+    @property
+    def profile_numbers(self):
+        return np.arange(1, len(self) + 1)
+
+    def _pair_boundary_order(self, members):
+        start_order = members[np.argsort(self.start_y[members], kind='stable')]
+        end_order = members[np.argsort(-self.end_y[members], kind='stable')]
+        index = np.concatenate((start_order, end_order))
+        is_end = np.concatenate((np.zeros(start_order.size, dtype=bool), np.ones(end_order.size, dtype=bool)))
+        return index, is_end
+
+    def boundary_order(self):
+        """
+        Order in which the profile points are chained into the mask polygon,
+        as (profile_index, is_end) arrays: for each pair, starts from lowest
+        to highest Y, then ends from highest to lowest Y. Position i in this
+        order is the point's vertex_ind - 1.
+        """
+        indexes, ends = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=bool)]
+        for pair in np.unique(self.pair_id):
+            index, is_end = self._pair_boundary_order(np.flatnonzero(self.pair_id == pair))
+            indexes.append(index)
+            ends.append(is_end)
+        return np.concatenate(indexes), np.concatenate(ends)
+
+    def mask_rings(self):
+        """Closed (pair_id, xs, ys) ring of the mask polygon of every pair."""
+        rings = []
+        for pair in np.unique(self.pair_id):
+            index, is_end = self._pair_boundary_order(np.flatnonzero(self.pair_id == pair))
+            xs = np.where(is_end, self.end_x[index], self.start_x[index])
+            ys = np.where(is_end, self.end_y[index], self.start_y[index])
+            rings.append((int(pair), np.append(xs, xs[0]), np.append(ys, ys[0])))
+        return rings
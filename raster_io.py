@@ -0,0 +1,355 @@
+"""
+GeoTIFF output helpers for the DEM pipeline.
+
+The tiled writer lets generate_dem produce rasters far larger than memory:
+the raster is created tiled on disk and filled one tile at a time, so only a
+single tile is held in memory whatever the size of the site.
+
+write_cog rewrites a finished raster as a Cloud Optimized GeoTIFF:
+compressed tiles, internal overviews ahead of the data, so QGIS opens and
+pans large outputs from the overviews instead of reading every block.
+
+clip_to_mask crops a raster to the mask polygons in process: the mask is
+rasterized once onto the raster's own grid and applied to each block as
+the cropped raster is written.
+"""
+import math
+import os
+
+import numpy as np
+from osgeo import gdal
+
+from .geopackage import open_layer
+
+
+# GTiff block sizes must be multiples of 16; 256 keeps blocks friendly to
+# QGIS rendering and to overview generation
+TILE_ALIGNMENT = 256
+
+# Rough working memory of one profile sample while rasterizing: the 3x3
+# neighbourhood expansion holds row, column, flat index and value arrays
+BYTES_PER_SAMPLE = 400
+
+# NoData do recorte quando nem o pedido nem o raster o definem
+CLIP_NO_DATA = -9999.0
+
+# Compressões aceites para a saída COG
+COG_COMPRESSIONS = ('DEFLATE', 'ZSTD')
+
+
+def tile_layout_for_budget(memory_budget_mb, bytes_per_cell=4):
+    """
+    Tile edge (in cells) and rasterizer batch size (in profile samples) that
+    fit in memory_budget_mb. Half the budget goes to the tile array and half
+    to the rasterizer's working arrays.
+    """
+    budget = max(float(memory_budget_mb), 1.0) * 1024 * 1024
+    tile_cells = budget / 2 / bytes_per_cell
+    tile_size = int(math.sqrt(tile_cells)) // TILE_ALIGNMENT * TILE_ALIGNMENT
+    tile_size = max(tile_size, TILE_ALIGNMENT)
+    chunk_samples = max(int(budget / 2 / BYTES_PER_SAMPLE), 1000)
+    return tile_size, chunk_samples
+
+
+def iter_tiles(rows, cols, tile_size):
+    """Yield (row_off, col_off, height, width) of every tile, row by row."""
+    for row_off in range(0, rows, tile_size):
+        for col_off in range(0, cols, tile_size):
+            yield row_off, col_off, min(tile_size, rows - row_off), min(tile_size, cols - col_off)
+
+
+class TiledGeoTiffWriter:
+    """
+    GeoTIFF (single-band Float32 by default) created with a tiled layout and
+    written one tile at a time.
+
+    tile_size is the processing tile handed out by tiles(); it is a multiple
+    of the on-disk GeoTIFF block size so every write covers whole blocks.
+    """
+
+    def __init__(self, output_path, cols, rows, geotransform, projection, no_data,
+                 tile_size=TILE_ALIGNMENT, bigtiff=False, block_size=TILE_ALIGNMENT, sparse=False,
+                 band_count=1, data_type=None):
+        """
+        sparse: create the file with SPARSE_OK so that blocks holding only
+        NoData are never written; GDAL reads them back as NoData.
+        band_count: number of bands; every band shares no_data.
+        data_type: GDAL band type, Float32 by default.
+        """
+        self.output_path = output_path
+        self.cols = cols
+        self.rows = rows
+        self.tile_size = tile_size
+        self.block_size = block_size
+        self.no_data = no_data
+        self.sparse = sparse
+        self.band_count = band_count
+
+        options = [
+            'TILED=YES',
+            f'BLOCKXSIZE={block_size}',
+            f'BLOCKYSIZE={block_size}',
+            'BIGTIFF=YES' if bigtiff else 'BIGTIFF=IF_SAFER',
+        ]
+        if sparse:
+            options.append('SPARSE_OK=TRUE')
+        if band_count > 1:
+            # Cada bloco guarda os valores de todas as bandas juntos
+            options.append('INTERLEAVE=BAND')
+        driver = gdal.GetDriverByName('GTiff')
+        if data_type is None:
+            data_type = gdal.GDT_Float32
+        self.dataset = driver.Create(output_path, cols, rows, band_count, data_type, options=options)
+        if self.dataset is None:
+            raise IOError(f"Could not create raster: {output_path}")
+        self.dataset.SetGeoTransform(geotransform)
+        self.dataset.SetProjection(projection)
+        self.bands = [self.dataset.GetRasterBand(i + 1) for i in range(band_count)]
+        for band in self.bands:
+            band.SetNoDataValue(no_data)
+        self.band = self.bands[0]
+
+    def tiles(self):
+        return iter_tiles(self.rows, self.cols, self.tile_size)
+
+    def set_band_description(self, band_number, description):
+        self.bands[band_number - 1].SetDescription(description)
+
+    def write_tile(self, array, row_off, col_off, band_number=1):
+        band = self.bands[band_number - 1]
+        if not self.sparse:
+            band.WriteArray(array, col_off, row_off)
+            return
+        # Only the blocks that hold data reach the file
+        height, width = array.shape
+        for r0 in range(0, height, self.block_size):
+            for c0 in range(0, width, self.block_size):
+                block = array[r0:r0 + self.block_size, c0:c0 + self.block_size]
+                if np.any(block != self.no_data):
+                    band.WriteArray(block, col_off + c0, row_off + r0)
+
+    def close(self):
+        if self.dataset is not None:
+            for band in self.bands:
+                band.FlushCache()
+            self.bands = []
+            self.band = None
+            self.dataset = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+def write_geotiff(output_path, array, geotransform, projection, no_data, bigtiff=False, sparse=False):
+    """
+    Write a whole in-memory array as a tiled single-band Float32 GeoTIFF.
+    """
+    rows, cols = array.shape
+    with TiledGeoTiffWriter(output_path, cols, rows, geotransform, projection, no_data,
+                            tile_size=max(rows, cols), bigtiff=bigtiff, sparse=sparse) as writer:
+        writer.write_tile(array, 0, 0)
+    return output_path
+
+
+def cog_options(compression='DEFLATE', threads=None, bigtiff=False):
+    """
+    COG driver creation options: tiles of TILE_ALIGNMENT, compression with
+    the predictor suited to the band type (floating point for Float32),
+    overviews down to a single tile averaged from the full resolution, and
+    all-NoData tiles left out. threads: NUM_THREADS value (a count or
+    'ALL_CPUS') for multi-threaded compression; None compresses on one.
+    """
+    compression = compression.upper()
+    if compression not in COG_COMPRESSIONS:
+        raise ValueError(f"Unknown COG compression: {compression}")
+    driver = gdal.GetDriverByName('COG')
+    if driver is None:
+        raise ValueError("COG output needs GDAL 3.1 or later")
+    option_list = driver.GetMetadataItem('DMD_CREATIONOPTIONLIST') or ''
+    if compression not in option_list:
+        raise ValueError(f"This GDAL build has no {compression} compression")
+    options = [
+        f'COMPRESS={compression}',
+        'PREDICTOR=YES',
+        f'BLOCKSIZE={TILE_ALIGNMENT}',
+        'OVERVIEWS=AUTO',
+        'OVERVIEW_RESAMPLING=AVERAGE',
+        'SPARSE_OK=TRUE',
+        'BIGTIFF=YES' if bigtiff else 'BIGTIFF=IF_SAFER',
+    ]
+    if threads:
+        options.append(f'NUM_THREADS={threads}')
+    return options
+
+
+def write_cog(path, compression='DEFLATE', threads=None, bigtiff=False):
+    """
+    Rewrite the GeoTIFF at path in place as a Cloud Optimized GeoTIFF (see
+    cog_options). The COG driver builds the overviews while it writes, and
+    keeps the NoData value and band descriptions. The original is only
+    replaced once the copy is complete.
+    """
+    temp_path = f"{os.path.splitext(path)[0]}.cog.tif"
+    try:
+        result = gdal.Translate(temp_path, path, format='COG',
+                                creationOptions=cog_options(compression, threads, bigtiff))
+        if result is None:
+            raise IOError(f"Could not write COG: {path}")
+        result = None
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return path
+
+
+def mask_window(layer, geotransform, cols, rows):
+    """(col0, col1, row0, row1) of the pixels of a cols x rows raster under the extent of a polygon layer."""
+    gt = geotransform
+    min_x, max_x, min_y, max_y = layer.GetExtent()
+    col0 = max(int(math.floor((min_x - gt[0]) / gt[1])), 0)
+    col1 = min(int(math.ceil((max_x - gt[0]) / gt[1])), cols)
+    row0 = max(int(math.floor((max_y - gt[3]) / gt[5])), 0)
+    row1 = min(int(math.ceil((min_y - gt[3]) / gt[5])), rows)
+    return col0, max(col1, col0), row0, max(row1, row0)
+
+
+def rasterize_mask(layer, geotransform, col0, row0, width, height):
+    """
+    Boolean (height, width) array of the pixels of a raster window whose
+    centre lies inside the polygons of layer (the gdalwarp cutline rule).
+    """
+    gt = geotransform
+    mem = gdal.GetDriverByName('MEM').Create('', width, height, 1, gdal.GDT_Byte)
+    mem.SetGeoTransform((gt[0] + col0 * gt[1], gt[1], 0.0, gt[3] + row0 * gt[5], 0.0, gt[5]))
+    gdal.RasterizeLayer(mem, [1], layer, burn_values=[1])
+    inside = mem.GetRasterBand(1).ReadAsArray() == 1
+    mem = None
+    return inside
+
+
+def clip_to_mask(raster_path, mask_path, output_path, no_data=None, bigtiff=False, block_rows=TILE_ALIGNMENT,
+                 progress=None):
+    """
+    Clip a single-band raster to the mask polygons (a file or GeoPackage
+    layer path) and crop it to the mask extent, snapped to the raster's own
+    pixels so no value is resampled. Pixels outside the mask get no_data
+    (by default the raster's NoData).
+
+    The mask is rasterized once, one byte per pixel of the cropped window;
+    the raster is then read and the crop written block_rows rows at a time.
+    progress: optional callable(blocks_done, total_blocks).
+    """
+    ds = gdal.Open(raster_path, gdal.GA_ReadOnly)
+    if ds is None:
+        raise IOError(f"Could not open raster: {raster_path}")
+    gt = ds.GetGeoTransform()
+    if gt[2] != 0 or gt[4] != 0:
+        raise ValueError("Rotated raster geotransforms are not supported")
+    band = ds.GetRasterBand(1)
+    source_no_data = band.GetNoDataValue()
+    if no_data is None:
+        no_data = source_no_data if source_no_data is not None else CLIP_NO_DATA
+
+    mask_ds, layer = open_layer(mask_path)
+    col0, col1, row0, row1 = mask_window(layer, gt, ds.RasterXSize, ds.RasterYSize)
+    width, height = col1 - col0, row1 - row0
+    if width == 0 or height == 0:
+        raise ValueError(f"The mask {mask_path} does not overlap {raster_path}")
+    inside = rasterize_mask(layer, gt, col0, row0, width, height)
+    mask_ds = None
+
+    window_gt = (gt[0] + col0 * gt[1], gt[1], 0.0, gt[3] + row0 * gt[5], 0.0, gt[5])
+    blocks = list(range(0, height, block_rows))
+    with TiledGeoTiffWriter(output_path, width, height, window_gt, ds.GetProjection(), no_data,
+                            bigtiff=bigtiff, data_type=band.DataType) as writer:
+        for k, block_row in enumerate(blocks):
+            if progress is not None:
+                progress(k, len(blocks))
+            block_height = min(block_rows, height - block_row)
+            block = band.ReadAsArray(col0, row0 + block_row, width, block_height)
+            keep = inside[block_row:block_row + block_height]
+            if source_no_data is not None:
+                keep = keep & (block != source_no_data)
+            writer.write_tile(np.where(keep, block, np.array(no_data, dtype=block.dtype)), block_row, 0)
+    if progress is not None:
+        progress(len(blocks), len(blocks))
+    band = None
+    ds = None
+    return output_path
+
+
+class SparseTileRaster:
+    """
+    In-memory raster made of fixed-size blocks that are only allocated when a
+    value is written into them.
+
+    Used instead of a dense (rows, cols) array when most of the bounding box
+    stays NoData, e.g. for a coast running diagonally across it. Written out
+    with write_geotiff, untouched blocks are never materialized or stored.
+    """
+
+    def __init__(self, rows, cols, no_data, block_size=TILE_ALIGNMENT):
+        self.rows = rows
+        self.cols = cols
+        self.no_data = no_data
+        self.block_size = block_size
+        self.blocks = {}
+
+    @property
+    def nbytes(self):
+        return sum(block.nbytes for block in self.blocks.values())
+
+    def _block(self, block_row, block_col):
+        key = (block_row, block_col)
+        block = self.blocks.get(key)
+        if block is None:
+            height = min(self.block_size, self.rows - block_row * self.block_size)
+            width = min(self.block_size, self.cols - block_col * self.block_size)
+            block = np.full((height, width), self.no_data, dtype=np.float32)
+            self.blocks[key] = block
+        return block
+
+    def write_first(self, rows, cols, values):
+        """
+        Store values at (rows, cols) wherever the cell still holds NoData.
+        Cells must be unique within one call. Returns the number of cells
+        written.
+        """
+        if len(rows) == 0:
+            return 0
+        block_ids = (rows // self.block_size) * (self.cols // self.block_size + 1) + cols // self.block_size
+        order = np.argsort(block_ids, kind='stable')
+        block_ids = block_ids[order]
+        rows, cols, values = rows[order], cols[order], values[order]
+        starts = np.flatnonzero(np.concatenate(([True], block_ids[1:] != block_ids[:-1])))
+        ends = np.concatenate((starts[1:], [block_ids.size]))
+
+        written = 0
+        for lo, hi in zip(starts, ends):
+            block_row = int(rows[lo]) // self.block_size
+            block_col = int(cols[lo]) // self.block_size
+            block = self._block(block_row, block_col)
+            r = rows[lo:hi] - block_row * self.block_size
+            c = cols[lo:hi] - block_col * self.block_size
+            empty = block[r, c] == self.no_data
+            block[r[empty], c[empty]] = values[lo:hi][empty]
+            written += int(np.count_nonzero(empty))
+        return written
+
+    def write_geotiff(self, output_path, geotransform, projection, bigtiff=False):
+        """
+        Write a tiled, sparse GeoTIFF whose blocks match the allocated ones.
+        """
+        writer = TiledGeoTiffWriter(
+            output_path, self.cols, self.rows, geotransform, projection, self.no_data,
+            tile_size=self.block_size, bigtiff=bigtiff, block_size=self.block_size, sparse=True
+        )
+        with writer:
+            for (block_row, block_col), block in sorted(self.blocks.items()):
+                writer.write_tile(block, block_row * self.block_size, block_col * self.block_size)
+        return output_path
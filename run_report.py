@@ -0,0 +1,300 @@
+"""
+Timing and profiling report for a DEM run.
+
+A RunReport measures the wall time and the process memory high-water mark
+(max RSS) of each pipeline stage, keeps run counters (profiles, steps,
+cells written, sampling misses) and, when profiling, captures a cProfile of
+the whole run and the peak traced memory of each stage. It is written as
+JSON next to the output GeoTIFF.
+
+Per-point messages go through the 'stable_beach_dem' logger, which is
+silent unless set_verbose(True) is called.
+
+The report is also the run's progress and cancellation channel: the
+pipeline calls progress(done, total) from its loops, and a subclass shows
+it (on_stage, on_progress). cancel() makes the next stage or progress call
+raise RunCancelled.
+"""
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+LOGGER_NAME = 'stable_beach_dem'
+
+log = logging.getLogger(LOGGER_NAME)
+log.addHandler(logging.NullHandler())
+log.setLevel(logging.WARNING)
+
+# Functions listed in the JSON summary of a cProfile capture
+PROFILE_TOP_FUNCTIONS = 25
+
+# Minimum seconds between two on_progress calls within a stage
+PROGRESS_INTERVAL = 0.2
+
+_verbose_handler = None
+
+
+def max_rss_mb():
+    """
+    High-water mark of the process resident memory in MB, or None where the
+    platform does not report it. Unlike tracemalloc it includes the GDAL and
+    NumPy buffers, and costs one system call.
+    """
+    if resource is not None:
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss vem em KB no Linux e em bytes no macOS
+        scale = 1 if sys.platform == 'darwin' else 1024
+        return round(max_rss * scale / 1024 / 1024, 3)
+    try:
+        import psutil
+    except ImportError:
+        return None
+    info = psutil.Process().memory_info()
+    return round(getattr(info, 'peak_wset', info.rss) / 1024 / 1024, 3)
+
+
+def set_verbose(enabled=True):
+    """Show (or hide again) the per-point debug messages on stderr."""
+    global _verbose_handler
+    if enabled:
+        if _verbose_handler is None:
+            _verbose_handler = logging.StreamHandler()
+            _verbose_handler.setFormatter(logging.Formatter('%(levelname)s %(name)s: %(message)s'))
+            log.addHandler(_verbose_handler)
+        log.setLevel(logging.DEBUG)
+    else:
+        if _verbose_handler is not None:
+            log.removeHandler(_verbose_handler)
+            _verbose_handler = None
+        log.setLevel(logging.WARNING)
+
+
+class RunCancelled(Exception):
+    """Raised inside a run whose report was cancelled."""
+
+
+def stage_percent(stage_progress, stage, fraction=0.0):
+    """
+    Overall progress (%) of a run `fraction` of the way through a stage.
+    stage_progress maps stage names to the percentage at which they start;
+    a stage ends where the next higher one starts (100 for the last).
+    Returns None for stages not in the map.
+    """
+    if stage not in stage_progress:
+        return None
+    start = stage_progress[stage]
+    end = min([p for p in stage_progress.values() if p > start] or [100])
+    return int(start + (end - start) * min(max(fraction, 0.0), 1.0))
+
+
+def report_paths(output_path):
+    """(json_path, prof_path) of the report written for output_path."""
+    base_path = os.path.splitext(output_path)[0]
+    return f"{base_path}_run_report.json", f"{base_path}_run_profile.prof"
+
+
+def format_progress(stage, done, total, unit, rate=None, eta=None):
+    """One-line progress message, e.g. 'rasterize: 1200/5000 profiles (850/s, ETA 4 s)'."""
+    message = f"{stage}: {done}/{total} {unit}"
+    if rate:
+        message += f" ({rate:.0f}/s, ETA {eta:.0f} s)" if eta is not None else f" ({rate:.0f}/s)"
+    return message
+
+
+class RunReport:
+    """
+    Collects per-stage timings and counters of one run.
+
+    Usage:
+        report = RunReport(profile=True)
+        report.start()
+        with report.stage('rasterize'):
+            ...
+        report.count('cells_written', n)
+        report.finish()
+        report.write(output_path)
+
+    Long loops call report.progress(done, total, unit) between chunks of
+    work. It raises RunCancelled once cancel() was called (from any
+    thread) and otherwise passes the stage, rate and ETA to on_progress at
+    most every PROGRESS_INTERVAL seconds.
+
+    Every stage records max_rss_mb, the process memory high-water mark when
+    it ends (it can only grow, so a stage that raises it is the one that
+    needed the memory). track_memory also traces Python allocations with
+    tracemalloc, which slows the run down noticeably and does not see GDAL
+    or NumPy buffers; it follows profile unless given.
+    """
+
+    def __init__(self, profile=False, track_memory=None):
+        self.profile = profile
+        self.track_memory = profile if track_memory is None else track_memory
+        self.stages = []
+        self.counters = {}
+        self.parameters = {}
+        self.total_seconds = None
+        self.peak_memory_mb = None
+        self.max_rss_mb = None
+        self._profiler = None
+        self._started_tracing = False
+        self._start_time = None
+        self._run_peak = 0
+        self._cancel_event = threading.Event()
+        self.current_stage = None
+        self._stage_start = None
+        self._last_progress = 0.0
+
+    def start(self):
+        self._start_time = time.perf_counter()
+        if self.track_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        if self.profile:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        return self
+
+    def finish(self):
+        if self._profiler is not None:
+            self._profiler.disable()
+        if self._start_time is not None:
+            self.total_seconds = time.perf_counter() - self._start_time
+        if self.track_memory and tracemalloc.is_tracing():
+            self._run_peak = max(self._run_peak, tracemalloc.get_traced_memory()[1])
+            if self._started_tracing:
+                tracemalloc.stop()
+                self._started_tracing = False
+        if self.track_memory:
+            self.peak_memory_mb = round(self._run_peak / 1024 / 1024, 3)
+        self.max_rss_mb = max_rss_mb()
+        return self
+
+    @contextmanager
+    def stage(self, name):
+        """Time the enclosed block; repeated names are recorded separately."""
+        self.check_cancelled()
+        outer_stage, outer_start = self.current_stage, self._stage_start
+        self.current_stage = name
+        self._stage_start = time.perf_counter()
+        self._last_progress = 0.0
+        self.on_stage(name)
+        tracing = self.track_memory and tracemalloc.is_tracing()
+        if tracing:
+            base, peak = tracemalloc.get_traced_memory()
+            self._run_peak = max(self._run_peak, peak)
+            # reset_peak só existe a partir do Python 3.9; antes disso o pico
+            # de cada etapa inclui o das etapas anteriores
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            entry = {'name': name, 'seconds': round(time.perf_counter() - start, 6),
+                     'max_rss_mb': max_rss_mb()}
+            if tracing:
+                peak = tracemalloc.get_traced_memory()[1]
+                self._run_peak = max(self._run_peak, peak)
+                entry['peak_memory_mb'] = round(max(peak - base, 0) / 1024 / 1024, 3)
+            self.stages.append(entry)
+            self.current_stage, self._stage_start = outer_stage, outer_start
+            log.info(f"Stage {name}: {entry['seconds']:.3f} s")
+
+    def cancel(self):
+        """Ask the run to stop at its next stage or progress call."""
+        self._cancel_event.set()
+
+    def is_cancelled(self):
+        return self._cancel_event.is_set()
+
+    def check_cancelled(self):
+        if self.is_cancelled():
+            raise RunCancelled("Cancelled by user")
+
+    def progress(self, done, total, unit='items'):
+        """
+        Report that done of total units of the current stage are finished.
+        Cheap enough for hot loops: on_progress only runs when the last call
+        is PROGRESS_INTERVAL seconds old or the stage is complete.
+        """
+        self.check_cancelled()
+        now = time.perf_counter()
+        if done < total and now - self._last_progress < PROGRESS_INTERVAL:
+            return
+        self._last_progress = now
+        elapsed = now - (self._stage_start or now)
+        rate = done / elapsed if elapsed > 0 else None
+        eta = (total - done) / rate if rate else None
+        self.on_progress(self.current_stage, done, total, unit, rate, eta)
+
+    def on_stage(self, name):
+        """Called when a stage starts; override to show it."""
+
+    def on_progress(self, stage, done, total, unit, rate, eta):
+        """Called with the throttled progress of a stage; override to show it."""
+        log.debug(format_progress(stage, done, total, unit, rate, eta))
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + int(value)
+
+    def set_parameters(self, **parameters):
+        self.parameters.update(parameters)
+
+    def _profile_summary(self):
+        stream = io.StringIO()
+        stats = pstats.Stats(self._profiler, stream=stream)
+        stats.sort_stats('cumulative')
+        rows = []
+        for (filename, line, function), (_, calls, own, cumulative, _) in stats.stats.items():
+            rows.append({
+                'function': f"{os.path.basename(filename)}:{line}({function})",
+                'calls': calls,
+                'own_seconds': round(own, 6),
+                'cumulative_seconds': round(cumulative, 6),
+            })
+        rows.sort(key=lambda row: row['cumulative_seconds'], reverse=True)
+        return rows[:PROFILE_TOP_FUNCTIONS]
+
+    def as_dict(self):
+        report = {
+            'total_seconds': None if self.total_seconds is None else round(self.total_seconds, 6),
+            'peak_memory_mb': self.peak_memory_mb,
+            'max_rss_mb': self.max_rss_mb,
+            'stages': self.stages,
+            'counters': self.counters,
+            'parameters': self.parameters,
+            'cancelled': self.is_cancelled(),
+        }
+        if self._profiler is not None:
+            report['profile'] = self._profile_summary()
+        return report
+
+    def write(self, output_path):
+        """
+        Write the JSON report for output_path and, when profiling, the raw
+        cProfile stats (readable with pstats or snakeviz). Returns the JSON
+        path.
+        """
+        json_path, prof_path = report_paths(output_path)
+        report = self.as_dict()
+        if self._profiler is not None:
+            self._profiler.dump_stats(prof_path)
+            report['profile_stats_path'] = prof_path
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, default=str)
+        log.info(f"Run report written to {json_path}")
+        return json_path
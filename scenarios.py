@@ -0,0 +1,271 @@
+"""
+Several stable beach scenarios (slope and vertical offset) from a single
+traversal of the profiles.
+
+Which profile, and which step along it, writes a cell of the raw DEM only
+depends on the geometry; the slope only sets the drop per step. Each tile
+is traced once into (profile, step) and every scenario band is then
+
+    z = ini_elev[profile] + offset - step * step_size * tan(slope)
+
+Likewise the analytic surface is z0 + offset - distance * tan(slope), with
+z0 and the distance from Line A rendered once per tile.
+
+The bands go into one multi-band GeoTIFF (one band per scenario) and the
+cut / fill volumes of every scenario against the input DEM into a CSV
+table, so ten scenarios cost little more than one.
+"""
+import csv
+import math
+
+import numpy as np
+
+from .profile_engine import profile_cell_bounds, rasterize_profiles
+from .raster_io import TiledGeoTiffWriter, tile_layout_for_budget
+from .run_report import log
+from .surface_model import joined_quads, quad_cell_bounds, quads_in_window, render_envelope_terms
+
+
+# Memória por tile quando a corrida não define tile_memory_mb
+DEFAULT_SCENARIO_MEMORY_MB = 512
+
+# Working memory per tile cell: trace codes, z0 and distance (float64), covered mask,
+# DEM sample (float64) and one Float32 output band
+SCENARIO_BYTES_PER_CELL = 37
+
+# Trace value of cells no profile reaches
+NO_TRACE = -1.0
+
+VOLUME_FIELDS = ('scenario', 'slope', 'offset', 'source', 'cells', 'area', 'fill', 'cut', 'net')
+
+
+def parse_values(text):
+    """
+    Floats from a comma, semicolon or space separated string such as
+    "3, 4.5, 6". Empty text gives an empty list.
+    """
+    if text is None:
+        return []
+    if isinstance(text, (int, float)):
+        return [float(text)]
+    if not isinstance(text, str):
+        return [float(value) for value in text]
+    parts = text.replace(';', ' ').replace(',', ' ').split()
+    return [float(part) for part in parts]
+
+
+def scenario_list(slopes, offsets=None):
+    """
+    (slope, offset) of every scenario: each slope combined with each
+    vertical offset, slope-major. No offsets means an offset of 0.
+    """
+    slopes = parse_values(slopes)
+    offsets = parse_values(offsets) or [0.0]
+    return [(slope, offset) for slope in slopes for offset in offsets]
+
+
+def scenario_name(slope, offset):
+    return f"slope {slope:g} offset {offset:+g}"
+
+
+def _tile_geotransform(geotransform, row_off, col_off):
+    return [
+        geotransform[0] + col_off * geotransform[1], geotransform[1], 0,
+        geotransform[3] + row_off * geotransform[5], 0, geotransform[5]
+    ]
+
+
+def trace_tile(profiles, window, bounds, chunk_samples):
+    """
+    (profile_index, step) of every cell of window, -1 where no profile
+    writes. Same first-writer rule as the raw DEM: each profile is traced
+    with value profile_index * code_base + step, and decoded after.
+    """
+    row_off, col_off, height, width = window
+    row_min, row_max, col_min, col_max = bounds
+    touching = ((row_max >= row_off) & (row_min < row_off + height) &
+                (col_max >= col_off) & (col_min < col_off + width) &
+                (profiles.n_steps > 0))
+    if not touching.any():
+        return None, None
+
+    codes = np.full((height, width), NO_TRACE, dtype=np.float64)
+    code_base = int(profiles.n_steps.max()) + 1
+    start_codes = np.arange(profiles.n_steps.size, dtype=np.float64) * code_base
+    # elevation_step = -1: o "valor" cresce um por passo
+    rasterize_profiles(
+        codes, profiles.start_rows[touching], profiles.start_cols[touching],
+        profiles.row_steps[touching], profiles.col_steps[touching], start_codes[touching],
+        -1.0, profiles.n_steps[touching], NO_TRACE,
+        chunk_samples=chunk_samples, window=(row_off, col_off, profiles.rows, profiles.cols)
+    )
+    traced = codes != NO_TRACE
+    if not traced.any():
+        return None, None
+    profile_index = np.full((height, width), -1, dtype=np.int64)
+    step = np.zeros((height, width), dtype=np.int64)
+    packed = codes[traced].astype(np.int64)
+    profile_index[traced] = packed // code_base
+    step[traced] = packed % code_base
+    return profile_index, step
+
+
+def surface_terms_tile(profiles, window, quads, quad_bounds):
+    """
+    (z0, distance, covered) of the analytic surface on window: the
+    along-shore start elevation and the distance from Line A, NaN outside
+    every quad, and the mask of cells inside one. Only the quads whose
+    quad_bounds (see surface_model.quad_cell_bounds) reach the window are
+    rendered, both terms in one pass. (None, None, None) if none covers it.
+    """
+    reaching = quads_in_window(quads, quad_bounds, window)
+    if reaching.size == 0:
+        return None, None, None
+    row_off, col_off, height, width = window
+    records = profiles.records
+    z0, distance, covered = render_envelope_terms(
+        (height, width), _tile_geotransform(profiles.geotransform, row_off, col_off),
+        records.start_x, records.start_y, records.end_x, records.end_y, records.ini_elev, reaching
+    )
+    if not covered.any():
+        return None, None, None
+    return z0, distance, covered
+
+
+class ScenarioVolumes:
+    """
+    Running cut / fill totals of every scenario against the input DEM.
+    fill is the volume the scenario surface lies above the DEM, cut the
+    volume below it; cells without a DEM value are not counted.
+    """
+
+    def __init__(self, scenarios, cell_area, source):
+        self.scenarios = scenarios
+        self.cell_area = cell_area
+        self.source = source
+        self.cells = np.zeros(len(scenarios), dtype=np.int64)
+        self.fill = np.zeros(len(scenarios), dtype=np.float64)
+        self.cut = np.zeros(len(scenarios), dtype=np.float64)
+
+    def add(self, k, values, dem_values):
+        valid = ~np.isnan(dem_values)
+        difference = values[valid].astype(np.float64) - dem_values[valid]
+        self.cells[k] += int(np.count_nonzero(valid))
+        self.fill[k] += float(difference[difference > 0].sum()) * self.cell_area
+        self.cut[k] += float(-difference[difference < 0].sum()) * self.cell_area
+
+    def rows(self):
+        result = []
+        for k, (slope, offset) in enumerate(self.scenarios):
+            result.append({
+                'scenario': k + 1, 'slope': slope, 'offset': offset, 'source': self.source,
+                'cells': int(self.cells[k]),
+                'area': round(float(self.cells[k] * self.cell_area), 3),
+                'fill': round(float(self.fill[k]), 3),
+                'cut': round(float(self.cut[k]), 3),
+                'net': round(float(self.fill[k] - self.cut[k]), 3),
+            })
+        return result
+
+    def write_csv(self, path):
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=VOLUME_FIELDS)
+            writer.writeheader()
+            writer.writerows(self.rows())
+        return path
+
+
+def write_scenarios(profiles, scenarios, dem_path, projection, surface_path=None, volumes_path=None,
+                    dem_sampler=None, tile_memory_mb=None, bigtiff=False, sparse=False, progress=None):
+    """
+    Write one band per (slope, offset) scenario of the raw DEM into
+    dem_path, and with surface_path of the analytic surface too, tracing
+    the profiles once per tile. The slope of profiles is not used.
+
+    dem_sampler: sampler of the input DEM (e.g. DemWindowSampler); with it,
+    volumes_path and surface_path the volume table of the surface bands is
+    written as CSV. The raw bands only cover the profile traces, so they
+    give no volumes.
+
+    progress: optional callable(tiles_done, total_tiles), called per tile.
+    Returns the volume rows (empty without a sampler).
+    """
+    origin_x, pixel_size_x, _, origin_y, _, neg_pixel_size_y = profiles.geotransform
+    pixel_size_y = -neg_pixel_size_y
+    step_size = math.sqrt(pixel_size_x**2 + pixel_size_y**2)
+    # Mesmas contas que StableBeachProfiles, para o cenário base dar o mesmo raster
+    elevation_steps = [math.tan(math.radians(slope)) * step_size for slope, _ in scenarios]
+    tan_slopes = [math.tan(math.radians(slope)) for slope, _ in scenarios]
+    ini_elev = profiles.records.ini_elev
+    no_data = profiles.no_data
+
+    tile_size, chunk_samples = tile_layout_for_budget(tile_memory_mb or DEFAULT_SCENARIO_MEMORY_MB,
+                                                      SCENARIO_BYTES_PER_CELL)
+    bounds = profile_cell_bounds(profiles.start_rows, profiles.start_cols, profiles.row_steps,
+                                 profiles.col_steps, profiles.n_steps)
+    volumes = None
+    if dem_sampler is not None and volumes_path:
+        if surface_path:
+            volumes = ScenarioVolumes(scenarios, pixel_size_x * pixel_size_y, 'surface')
+        else:
+            log.warning("Scenario volumes need the analytic surface; the volume table is not written")
+
+    writers = []
+    try:
+        for path in (dem_path, surface_path):
+            if not path:
+                continue
+            writer = TiledGeoTiffWriter(path, profiles.cols, profiles.rows, profiles.geotransform,
+                                        projection, no_data, tile_size=tile_size, bigtiff=bigtiff,
+                                        sparse=sparse, band_count=len(scenarios))
+            writers.append(writer)
+            for k, (slope, offset) in enumerate(scenarios):
+                writer.set_band_description(k + 1, scenario_name(slope, offset))
+        raw_writer = writers[0]
+        surface_writer = writers[1] if surface_path else None
+        if surface_writer is not None:
+            records = profiles.records
+            quads = joined_quads(len(records), profiles.part_breaks)
+            quad_bounds = quad_cell_bounds(records.start_x, records.start_y, records.end_x,
+                                           records.end_y, quads, profiles.geotransform)
+
+        tiles = list(raw_writer.tiles())
+        for n, window in enumerate(tiles):
+            if progress is not None:
+                progress(n, len(tiles))
+            row_off, col_off, height, width = window
+            profile_index, step = trace_tile(profiles, window, bounds, chunk_samples)
+            z0, distance, covered = (None, None, None)
+            if surface_writer is not None:
+                z0, distance, covered = surface_terms_tile(profiles, window, quads, quad_bounds)
+
+            # Valores da DEM de entrada nos centros das células, lidos uma vez por tile
+            if volumes is not None and z0 is not None:
+                rows, cols = np.nonzero(covered)
+                xs = origin_x + (col_off + cols + 0.5) * pixel_size_x
+                ys = origin_y - (row_off + rows + 0.5) * pixel_size_y
+                dem_values = dem_sampler.sample(xs, ys)
+
+            for k, (slope, offset) in enumerate(scenarios):
+                if profile_index is not None:
+                    traced = profile_index >= 0
+                    band = np.full((height, width), no_data, dtype=np.float32)
+                    band[traced] = (ini_elev[profile_index[traced]] + offset
+                                    - step[traced] * elevation_steps[k])
+                    raw_writer.write_tile(band, row_off, col_off, k + 1)
+                if z0 is not None:
+                    band = np.full((height, width), no_data, dtype=np.float32)
+                    band[covered] = z0[covered] + offset - distance[covered] * tan_slopes[k]
+                    surface_writer.write_tile(band, row_off, col_off, k + 1)
+                    if volumes is not None:
+                        volumes.add(k, band[covered], dem_values)
+        if progress is not None:
+            progress(len(tiles), len(tiles))
+    finally:
+        for writer in writers:
+            writer.close()
+
+    if volumes is None:
+        return []
+    volumes.write_csv(volumes_path)
+    return volumes.rows()
@@ -0,0 +1,221 @@
+"""
+Analytic stable-beach surface between neighbouring profiles.
+
+Instead of rasterizing thin profile traces and filling the gaps afterwards,
+every cell inside the profile envelope is placed between the two profiles
+around it and gets its elevation straight from the slope model.
+"""
+import numpy as np
+
+
+# Cells evaluated per vectorized batch inside one quad
+QUAD_BATCH_CELLS = 1_000_000
+
+_EPS = 1e-12
+
+
+def _cross(ax, ay, bx, by):
+    return ax * by - ay * bx
+
+
+def inverse_bilinear(px, py, ax, ay, bx, by, cx, cy, dx, dy):
+    """
+    (u, v) coordinates of points P inside the quad A-B-C-D, where
+    P = A + u (B - A) + v (D - A) + u v (A - B + C - D).
+
+    Here A, B are the starts of two neighbouring profiles and D, C their
+    ends, so u runs along-shore and v cross-shore. Points outside the quad
+    get NaN.
+    """
+    ex, ey = bx - ax, by - ay
+    fx, fy = dx - ax, dy - ay
+    gx, gy = ax - bx + cx - dx, ay - by + cy - dy
+    hx, hy = px - ax, py - ay
+
+    k2 = _cross(gx, gy, fx, fy)
+    k1 = _cross(ex, ey, fx, fy) + _cross(hx, hy, gx, gy)
+    k0 = _cross(hx, hy, ex, ey)
+
+    n = np.broadcast(px, py).shape
+    u = np.full(n, np.nan)
+    v = np.full(n, np.nan)
+
+    def solve_u(vv):
+        den_x = ex + gx * vv
+        den_y = ey + gy * vv
+        use_x = np.abs(den_x) > np.abs(den_y)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(use_x, (hx - fx * vv) / den_x, (hy - fy * vv) / den_y)
+
+    def inside(uu, vv):
+        return (uu >= -1e-9) & (uu <= 1 + 1e-9) & (vv >= -1e-9) & (vv <= 1 + 1e-9)
+
+    if abs(k2) < _EPS:
+        # Parallel sides: the equation in v is linear
+        with np.errstate(divide='ignore', invalid='ignore'):
+            v1 = np.where(np.abs(k1) > _EPS, -k0 / k1, np.nan)
+        u1 = solve_u(v1)
+        ok = inside(u1, v1)
+        u[ok], v[ok] = u1[ok], v1[ok]
+        return u, v
+
+    disc = k1 * k1 - 4.0 * k0 * k2
+    real = disc >= 0
+    root = np.sqrt(np.where(real, disc, 0.0))
+    for sign in (-1.0, 1.0):
+        vv = (-k1 + sign * root) / (2.0 * k2)
+        uu = solve_u(vv)
+        ok = real & np.isnan(u) & inside(uu, vv)
+        u[ok], v[ok] = uu[ok], vv[ok]
+    return u, v
+
+
+def quad_cell_bounds(start_x, start_y, end_x, end_y, quads, geotransform):
+    """
+    (row_min, row_max, col_min, col_max) arrays of the cells around the
+    quad between profiles q and q + 1, for every q in quads, one cell of
+    margin included. Grid cells, not clipped to the raster.
+    """
+    origin_x, pixel_size_x, _, origin_y, _, neg_pixel_size_y = geotransform
+    quads = np.asarray(quads, dtype=np.int64)
+    start_x = np.asarray(start_x, dtype=np.float64)
+    start_y = np.asarray(start_y, dtype=np.float64)
+    end_x = np.asarray(end_x, dtype=np.float64)
+    end_y = np.asarray(end_y, dtype=np.float64)
+    xs = np.stack([start_x[quads], start_x[quads + 1], end_x[quads], end_x[quads + 1]])
+    ys = np.stack([start_y[quads], start_y[quads + 1], end_y[quads], end_y[quads + 1]])
+    col_min = np.floor((xs.min(axis=0) - origin_x) / pixel_size_x).astype(np.int64) - 1
+    col_max = np.ceil((xs.max(axis=0) - origin_x) / pixel_size_x).astype(np.int64) + 1
+    row_min = np.floor((origin_y - ys.max(axis=0)) / -neg_pixel_size_y).astype(np.int64) - 1
+    row_max = np.ceil((origin_y - ys.min(axis=0)) / -neg_pixel_size_y).astype(np.int64) + 1
+    return row_min, row_max, col_min, col_max
+
+
+def quads_in_window(quads, bounds, window):
+    """The quads whose cell bounds reach window (row_off, col_off, height, width), in order."""
+    row_off, col_off, height, width = window
+    row_min, row_max, col_min, col_max = bounds
+    return quads[(row_max >= row_off) & (row_min < row_off + height) &
+                 (col_max >= col_off) & (col_min < col_off + width)]
+
+
+def joined_quads(n_profiles, breaks=None):
+    """Indices i of the quads between profiles i and i + 1 that are not broken."""
+    quads = np.arange(max(n_profiles - 1, 0), dtype=np.int64)
+    if breaks is not None:
+        quads = quads[~np.asarray(breaks, dtype=bool)[:quads.size]]
+    return quads
+
+
+def _quad_cells(shape, geotransform, start_x, start_y, end_x, end_y, quads):
+    """
+    For each quad in quads, batches (i, rows, cols, u, v) of the cells of a
+    (rows, cols) grid in its bounding box: rows and cols are slices and
+    (u, v) the quad coordinates of the cell centres, NaN outside the quad.
+    """
+    rows, cols = shape
+    origin_x, pixel_size_x, _, origin_y, _, neg_pixel_size_y = geotransform
+    pixel_size_y = -neg_pixel_size_y
+
+    for i in quads:
+        ax, ay, dx, dy = start_x[i], start_y[i], end_x[i], end_y[i]
+        bx, by, cx, cy = start_x[i + 1], start_y[i + 1], end_x[i + 1], end_y[i + 1]
+
+        xs = (ax, bx, cx, dx)
+        ys = (ay, by, cy, dy)
+        c0 = max(int(np.floor((min(xs) - origin_x) / pixel_size_x)), 0)
+        c1 = min(int(np.ceil((max(xs) - origin_x) / pixel_size_x)), cols - 1)
+        r0 = max(int(np.floor((origin_y - max(ys)) / pixel_size_y)), 0)
+        r1 = min(int(np.ceil((origin_y - min(ys)) / pixel_size_y)), rows - 1)
+        if c0 > c1 or r0 > r1:
+            continue
+
+        width = c1 - c0 + 1
+        rows_per_batch = max(QUAD_BATCH_CELLS // width, 1)
+        cell_x = origin_x + (np.arange(c0, c1 + 1) + 0.5) * pixel_size_x
+
+        for rb in range(r0, r1 + 1, rows_per_batch):
+            re = min(rb + rows_per_batch, r1 + 1)
+            cell_y = origin_y - (np.arange(rb, re) + 0.5) * pixel_size_y
+            px, py = np.meshgrid(cell_x, cell_y)
+            u, v = inverse_bilinear(px, py, ax, ay, bx, by, cx, cy, dx, dy)
+            yield i, slice(rb, re), slice(c0, c1 + 1), u, v
+
+
+def _as_float_arrays(*arrays):
+    return [np.asarray(array, dtype=np.float64) for array in arrays]
+
+
+def render_envelope_surface(result_array, geotransform, start_x, start_y, end_x, end_y,
+                            start_z, tan_slope, no_data, breaks=None, quads=None):
+    """
+    Fill result_array (in place) with the stable surface between consecutive
+    profiles.
+
+    Each cell centre inside the quad formed by profiles i and i + 1 gets
+
+        z = z0(u) - d(u, v) * tan(slope)
+
+    where z0 is the start elevation interpolated along-shore and d the
+    distance from Line A, interpolated from the two profile lengths. Cells
+    covered by more than one quad keep the first value, following profile
+    order, as the rasterized traces do. Cells outside every quad are left
+    untouched.
+
+    breaks: optional boolean array, True at i when profiles i and i + 1
+    belong to different parts of Line A and must not be joined.
+    quads: optional increasing indices of the only quads to render (e.g.
+    from quads_in_window); breaks is not applied to them.
+
+    Returns the number of cells written.
+    """
+    start_x, start_y, end_x, end_y, start_z = _as_float_arrays(start_x, start_y, end_x, end_y, start_z)
+    lengths = np.hypot(end_x - start_x, end_y - start_y)
+    if quads is None:
+        quads = joined_quads(start_x.size, breaks)
+
+    cells_written = 0
+    for i, rows, cols, u, v in _quad_cells(result_array.shape, geotransform,
+                                           start_x, start_y, end_x, end_y, quads):
+        window = result_array[rows, cols]
+        hit = ~np.isnan(u) & (window == no_data)
+        if not hit.any():
+            continue
+
+        uu = u[hit]
+        vv = v[hit]
+        z0 = (1 - uu) * start_z[i] + uu * start_z[i + 1]
+        dist = vv * ((1 - uu) * lengths[i] + uu * lengths[i + 1])
+        window[hit] = (z0 - dist * tan_slope).astype(result_array.dtype)
+        cells_written += int(np.count_nonzero(hit))
+
+    return cells_written
+
+
+
+def render_envelope_terms(shape, geotransform, start_x, start_y, end_x, end_y, start_z,
+                          quads):
+    """
+    (z0, distance, hit) on a grid of the given shape in one pass over quads:
+    the along-shore start elevation and the distance from Line A of the
+    surface above (NaN outside every quad) and the mask of covered cells.
+    Same first-quad-wins rule as render_envelope_surface, so
+    z0 - distance * tan(slope) equals its output on every hit cell.
+    """
+    start_x, start_y, end_x, end_y, start_z = _as_float_arrays(start_x, start_y, end_x, end_y, start_z)
+    lengths = np.hypot(end_x - start_x, end_y - start_y)
+    z0 = np.full(shape, np.nan, dtype=np.float64)
+    distance = np.full(shape, np.nan, dtype=np.float64)
+    covered = np.zeros(shape, dtype=bool)
+
+    for i, rows, cols, u, v in _quad_cells(shape, geotransform, start_x, start_y, end_x, end_y, quads):
+        hit = ~np.isnan(u) & ~covered[rows, cols]
+        if not hit.any():
+            continue
+        uu = u[hit]
+        vv = v[hit]
+        z0[rows, cols][hit] = (1 - uu) * start_z[i] + uu * start_z[i + 1]
+        distance[rows, cols][hit] = vv * ((1 - uu) * lengths[i] + uu * lengths[i + 1])
+        covered[rows, cols][hit] = True
+
+    return z0, distance, covered
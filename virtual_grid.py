@@ -0,0 +1,298 @@
+"""
+Raster-aligned virtual calculation grid.
+
+Instead of one polygon per cell, a virtual grid is stored as what defines
+it:
+
+- <grid>.json: origin, cell size, rows, cols and projection
+- <grid>_ids.tif: cell-id raster, one Int32 pixel per cell, NO_CELL where
+  the grid has no cell (outside the mask with only_overlap)
+- <grid>_cells.csv: the attributes of every cell, keyed by id
+
+The cells are snapped to the pixel lattice of the stable DEM: the cell
+size is a whole number of DEM pixels and the cell corners fall on pixel
+corners, so the id raster overlays the DEM exactly. Cell polygons are only
+built when asked for, for some ids or an extent (materialize_cells).
+"""
+import csv
+import json
+import math
+import os
+
+import numpy as np
+from osgeo import gdal
+
+from .grid_cells import row_columns, write_cells
+from .grid_volumes import VOLUME_FIELDS
+from .raster_io import TILE_ALIGNMENT, TiledGeoTiffWriter
+
+
+# Valor do raster de ids onde não há célula
+NO_CELL = 0
+
+CELL_FIELDS = ('id', 'row', 'col', 'centroid_x', 'centroid_y', 'area')
+
+# Folga ao encaixar a extensão na malha de pixels
+_SNAP_TOLERANCE = 1e-9
+
+
+def virtual_grid_paths(definition_path):
+    """Files of the virtual grid whose definition is at definition_path."""
+    base = os.path.splitext(definition_path)[0]
+    return {
+        'definition': definition_path,
+        'ids': f"{base}_ids.tif",
+        'cells': f"{base}_cells.csv",
+    }
+
+
+class VirtualGrid:
+    """
+    rows x cols square cells whose lower left corner is (origin_x, origin_y).
+    Rows are counted from the top, as in the id raster, and the id of a
+    cell is row * cols + col + 1, so ids never depend on which cells exist.
+    """
+
+    def __init__(self, origin_x, origin_y, cell_size, rows, cols, projection=''):
+        self.origin_x = origin_x
+        self.origin_y = origin_y
+        self.cell_size = cell_size
+        self.rows = rows
+        self.cols = cols
+        self.projection = projection
+
+    @classmethod
+    def aligned(cls, extent, cell_size, geotransform, projection=''):
+        """
+        Grid covering extent (x_min, y_min, x_max, y_max) on the pixel
+        lattice of a raster with geotransform. cell_size is rounded to a
+        whole number of pixels, at least one.
+        """
+        if geotransform[2] != 0 or geotransform[4] != 0:
+            raise ValueError("Rotated raster geotransforms are not supported")
+        pixel_size = geotransform[1]
+        if not math.isclose(pixel_size, -geotransform[5], rel_tol=1e-9):
+            raise ValueError("A raster-aligned grid needs square pixels")
+        size = max(int(round(cell_size / pixel_size)), 1) * pixel_size
+
+        x_min, y_min, x_max, y_max = extent
+        first_col = math.floor((x_min - geotransform[0]) / size + _SNAP_TOLERANCE)
+        first_row = math.floor((geotransform[3] - y_max) / size + _SNAP_TOLERANCE)
+        origin_x = geotransform[0] + first_col * size
+        top = geotransform[3] - first_row * size
+        cols = max(math.ceil((x_max - origin_x) / size - _SNAP_TOLERANCE), 1)
+        rows = max(math.ceil((top - y_min) / size - _SNAP_TOLERANCE), 1)
+        return cls(origin_x, top - rows * size, size, rows, cols, projection)
+
+    @property
+    def top(self):
+        return self.origin_y + self.rows * self.cell_size
+
+    @property
+    def geotransform(self):
+        return [self.origin_x, self.cell_size, 0, self.top, 0, -self.cell_size]
+
+    def cell_ids(self, rows, cols):
+        return np.asarray(rows, dtype=np.int64) * self.cols + np.asarray(cols, dtype=np.int64) + 1
+
+    def rows_cols(self, ids):
+        return np.divmod(np.asarray(ids, dtype=np.int64) - 1, self.cols)
+
+    def lower_left(self, rows, cols):
+        """(x_min, y_min) of cells."""
+        return (self.origin_x + np.asarray(cols) * self.cell_size,
+                self.top - (np.asarray(rows) + 1) * self.cell_size)
+
+    def window(self, extent):
+        """
+        (row_off, col_off, height, width) of the cells that touch extent
+        (x_min, y_min, x_max, y_max), None when it misses the grid.
+        """
+        x_min, y_min, x_max, y_max = extent
+        col0 = max(math.ceil((x_min - self.origin_x) / self.cell_size) - 1, 0)
+        col1 = min(math.floor((x_max - self.origin_x) / self.cell_size), self.cols - 1)
+        row0 = max(math.ceil((self.top - y_max) / self.cell_size) - 1, 0)
+        row1 = min(math.floor((self.top - y_min) / self.cell_size), self.rows - 1)
+        if col0 > col1 or row0 > row1:
+            return None
+        return row0, col0, row1 - row0 + 1, col1 - col0 + 1
+
+    def to_dict(self):
+        return {
+            'origin_x': self.origin_x,
+            'origin_y': self.origin_y,
+            'cell_size': self.cell_size,
+            'rows': self.rows,
+            'cols': self.cols,
+            'projection': self.projection,
+        }
+
+
+def aligned_grid(extent, cell_size, raster_path):
+    """VirtualGrid over extent snapped to the pixels of the raster at raster_path."""
+    ds = gdal.Open(raster_path, gdal.GA_ReadOnly)
+    if ds is None:
+        raise IOError(f"Could not open raster: {raster_path}")
+    grid = VirtualGrid.aligned(extent, cell_size, ds.GetGeoTransform(), ds.GetProjection())
+    ds = None
+    return grid
+
+
+def load_virtual_grid(definition_path):
+    """(VirtualGrid, definition dict) of a virtual grid written by write_virtual_grid."""
+    with open(definition_path, encoding='utf-8') as f:
+        definition = json.load(f)
+    grid = VirtualGrid(definition['origin_x'], definition['origin_y'], definition['cell_size'],
+                       definition['rows'], definition['cols'], definition.get('projection', ''))
+    return grid, definition
+
+
+def write_virtual_grid(definition_path, grid, polygons, only_overlap=False, volumes=None,
+                       strip_rows=TILE_ALIGNMENT, progress=None):
+    """
+    Write the definition, id raster and cell table of grid. polygons are
+    the mask's closed rings (see grid_cells.row_columns), used with
+    only_overlap. volumes: GridVolumes of the same grid (its rows count
+    from the bottom), whose VOLUME_FIELDS are added to the table.
+
+    The id raster is written in strips of strip_rows rows, top down, and
+    the table row by row, so memory does not grow with the grid.
+    progress: optional callable(rows_done, rows). Returns the number of cells.
+    """
+    if grid.rows * grid.cols >= 2**31:
+        raise ValueError("Too many cells for an Int32 id raster; use a larger cell size")
+    paths = virtual_grid_paths(definition_path)
+    fields = list(CELL_FIELDS) + (list(VOLUME_FIELDS) if volumes is not None else [])
+    area = grid.cell_size * grid.cell_size
+    half = grid.cell_size / 2
+    origin_y = grid.origin_y
+
+    count = 0
+    writer = TiledGeoTiffWriter(paths['ids'], grid.cols, grid.rows, grid.geotransform, grid.projection,
+                                NO_CELL, sparse=True, data_type=gdal.GDT_Int32)
+    try:
+        with open(paths['cells'], 'w', newline='', encoding='utf-8') as f:
+            table = csv.writer(f)
+            table.writerow(fields)
+            for strip_row in range(0, grid.rows, strip_rows):
+                if progress is not None:
+                    progress(strip_row, grid.rows)
+                height = min(strip_rows, grid.rows - strip_row)
+                strip = np.full((height, grid.cols), NO_CELL, dtype=np.int32)
+                # row_columns conta as linhas de baixo para cima
+                bottom_rows = [grid.rows - 1 - row for row in range(strip_row, strip_row + height)]
+                for bottom_row, columns in row_columns(polygons, grid.origin_x, origin_y, grid.cell_size,
+                                                       grid.rows, grid.cols, only_overlap, bottom_rows):
+                    if columns.size == 0:
+                        continue
+                    row = grid.rows - 1 - bottom_row
+                    ids = grid.cell_ids(row, columns)
+                    strip[row - strip_row, columns] = ids
+                    centre_x = grid.origin_x + columns * grid.cell_size + half
+                    centre_y = origin_y + bottom_row * grid.cell_size + half
+                    columns_out = [ids.tolist(), [row] * columns.size, columns.tolist(),
+                                   centre_x.tolist(), [centre_y] * columns.size, [area] * columns.size]
+                    if volumes is not None:
+                        columns_out += [
+                            np.round(values[bottom_row, columns], 4).tolist()
+                            for values in (volumes.covered, volumes.coverage, volumes.fill,
+                                           volumes.cut, volumes.net)
+                        ]
+                    table.writerows(zip(*columns_out))
+                    count += columns.size
+                writer.write_tile(strip, strip_row, 0)
+    finally:
+        writer.close()
+
+    definition = dict(grid.to_dict(), only_overlap=only_overlap, cells=count, fields=fields,
+                      ids_raster=os.path.basename(paths['ids']),
+                      cell_table=os.path.basename(paths['cells']))
+    with open(definition_path, 'w', encoding='utf-8') as f:
+        json.dump(definition, f, indent=2)
+    if progress is not None:
+        progress(grid.rows, grid.rows)
+    return count
+
+
+def _in_window(grid, ids, window):
+    rows, cols = grid.rows_cols(ids)
+    row_off, col_off, height, width = window
+    return ((rows >= row_off) & (rows < row_off + height) &
+            (cols >= col_off) & (cols < col_off + width))
+
+
+def select_cells(definition_path, ids=None, extent=None):
+    """
+    Sorted ids of the existing cells of a virtual grid that are in ids
+    and / or touch extent (x_min, y_min, x_max, y_max), all of them when
+    neither is given. Existence is checked against the id raster.
+    """
+    grid, _ = load_virtual_grid(definition_path)
+    window = (0, 0, grid.rows, grid.cols)
+    if extent is not None:
+        window = grid.window(extent)
+        if window is None:
+            return np.empty(0, dtype=np.int64)
+
+    ds = gdal.Open(virtual_grid_paths(definition_path)['ids'], gdal.GA_ReadOnly)
+    if ds is None:
+        raise IOError(f"Could not open the id raster of {definition_path}")
+    band = ds.GetRasterBand(1)
+    if ids is None:
+        row_off, col_off, height, width = window
+        existing = band.ReadAsArray(col_off, row_off, width, height).astype(np.int64)
+        ds = None
+        return np.sort(existing[existing != NO_CELL])
+
+    ids = np.unique(np.asarray(ids, dtype=np.int64))
+    ids = ids[(ids >= 1) & (ids <= grid.rows * grid.cols)]
+    ids = ids[_in_window(grid, ids, window)]
+    rows, cols = grid.rows_cols(ids)
+    keep = np.zeros(ids.size, dtype=bool)
+    # Ids ordenados: as células de cada linha são contíguas
+    bounds = np.flatnonzero(np.diff(rows)) + 1
+    for lo, hi in zip(np.concatenate(([0], bounds)), np.concatenate((bounds, [ids.size]))):
+        if lo == hi:
+            continue
+        col0, col1 = int(cols[lo]), int(cols[hi - 1])
+        line = band.ReadAsArray(col0, int(rows[lo]), col1 - col0 + 1, 1)[0]
+        keep[lo:hi] = line[cols[lo:hi] - col0] == ids[lo:hi]
+    ds = None
+    return ids[keep]
+
+
+def cell_table_values(definition_path, ids, fields):
+    """
+    Values of fields from the cell table for the sorted ids, one list per
+    id (NaN where an id is missing). The table is streamed, not loaded.
+    """
+    values = np.full((ids.size, len(fields)), np.nan)
+    if ids.size == 0 or not fields:
+        return values
+    with open(virtual_grid_paths(definition_path)['cells'], newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        columns = [header.index(name) for name in fields]
+        for record in reader:
+            k = np.searchsorted(ids, int(record[0]))
+            if k < ids.size and ids[k] == int(record[0]):
+                values[k] = [float(record[c]) for c in columns]
+    return values
+
+
+def materialize_cells(definition_path, output_path, ids=None, extent=None):
+    """
+    Write the polygons of the cells in ids and / or touching extent (all
+    cells when neither is given) as a shapefile, with the grid attributes
+    and any volume fields of the cell table. Returns the number of cells.
+    """
+    grid, definition = load_virtual_grid(definition_path)
+    selected = select_cells(definition_path, ids, extent)
+    extra_fields = [name for name in definition.get('fields', []) if name in VOLUME_FIELDS]
+    values = None
+    if extra_fields:
+        values = cell_table_values(definition_path, selected, extra_fields).tolist()
+    rows, cols = grid.rows_cols(selected)
+    x_min, y_min = grid.lower_left(rows, cols)
+    return write_cells(output_path, selected, x_min.astype(np.float64), y_min.astype(np.float64),
+                       grid.cell_size, grid.projection, extra_fields, values)
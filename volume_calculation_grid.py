@@ -6,13 +6,22 @@ from qgis.core import (
     QgsGeometry,
     QgsPointXY,
     QgsProject,
+    QgsRasterLayer,
+    QgsRectangle,
     QgsWkbTypes,
     QgsVectorFileWriter,
     QgsCoordinateReferenceSystem
 )
 from qgis.PyQt.QtCore import QVariant
+from osgeo import gdal
 import os
 
+from .geopackage import layer_display_name, layer_file, layer_path, raster_table_path, split_layer_path
+from .grid_cells import row_columns, write_grid
+from .grid_volumes import VOLUME_FIELDS, grid_cell_volumes
+from .run_report import RunCancelled
+from .virtual_grid import aligned_grid, materialize_cells, virtual_grid_paths, write_virtual_grid
+
 def find_mask_layer():
     """Encontra a layer que termina com '_mask' no projeto"""
     for layer in QgsProject.instance().mapLayers().values():
@@ -20,9 +29,194 @@ def find_mask_layer():
             return layer
     return None
 
-def generate_grid(mask_layer, cell_size, only_overlap=False):
+def find_stable_surface(mask_layer):
+    """
+    Superfície estável gerada com a máscara: <name>_surface_cropped.tif, ou
+    <name>_surface.tif se não houver recorte. None if neither exists.
+    For a mask in a GeoPackage, the same tables of that GeoPackage.
+    """
+    container_path, mask_table = split_layer_path(mask_layer.source())
+    if mask_table is not None:
+        base_table = mask_table[:-len('_mask')] if mask_table.endswith('_mask') else mask_table
+        for suffix in ('_surface_cropped', '_surface'):
+            source = raster_table_path(container_path, base_table + suffix)
+            if gdal.Open(source) is not None:
+                return source
+        return None
+
+    base_path = mask_layer.source().split('|')[0]
+    if base_path.endswith('_mask.shp'):
+        base_path = base_path[:-len('_mask.shp')]
+    for suffix in ('_surface_cropped.tif', '_surface.tif'):
+        if os.path.exists(base_path + suffix):
+            return base_path + suffix
+    return None
+
+
+def grid_fields(volumes=False):
+    """Campos da grade: id, centroide e área da célula, e os volumes se pedidos"""
+    fields = QgsFields()
+    fields.append(QgsField("id", QVariant.Int))
+    fields.append(QgsField("centroid_x", QVariant.Double))
+    fields.append(QgsField("centroid_y", QVariant.Double))
+    fields.append(QgsField("area", QVariant.Double))
+    if volumes:
+        for name in VOLUME_FIELDS:
+            fields.append(QgsField(name, QVariant.Double))
+    return fields
+
+
+def grid_layout(extent, cell_size):
+    """(origin_x, origin_y, rows, cols) of the grid over extent; row 0 is the bottom row."""
+    cols = int((extent.xMaximum() - extent.xMinimum()) / cell_size) + 1
+    rows = int((extent.yMaximum() - extent.yMinimum()) / cell_size) + 1
+    return extent.xMinimum(), extent.yMinimum(), rows, cols
+
+
+def compute_grid_volumes(extent, cell_size, surface_path, dem_path, feedback=None):
+    """
+    Volumes de corte e aterro de cada célula da grade sobre extent, entre a
+    superfície estável e o DEM (see grid_volumes). Returns a GridVolumes.
+    Raises RunCancelled when feedback is cancelled.
+    """
+    origin_x, origin_y, rows, cols = grid_layout(extent, cell_size)
+    return grid_cell_volumes(surface_path, dem_path, origin_x, origin_y, cell_size, rows, cols,
+                             progress=volume_progress(feedback))
+
+
+def volume_progress(feedback):
+    """
+    Progress callback of grid_cell_volumes for feedback: the first half of
+    the progress bar, raising RunCancelled once feedback is cancelled.
+    """
+    def progress(done, total):
+        if feedback is not None:
+            if feedback.isCanceled():
+                raise RunCancelled("Grid generation cancelled")
+            feedback.setProgress(50.0 * done / total if total else 50.0)
+    return progress
+
+
+def grid_output_path(mask_layer, virtual=False):
+    """
+    Default grid output of a mask: <mask>_grid.shp next to it (the
+    <mask>_grid table for a mask in a GeoPackage), or the <mask>_grid.json
+    definition of a virtual grid.
+    """
+    base_path = os.path.dirname(layer_file(mask_layer.source()))
+    base_name = layer_display_name(mask_layer.source())
+    if virtual:
+        return os.path.join(base_path, f"{base_name}_grid.json")
+    container_path, mask_table = split_layer_path(mask_layer.source())
+    if mask_table is not None:
+        return layer_path(container_path, f"{base_name}_grid")
+    return os.path.join(base_path, f"{base_name}_grid.shp")
+
+
+def load_grid_layers(output_path, virtual=False):
+    """
+    Add a generated grid to the project: the grid layer, or the id raster
+    and cell table of a virtual grid. Must run on the main thread.
+    Returns (success, message).
+    """
+    name = layer_display_name(output_path)
+    if not virtual:
+        grid_layer = QgsVectorLayer(output_path, name, "ogr")
+        if not grid_layer.isValid():
+            return False, "Error loading generated grid"
+        QgsProject.instance().addMapLayer(grid_layer)
+        return True, "Grid loaded"
+
+    # Raster de ids e tabela de atributos
+    paths = virtual_grid_paths(output_path)
+    ids_layer = QgsRasterLayer(paths['ids'], f"{name}_ids")
+    cells_layer = QgsVectorLayer(f"file:///{paths['cells']}?type=csv&geomType=none",
+                                 f"{name}_cells", "delimitedtext")
+    if not ids_layer.isValid():
+        return False, "Error loading the grid id raster"
+    QgsProject.instance().addMapLayer(ids_layer)
+    if cells_layer.isValid():
+        QgsProject.instance().addMapLayer(cells_layer)
+    return True, "Virtual grid loaded"
+
+
+def mask_polygons(geometries):
+    """
+    Polígonos da máscara como listas de anéis fechados (xs, ys), for
+    grid_cells. geometries: a QgsGeometry or a list of them (one per mask
+    feature).
+    """
+    if isinstance(geometries, QgsGeometry):
+        geometries = [geometries]
+    polygons = []
+    for geometry in geometries:
+        if geometry is None or geometry.isEmpty():
+            continue
+        parts = geometry.asMultiPolygon() if geometry.isMultipart() else [geometry.asPolygon()]
+        for rings in parts:
+            polygons.append([([p.x() for p in ring], [p.y() for p in ring]) for ring in rings])
+    return polygons
+
+
+def grid_features(extent, mask_geom, cell_size, only_overlap=False, feedback=None, volumes=None):
+    """
+    Gera as células da grade (QgsFeature) sobre extent, linha a linha.
+    Stops early when feedback is cancelled.
+
+    mask_geom: mask QgsGeometry, or a list of them (every mask feature).
+    The overlapping cells of each row come from the mask's intervals along
+    that row (see grid_cells.row_columns) and the centroids are the cell
+    centres, so no geometry test is made per cell.
+
+    volumes: GridVolumes of the same grid (see compute_grid_volumes); its
+    per-cell values are appended to the attributes (grid_fields(True)).
+    """
+    origin_x, origin_y, rows, cols = grid_layout(extent, cell_size)
+    polygons = mask_polygons(mask_geom) if only_overlap else []
+    area = cell_size * cell_size
+
+    cell_id = 1
+    for row, columns in row_columns(polygons, origin_x, origin_y, cell_size, rows, cols, only_overlap):
+        if feedback is not None:
+            if feedback.isCanceled():
+                return
+            feedback.setProgress(100.0 * row / rows)
+        y_min = origin_y + row * cell_size
+        for col in columns.tolist():
+            x_min = origin_x + col * cell_size
+
+            # Criar feature
+            feat = QgsFeature()
+            feat.setGeometry(QgsGeometry.fromRect(QgsRectangle(x_min, y_min, x_min + cell_size, y_min + cell_size)))
+
+            # Definir atributos; o centroide é o centro da célula
+            attributes = [
+                cell_id,
+                x_min + cell_size / 2,
+                y_min + cell_size / 2,
+                area
+            ]
+            if volumes is not None:
+                attributes.extend(volumes.attributes(row, col))
+            feat.setAttributes(attributes)
+
+            yield feat
+            cell_id += 1
+
+
+def generate_grid(mask_layer, cell_size, only_overlap=False, output_path=None, load_layer=True, feedback=None,
+                  dem_path=None, surface_path=None):
     """
     Gera uma grade de polígonos baseada na extensão da máscara
+
+    output_path defaults to <mask>_grid.shp next to the mask, or to the
+    <mask>_grid table when the mask is in a GeoPackage. With load_layer
+    False the grid is not added to the project.
+
+    With dem_path, every cell also gets its cut / fill volume between the
+    stable surface (surface_path, by default the one found next to the
+    mask) and that DEM, and the totals are written to
+    <grid>_volumes.json and returned in the message.
     """
     try:
         if not mask_layer:
@@ -30,97 +224,157 @@ def generate_grid(mask_layer, cell_size, only_overlap=False):
 
         # Obter extensão da máscara
         extent = mask_layer.extent()
-        
-        # Calcular número de células em cada direção
-        cols = int((extent.xMaximum() - extent.xMinimum()) / cell_size) + 1
-        rows = int((extent.yMaximum() - extent.yMinimum()) / cell_size) + 1
 
         # Preparar o nome do arquivo de saída
-        base_path = os.path.dirname(mask_layer.source())
-        base_name = os.path.splitext(os.path.basename(mask_layer.source()))[0]
-        output_path = os.path.join(base_path, f"{base_name}_grid.shp")
-
-        # Definir campos
-        fields = QgsFields()
-        fields.append(QgsField("id", QVariant.Int))
-        fields.append(QgsField("centroid_x", QVariant.Double))
-        fields.append(QgsField("centroid_y", QVariant.Double))
-        fields.append(QgsField("area", QVariant.Double))
-
-        # Criar writer para o shapefile
-        writer = QgsVectorFileWriter(
-            output_path,
-            "UTF-8",
-            fields,
-            QgsWkbTypes.Polygon,
-            mask_layer.crs(),
-            "ESRI Shapefile"
-        )
-
-        if writer.hasError() != QgsVectorFileWriter.NoError:
-            return False, f"Error creating grid file: {writer.errorMessage()}"
-
-        # Criar células
-        cell_id = 1
-        mask_geom = next(mask_layer.getFeatures()).geometry()
-
-        features = []  # Lista para armazenar todas as features
-        for row in range(rows):
-            for col in range(cols):
-                # Calcular coordenadas da célula
-                x_min = extent.xMinimum() + col * cell_size
-                x_max = x_min + cell_size
-                y_min = extent.yMinimum() + row * cell_size
-                y_max = y_min + cell_size
-
-                # Criar geometria da célula
-                points = [
-                    QgsPointXY(x_min, y_min),
-                    QgsPointXY(x_max, y_min),
-                    QgsPointXY(x_max, y_max),
-                    QgsPointXY(x_min, y_max),
-                    QgsPointXY(x_min, y_min)
-                ]
-                cell_geom = QgsGeometry.fromPolygonXY([points])
-
-                # Se only_overlap está ativo, verificar interseção
-                if only_overlap and not cell_geom.intersects(mask_geom):
-                    continue
-
-                # Criar feature
-                feat = QgsFeature()
-                feat.setGeometry(cell_geom)
-
-                # Calcular centroide
-                centroid = cell_geom.centroid().asPoint()
-
-                # Definir atributos
-                feat.setAttributes([
-                    cell_id,
-                    centroid.x(),
-                    centroid.y(),
-                    cell_size * cell_size
-                ])
-
-                # Adicionar feature à lista
-                features.append(feat)
-                cell_id += 1
-
-        # Adicionar todas as features de uma vez
-        writer.addFeatures(features)
-
-        # Limpar o writer
-        del writer
+        if output_path is None:
+            output_path = grid_output_path(mask_layer)
+
+        volumes = None
+        if dem_path:
+            surface_path = surface_path or find_stable_surface(mask_layer)
+            if not surface_path:
+                return False, "Stable surface not found next to the mask layer"
+            print(f"Computing grid volumes between {surface_path} and {dem_path}")
+            volumes = compute_grid_volumes(extent, cell_size, surface_path, dem_path, feedback)
+
+        # Todos os polígonos da máscara (um por par de linhas)
+        polygons = mask_polygons([feat.geometry() for feat in mask_layer.getFeatures()])
+        origin_x, origin_y, rows, cols = grid_layout(extent, cell_size)
+
+        def progress(done, total):
+            if feedback is not None:
+                if feedback.isCanceled():
+                    raise RunCancelled("Grid generation cancelled")
+                feedback.setProgress(100.0 * done / total if total else 100.0)
+
+        # Células escritas em lotes, cada lote numa transação
+        written = write_grid(output_path, polygons, origin_x, origin_y, cell_size, rows, cols,
+                             mask_layer.crs().toWkt(), only_overlap, volumes, progress=progress)
+        print(f"Grid of {written} cells written to {output_path}")
+
+        message = "Grid generated successfully"
+        if volumes is not None:
+            summary_path = volumes.write_summary(
+                os.path.join(os.path.dirname(layer_file(output_path)),
+                             f"{layer_display_name(output_path)}_volumes.json"),
+                surface=surface_path, dem=dem_path
+            )
+            totals = volumes.summary()
+            print(f"Grid volumes written to {summary_path}: {totals}")
+            message = (f"Grid generated: fill {totals['fill']:.1f}, cut {totals['cut']:.1f}, "
+                       f"net {totals['net']:.1f} over {totals['covered_area']:.1f} m²")
+        if not load_layer:
+            return True, message
 
         # Carregar a nova camada no QGIS
-        grid_layer = QgsVectorLayer(output_path, f"{base_name}_grid", "ogr")
-        if grid_layer.isValid():
-            QgsProject.instance().addMapLayer(grid_layer)
-            return True, "Grid generated successfully"
-        else:
-            return False, "Error loading generated grid"
+        loaded, error = load_grid_layers(output_path)
+        return (True, message) if loaded else (False, error)
+
+    except RunCancelled as e:
+        return False, str(e)
 
     except Exception as e:
         import traceback
         error_msg = f"Error generating grid: {str(e)}\n{traceback.format_exc()}"
-        return False, error_msg
\ No newline at end of file
+        return False, error_msg
+
+
+def generate_virtual_grid(mask_layer, cell_size, only_overlap=False, output_path=None, load_layer=True,
+                          feedback=None, dem_path=None, surface_path=None):
+    """
+    Gera a grade virtual alinhada aos pixels da superfície estável (see
+    virtual_grid): <grid>.json, the <grid>_ids.tif cell-id raster and the
+    <grid>_cells.csv attribute table, with no polygons.
+
+    output_path is the definition, <mask>_grid.json by default. The cell
+    size is rounded to a whole number of surface pixels. With dem_path the
+    table also gets the cut / fill volumes, as in generate_grid.
+    """
+    try:
+        if not mask_layer:
+            return False, "Mask layer not found"
+
+        surface_path = surface_path or find_stable_surface(mask_layer)
+        if not surface_path:
+            return False, "Stable surface not found next to the mask layer"
+
+        extent = mask_layer.extent()
+        if output_path is None:
+            output_path = grid_output_path(mask_layer, virtual=True)
+
+        # Grade encaixada na malha de pixels da superfície
+        grid = aligned_grid((extent.xMinimum(), extent.yMinimum(), extent.xMaximum(), extent.yMaximum()),
+                            cell_size, surface_path)
+        if not grid.projection:
+            grid.projection = mask_layer.crs().toWkt()
+        print(f"Virtual grid of {grid.rows}x{grid.cols} cells of {grid.cell_size} m aligned to {surface_path}")
+
+        volumes = None
+        if dem_path:
+            print(f"Computing grid volumes between {surface_path} and {dem_path}")
+            volumes = grid_cell_volumes(surface_path, dem_path, grid.origin_x, grid.origin_y, grid.cell_size,
+                                        grid.rows, grid.cols, progress=volume_progress(feedback))
+
+        polygons = mask_polygons([feat.geometry() for feat in mask_layer.getFeatures()])
+
+        def progress(done, total):
+            if feedback is not None:
+                if feedback.isCanceled():
+                    raise RunCancelled("Grid generation cancelled")
+                feedback.setProgress(100.0 * done / total if total else 100.0)
+
+        count = write_virtual_grid(output_path, grid, polygons, only_overlap, volumes, progress=progress)
+        print(f"Virtual grid of {count} cells written to {output_path}")
+
+        message = f"Virtual grid of {count} cells generated"
+        if volumes is not None:
+            volumes.write_summary(f"{os.path.splitext(output_path)[0]}_volumes.json",
+                                  surface=surface_path, dem=dem_path)
+            totals = volumes.summary()
+            message = (f"Virtual grid generated: fill {totals['fill']:.1f}, cut {totals['cut']:.1f}, "
+                       f"net {totals['net']:.1f} over {totals['covered_area']:.1f} m²")
+        if not load_layer:
+            return True, message
+
+        loaded, error = load_grid_layers(output_path, virtual=True)
+        return (True, message) if loaded else (False, error)
+
+    except RunCancelled as e:
+        return False, str(e)
+
+    except Exception as e:
+        import traceback
+        error_msg = f"Error generating virtual grid: {str(e)}\n{traceback.format_exc()}"
+        return False, error_msg
+
+
+def materialize_grid_cells(definition_path, extent=None, ids=None, output_path=None, load_layer=True):
+    """
+    Polígonos das células de uma grade virtual, só os pedidos: the cells
+    in ids and / or touching extent (a QgsRectangle in the grid's CRS).
+    output_path defaults to <grid>_selection.shp, replaced on every call.
+    """
+    try:
+        if output_path is None:
+            output_path = f"{os.path.splitext(definition_path)[0]}_selection.shp"
+        bounds = None
+        if extent is not None:
+            bounds = (extent.xMinimum(), extent.yMinimum(), extent.xMaximum(), extent.yMaximum())
+        count = materialize_cells(definition_path, output_path, ids=ids, extent=bounds)
+        print(f"{count} grid cells written to {output_path}")
+        if count == 0:
+            return False, "No grid cells in the selection"
+        if not load_layer:
+            return True, f"{count} grid cells built"
+
+        name = os.path.splitext(os.path.basename(output_path))[0]
+        layer = QgsVectorLayer(output_path, name, "ogr")
+        if not layer.isValid():
+            return False, "Error loading the grid cells"
+        QgsProject.instance().addMapLayer(layer)
+        return True, f"{count} grid cells built"
+
+    except Exception as e:
+        import traceback
+        error_msg = f"Error building grid cells: {str(e)}\n{traceback.format_exc()}"
+        return False, error_msg